@@ -1,5 +1,10 @@
+import multiprocessing
+
 import fire
 
 from rift.server.core import main
 
-fire.Fire(main)
+if __name__ == "__main__":
+    # the workers of the diff process pool start by running this module again when frozen.
+    multiprocessing.freeze_support()
+    fire.Fire(main)
@@ -1,7 +1,8 @@
 import asyncio
 import logging
+import math
 from abc import ABC
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from enum import Enum
 from typing import Any, ClassVar, Dict, List, Optional, Type
 
@@ -12,6 +13,7 @@ import rift.lsp.types as lsp
 from rift.agents.agenttask import AgentTask
 from rift.llm.openai_types import Message as ChatMessage
 from rift.lsp import LspServer as BaseLspServer
+from rift.server.progress import ResponseDeltas, is_partial_response
 
 logger = logging.getLogger(__name__)
 
@@ -101,6 +103,7 @@ class Agent:
     tasks: List[AgentTask] = field(default_factory=list)
     task: Optional[AgentTask] = None
     params_cls: Type[AgentParams] = AgentParams
+    _response_deltas: ResponseDeltas = field(default_factory=ResponseDeltas, init=False, repr=False)
 
     # def get_display(self):
     #     """Get agent display information"""
@@ -183,7 +186,7 @@ class Agent:
         try:
             # request user responses/data from server
             response = await self.server.request(
-                f"morph/{self.agent_type}_{self.agent_id}_request_input", req
+                f"morph/{self.agent_type}_{self.agent_id}_request_input", req, timeout=math.inf
             )
             return response["response"]
         except Exception as e:  # return the response from the user
@@ -204,7 +207,7 @@ class Agent:
         """Send chat request"""
         try:
             response = await self.server.request(
-                f"morph/{self.agent_type}_{self.agent_id}_request_chat", req
+                f"morph/{self.agent_type}_{self.agent_id}_request_chat", req, timeout=math.inf
             )
             return response["message"].strip()
         except Exception as exception:
@@ -269,7 +272,20 @@ class Agent:
             logger.info(f"[error]: {self.task._task.exception()}")
 
         # logger.info(f"{progress=}")
-        await self.server.notify(f"morph/{self.agent_type}_{self.agent_id}_send_progress", progress)
+        encode = None
+        if getattr(self.server, "progress_deltas", False):
+            # encoded when sent, so that the deltas are relative to what the client has.
+            encode = self._encode_response_delta
+        # partial streamed responses are coalesced, everything else is delivered right away.
+        await self.server.notify_throttled(
+            f"morph/{self.agent_type}_{self.agent_id}_send_progress",
+            progress,
+            final=not is_partial_response(payload),
+            encode=encode,
+        )
+
+    def _encode_response_delta(self, progress: AgentProgress) -> AgentProgress:
+        return replace(progress, payload=self._response_deltas.encode(progress.payload))
 
     async def main(self):
         """
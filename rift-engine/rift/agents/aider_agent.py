@@ -106,7 +106,7 @@ class Aider(agent.ThirdPartyAgent):
         """
         return await self.server.apply_workspace_edit(
             lsp.ApplyWorkspaceEditParams(
-                file_diff.edits_from_file_changes(
+                await file_diff.edits_from_file_changes_async(
                     updates,
                     user_confirmation=True,
                 )
@@ -132,7 +132,10 @@ async def main(agent_cls, params):
         datefmt="[%X]",
         handlers=[RichHandler(console=console)],
     )
-    client: core.CodeCapabilitiesServer = core.create_metaserver(port=params.port)
+    # the edits go to the one editor that is connected.
+    client: core.CodeCapabilitiesServer = core.create_metaserver(
+        port=params.port, max_connections=1
+    )
     logger.info(f"started Rift server on port {params.port}")
     t = asyncio.create_task(client.run_forever())
 
@@ -168,7 +171,7 @@ async def main(agent_cls, params):
                 label = file_changes[0].description or label
             for file_change in file_changes:
                 agent_stats.stats["changed_files"].append(file_change.uri.uri)
-            resp = await client.server.apply_workspace_edit(
+            resp = await client.sessions.latest.server.apply_workspace_edit(
                 lsp.ApplyWorkspaceEditParams(
                     file_diff.edits_from_file_changes(file_changes, user_confirmation=True),
                     label=label,
@@ -102,7 +102,10 @@ async def main(params):
         datefmt="[%X]",
         handlers=[RichHandler(console=console)],
     )
-    client: core.CodeCapabilitiesServer = core.create_metaserver(port=params.port)
+    # the edits go to the one editor that is connected.
+    client: core.CodeCapabilitiesServer = core.create_metaserver(
+        port=params.port, max_connections=1
+    )
     logger.info(f"started Rift server on port {params.port}")
     t = asyncio.create_task(client.run_forever())
     await asyncio.sleep(2)
@@ -159,7 +162,7 @@ async def main(params):
         absolute_file_path = os.path.join(os.getcwd(), file_path)
         logger.info(f"Generating a diff for {absolute_file_path}")
         file_change = file_diff.get_file_change(path=absolute_file_path, new_content=code)
-        await client.server.apply_workspace_edit(
+        await client.sessions.latest.server.apply_workspace_edit(
             lsp.ApplyWorkspaceEditParams(
                 file_diff.edits_from_file_changes([file_change], user_confirmation=True),
                 label="rift",
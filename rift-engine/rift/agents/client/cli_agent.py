@@ -121,7 +121,10 @@ async def main(agent_cls, params):
         datefmt="[%X]",
         handlers=[RichHandler(console=console)],
     )
-    client: core.CodeCapabilitiesServer = core.create_metaserver(port=params.port)
+    # the edits go to the one editor that is connected.
+    client: core.CodeCapabilitiesServer = core.create_metaserver(
+        port=params.port, max_connections=1
+    )
     logger.info(f"started Rift server on port {params.port}")
     t = asyncio.create_task(client.run_forever())
     await asyncio.sleep(1)
@@ -133,7 +136,7 @@ async def main(agent_cls, params):
     agent = agent_cls(run_params=params, console=console)
 
     async for file_changes in agent.run():
-        await client.server.apply_workspace_edit(
+        await client.sessions.latest.server.apply_workspace_edit(
             lsp.ApplyWorkspaceEditParams(
                 file_diff.edits_from_file_changes(file_changes, user_confirmation=True),
                 label="rift",
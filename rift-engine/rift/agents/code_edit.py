@@ -10,8 +10,10 @@ import rift.lsp.types as lsp
 from rift.agents.abstract import AgentProgress  # AgentTask,
 from rift.agents.abstract import Agent, AgentParams, AgentRunResult, AgentState, RequestChatRequest
 from rift.llm.abstract import AbstractCodeEditProvider
+from rift.server.edit_stream import EditStream, offset_positions
 from rift.server.selection import RangeSet
 from rift.util.context import resolve_inline_uris
+from rift.util.line_diff import StreamingLineDiff
 from rift.util.TextStream import TextStream
 
 logger = logging.getLogger(__name__)
@@ -117,6 +119,7 @@ class CodeEditAgent(Agent):
                 uroffset_start = self.state.document.position_to_offset(self.state.selection.first)
                 uroffset_end = self.state.document.position_to_offset(self.state.selection.second)
 
+            edit_stream: Optional[EditStream] = None
             while True:
                 try:
                     # get the next prompt
@@ -127,9 +130,6 @@ class CodeEditAgent(Agent):
                         break
                     documents = resolve_inline_uris(instructionPrompt, self.server)
                     self.server.register_change_callback(self.on_change, self.state.document.uri)
-                    from diff_match_patch import diff_match_patch
-
-                    dmp = diff_match_patch()
                     edit_code_result = await self.state.model.edit_code(
                         urtext,
                         uroffset_start,
@@ -177,94 +177,59 @@ class CodeEditAgent(Agent):
                     logger.info("starting to iterate through text stream")
                     self.DIFF = None
 
-                    diff_queue = asyncio.Queue()
+                    async def on_flush(diff_text: str):
+                        self.RANGE = edit_stream.range
+                        diff = self.DIFF
+                        if diff is None or "".join(text for _, text in diff) != diff_text:
+                            # a newer diff is on its way
+                            return
+                        self.state.additive_ranges = RangeSet()
+                        self.state.negative_ranges = RangeSet()
+                        # positions of the diff boundaries relative to the start of the selection
+                        offsets = [0]
+                        for _, text in diff:
+                            offsets.append(offsets[-1] + len(text))
+                        positions = offset_positions(self.RANGE.start, diff_text, offsets)
+                        for (op, _), cursor, next_cursor in zip(diff, positions, positions[1:]):
+                            if op == -1:  # delete
+                                self.state.negative_ranges.add(lsp.Range(cursor, next_cursor))
+                            elif op == 0:  # keep
+                                pass
+                            elif op == 1:  # add
+                                self.state.additive_ranges.add(lsp.Range(cursor, next_cursor))
+
+                        progress = CodeEditProgress(
+                            response=None,
+                            textDocument=self.state.document,
+                            cursor=self.state.cursor,
+                            additive_ranges=list(self.state.additive_ranges),
+                            negative_ranges=list(self.state.negative_ranges),
+                        )
+                        await self.send_progress(progress)
 
-                    async def send_diff(new_text: str):
-                        fuel = 10
-                        while True:
-                            if self.state._done._value:
-                                break
-                            if fuel <= 0:
-                                raise Exception(":(")
-                            try:
-                                # diff = dmp.diff_lineMode(self.selection_text, new_text, None)
-                                # # dmp.diff_cleanupSemantic(diff)
-                                # dmp.diff_cleanupMerge
-
-                                (x, y, linearray) = dmp.diff_linesToChars(
-                                    self.selection_text, new_text
-                                )
-
-                                diff = dmp.diff_main(x, y, False)
-
-                                # Convert the diff back to original text.
-                                dmp.diff_charsToLines(diff, linearray)
-                                # Eliminate freak matches (e.g. blank lines)
-                                dmp.diff_cleanupSemantic(diff)
-
-                                self.DIFF = diff  # store the latest diff
-                                # logger.info(f"{diff=}")
-                                diff_text = "".join([text for _, text in diff])
-                                if diff_text == self.selection_text:
-                                    break
-                                # logger.info(f"{diff=}")
-
-                                cf = asyncio.get_running_loop().create_future()
-                                self.state.change_futures[diff_text] = cf
-
-                                await self.server.apply_range_edit(
-                                    self.state.document.uri, self.RANGE, diff_text
-                                )
-
-                                def add_pos_text(pos: lsp.Position, text: str):
-                                    line_delta = text.count("\n")
-                                    if line_delta == 0:
-                                        offset = pos.character + len(text)
-                                    else:
-                                        offset = list(reversed(text)).index("\n")
-                                    return lsp.Position(pos.line + line_delta, offset)
-
-                                self.RANGE = lsp.Range(
-                                    self.state.selection.first,
-                                    add_pos_text(self.state.selection.first, diff_text),
-                                )
-
-                                try:
-                                    await asyncio.wait_for(cf, timeout=2)
-                                    break
-                                except asyncio.TimeoutError:
-                                    break
-                                finally:
-                                    del self.state.change_futures[diff_text]
-                                    self.state.additive_ranges = RangeSet()
-                                    self.state.negative_ranges = RangeSet()
-                                    with lsp.setdoc(self.state.document):
-                                        cursor = self.state.selection.first
-                                        for op, text in diff:
-                                            next_cursor = add_pos_text(cursor, text)
-                                            if op == -1:  # delete
-                                                self.state.negative_ranges.add(
-                                                    lsp.Range(cursor, next_cursor)
-                                                )
-                                            elif op == 0:  # keep
-                                                pass
-                                            elif op == 1:  # add
-                                                self.state.additive_ranges.add(
-                                                    lsp.Range(cursor, next_cursor)
-                                                )
-                                            cursor = next_cursor
-
-                                    progress = CodeEditProgress(
-                                        response=None,
-                                        textDocument=self.state.document,
-                                        cursor=self.state.cursor,
-                                        additive_ranges=list(self.state.additive_ranges),
-                                        negative_ranges=list(self.state.negative_ranges),
-                                    )
-                                    await self.send_progress(progress)
-                            except Exception as e:
-                                logger.info(f"caught {e=} retrying")
-                                fuel -= 1
+                    # the edits are sent to the editor in the background, so the model stream is
+                    # never held up waiting for the editor.
+                    region_start, region_end = self.state.document.positions_to_offsets(
+                        [self.RANGE.start, self.RANGE.end]
+                    )
+                    edit_stream = EditStream(
+                        self.server,
+                        self.state.document.uri,
+                        self.RANGE,
+                        self.state.document.text[region_start:region_end],
+                        change_futures=self.state.change_futures,
+                        on_flush=on_flush,
+                    )
+
+                    # keeps the alignment between calls, so each new line is only diffed once.
+                    line_diff = StreamingLineDiff(self.selection_text)
+
+                    def send_diff(new_text: str):
+                        if self.state._done._value:
+                            return
+                        diff = line_diff.update(new_text)
+                        self.DIFF = diff  # store the latest diff
+                        edit_stream.update("".join([text for _, text in diff]))
 
                     async def generate_code():
                         nonlocal all_deltas
@@ -272,15 +237,6 @@ class CodeEditAgent(Agent):
                         after = edit_code_result.code
                         line_flag = False
 
-                        async def _watch_queue():
-                            while True:
-                                x = await diff_queue.get()
-                                if x is None:
-                                    return
-                                else:
-                                    await send_diff(x)
-
-                        diff_queue_task = asyncio.create_task(_watch_queue())
                         while True:
                             if after.at_eof():
                                 break
@@ -299,11 +255,9 @@ class CodeEditAgent(Agent):
                                 line_flag = True
                             # logger.info(f"{all_deltas=}")
 
-                            await diff_queue.put("".join(all_deltas))
-                        await diff_queue.put(None)
-                        await diff_queue_task
-
-                        # asyncio.create_task(send_diff("".join(all_deltas)))
+                            send_diff("".join(all_deltas))
+                        await edit_stream.aclose()
+                        self.RANGE = edit_stream.range
 
                     await self.add_task("Generate code", generate_code).run()
                     await gather_thoughts()
@@ -327,6 +281,8 @@ class CodeEditAgent(Agent):
                     )
                     logger.info("sent ready=True")
                 finally:
+                    if edit_stream is not None:
+                        edit_stream.cancel()
                     self.server.change_callbacks[self.state.document.uri].discard(self.on_change)
             return CodeEditRunResult()
         except asyncio.CancelledError as e:
@@ -295,13 +295,11 @@ class EngineerAgent(ThirdPartyAgent):
                 updates = [x for x in items if x[0] not in SEEN]
                 if len(updates) > 0:
                     # for file_path, new_contents in updates:
+                    file_changes = await file_diff.get_file_changes_async(updates)
                     await self.server.apply_workspace_edit(
                         lsp.ApplyWorkspaceEditParams(
-                            file_diff.edits_from_file_changes(
-                                [
-                                    file_diff.get_file_change(file_path, new_contents)
-                                    for file_path, new_contents in updates
-                                ],
+                            await file_diff.edits_from_file_changes_async(
+                                file_changes,
                                 user_confirmation=True,
                             )
                         )
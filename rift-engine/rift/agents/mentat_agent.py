@@ -67,7 +67,7 @@ class Mentat(agent.Agent):
     async def apply_file_changes(self, updates) -> lsp.ApplyWorkspaceEditResponse:
         return await self.server.apply_workspace_edit(
             lsp.ApplyWorkspaceEditParams(
-                file_diff.edits_from_file_changes(
+                await file_diff.edits_from_file_changes_async(
                     updates,
                     user_confirmation=True,
                 )
@@ -9,6 +9,7 @@ import rift.lsp.types as lsp
 from rift.agents.abstract import AgentProgress  # AgentTask,
 from rift.agents.abstract import Agent, AgentParams, AgentRunResult, AgentState, agent
 from rift.server.selection import RangeSet
+from rift.util.line_diff import StreamingLineDiff
 from rift.util.TextStream import TextStream
 
 logger = logging.getLogger(__name__)
@@ -80,11 +81,8 @@ class ReversoAgent(Agent):
 
     async def run(self) -> AgentRunResult:  # main entry point
         self.server.register_change_callback(self.on_change, self.state.document.uri)
-        from diff_match_patch import diff_match_patch
 
         logger.info("in run")
-        dmp = diff_match_patch()
-        logger.info("hawyee")
         EDIT = """\
 def quicksort(nums: List[int]) -> List[int]:
     if len(nums) <= 1:
@@ -96,7 +94,6 @@ def quicksort(nums: List[int]) -> List[int]:
     return quicksort(left) + middle + quicksort(right)
 """
         EDIT = "\n".join("".join(reversed(line)) for line in EDIT.split("\n"))
-        logger.info("importe diff_match_patch")
 
         async def create_dummy_text_stream(msg: str):
             cursor = 0
@@ -124,6 +121,7 @@ def quicksort(nums: List[int]) -> List[int]:
         offset_start = self.state.document.position_to_offset(self.state.selection.first)
         offset_end = self.state.document.position_to_offset(self.state.selection.second)
         selection_text = self.state.document.text[offset_start:offset_end]
+        line_diff = StreamingLineDiff(selection_text)
         async for delta in text_stream:
             logger.info(f"DELTA: {delta=}")
             fuel = 10
@@ -140,8 +138,7 @@ def quicksort(nums: List[int]) -> List[int]:
 
                     # calculate diff
 
-                    diff = dmp.diff_lineMode(selection_text, new_text, None)
-                    dmp.diff_cleanupSemantic(diff)
+                    diff = line_diff.update(new_text)
                     logger.info(f"{diff=}")
                     diff_text = "".join([text for _, text in diff])
 
@@ -156,20 +153,18 @@ def quicksort(nums: List[int]) -> List[int]:
                     await self.server.apply_range_edit(self.state.document.uri, RANGE, diff_text)
 
                     # recalculate our ranges
-                    with lsp.setdoc(self.state.document):
-                        cursor = self.state.selection.first
-                        for op, text in diff:
-                            if op == -1:  # delete
-                                self.state.negative_ranges.add(
-                                    lsp.Range(cursor, cursor + len(text))
-                                )
-                            elif op == 0:  # keep
-                                pass
-                            elif op == 1:  # add
-                                self.state.additive_ranges.add(
-                                    lsp.Range(cursor, cursor + len(text))
-                                )
-                            cursor += len(text)
+                    document = self.state.document
+                    offsets = [document.position_to_offset(self.state.selection.first)]
+                    for _, text in diff:
+                        offsets.append(offsets[-1] + len(text))
+                    positions = document.offsets_to_positions(offsets)
+                    for (op, _), cursor, next_cursor in zip(diff, positions, positions[1:]):
+                        if op == -1:  # delete
+                            self.state.negative_ranges.add(lsp.Range(cursor, next_cursor))
+                        elif op == 0:  # keep
+                            pass
+                        elif op == 1:  # add
+                            self.state.additive_ranges.add(lsp.Range(cursor, next_cursor))
 
                     self.send_progress(
                         ReversoProgress(
@@ -326,7 +326,9 @@ class SmolAgent(ThirdPartyAgent):
                 file_change for _, file_change in await asyncio.gather(*fs)
             ]
             await asyncio.sleep(0.1)
-            workspace_edit = file_diff.edits_from_file_changes(file_changes, user_confirmation=True)
+            workspace_edit = await file_diff.edits_from_file_changes_async(
+                file_changes, user_confirmation=True
+            )
             await self.server.apply_workspace_edit(
                 lsp.ApplyWorkspaceEditParams(edit=workspace_edit, label="rift")
             )
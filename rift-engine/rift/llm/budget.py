@@ -0,0 +1,188 @@
+"""
+Token budgets of the prompts sent to the chat models.
+
+A prompt and the completion sampled from it have to fit in the context window of the model. The budget
+counts the tokens of the messages exactly, including the tokens that the chat format adds around each
+message (see https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb),
+so the parts of the prompt that get truncated can use all of the space that's left without overflowing it.
+
+Contents Order in the Context:
+
+1) System Message: This includes an introduction and the current file content.
+2) Non-System Messages: These are the previous dialogue turns in the chat, both from the user and the system.
+3) Model's Responses Buffer: This is a reserved space for the response that the model will generate.
+
+Truncation Strategy for Sizes:
+
+1) System Message Size: Limited to the maximum of either `system_message_size` tokens or the remaining tokens available after accounting for non-system messages and the model's responses buffer.
+2) Non-System Messages Size: Limited to the number of tokens available after considering the size of the system message and the model's responses buffer.
+3) Model's Responses Buffer Size: Always reserved to `completion_size` tokens.
+"""
+import logging
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from itertools import accumulate
+from typing import Any, Callable, List, Optional
+
+from rift.llm.openai_types import Message
+from rift.llm.tokens import get_token_cache
+
+logger = logging.getLogger(__name__)
+
+MAX_CONTEXT_SIZE = 4096  # Context window of the models that we don't know about
+MAX_LEN_SAMPLED_COMPLETION = 768  # Reserved tokens for model's responses
+MAX_SYSTEM_MESSAGE_SIZE = 1024  # Token limit for system message
+
+CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-1106": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+}
+""" Context windows of the OpenAI models, by prefix of the model name. The longest prefix wins, so that
+eg `gpt-4-32k-0613` gets the window of `gpt-4-32k` and `gpt-4-0613` the window of `gpt-4`. """
+
+TOKENS_PER_MESSAGE = 4
+""" Every message is `<|im_start|>{role}\\n{content}<|im_end|>\\n`. """
+TOKENS_PER_NAME = 1
+REPLY_PRIMING = 3
+""" Every reply is primed with `<|im_start|>assistant<|im_sep|>`. """
+
+
+def context_window(model: Optional[str]) -> int:
+    """The number of tokens that fit in the context window of the given model."""
+    if not model:
+        return MAX_CONTEXT_SIZE
+    best = None
+    for prefix in CONTEXT_WINDOWS:
+        if model.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    if best is None:
+        logger.debug(f"unknown context window for {model}, assuming {MAX_CONTEXT_SIZE} tokens")
+        return MAX_CONTEXT_SIZE
+    return CONTEXT_WINDOWS[best]
+
+
+@dataclass
+class ContextBudget:
+    context_size: int = MAX_CONTEXT_SIZE
+    completion_size: int = MAX_LEN_SAMPLED_COMPLETION
+    """ Tokens reserved for the model's response, passed as `max_tokens`. """
+    system_message_size: int = MAX_SYSTEM_MESSAGE_SIZE
+    """ Tokens that the system message can always use, it can use more if the other messages leave room. """
+    encoder: Any = field(default_factory=get_token_cache)
+    tokens_per_message: int = TOKENS_PER_MESSAGE
+    reply_priming: int = REPLY_PRIMING
+
+    @classmethod
+    def for_model(cls, model: Optional[str], **kwargs) -> "ContextBudget":
+        return cls(context_size=context_window(model), **kwargs)
+
+    @property
+    def prompt_size(self) -> int:
+        """The number of tokens that the messages of a prompt can take."""
+        return self.context_size - self.completion_size - self.reply_priming
+
+    def count(self, text: str) -> int:
+        return self.encoder.count(text)
+
+    def message_size(self, msg: Message) -> int:
+        # chat histories are measured again for every reply, so the size is kept on the message for as long
+        # as its content doesn't change.
+        sizes = msg._token_sizes
+        cached = sizes.get(self.encoder)
+        if cached is not None and cached[0] is msg.content:
+            size = cached[1]
+        else:
+            size = self.count(msg.content)
+            if msg.name:
+                size += self.count(msg.name) + TOKENS_PER_NAME
+            sizes[self.encoder] = (msg.content, size)
+        return size + self.tokens_per_message
+
+    def messages_size(self, messages: List[Message]) -> int:
+        return sum(self.message_size(msg) for msg in messages)
+
+    def fits(self, messages: List[Message]) -> bool:
+        return self.messages_size(messages) <= self.prompt_size
+
+    def max_system_message_size(self, non_system_messages_size: int) -> int:
+        """Maximum size of the system message"""
+        # It's either the maximum defined limit or the remaining tokens in the context after accounting for the
+        # model's response and the non-system messages, whichever is larger. This ensures that the system message
+        # can take advantage of spare space, if available.
+        return max(
+            min(self.system_message_size, self.prompt_size),
+            self.prompt_size - non_system_messages_size,
+        )
+
+    def max_non_system_messages_size(self, system_message_size: int) -> int:
+        """Maximum size of the non-system messages"""
+        return self.prompt_size - system_message_size
+
+    def truncate_messages(self, messages: List[Message]) -> List[Message]:
+        """Keeps the first (system) message and as many of the latest other messages as fit."""
+        max_size = self.max_non_system_messages_size(self.message_size(messages[0]))
+        # sizes[i] is the size of the latest i + 1 messages.
+        sizes = list(accumulate(self.message_size(messages[i]) for i in range(len(messages) - 1, 0, -1)))
+        n = bisect_right(sizes, max_size)
+        return [messages[0]] + messages[len(messages) - n :]
+
+    def fit(
+        self, build: Callable[[int], List[Message]], max_size: int, limit: Optional[int] = None
+    ) -> List[Message]:
+        """Calls `build(size)` with smaller sizes, starting from `max_size`, until the messages it returns fit
+        in `limit` tokens (by default, in the prompt).
+
+        `build` truncates the variable parts of the messages (eg the documents) to `size` tokens. Truncating
+        to exact token counts is fiddly (a truncated text can tokenize differently and the markup around the
+        truncated parts has to be accounted for), so the result is measured and built again with the overflow
+        taken off.
+        """
+        if limit is None:
+            limit = self.prompt_size
+        while True:
+            messages = build(max_size)
+            overflow = self.messages_size(messages) - limit
+            if overflow <= 0 or max_size <= 0:
+                return messages
+            max_size = max(max_size - overflow, 0)
+
+
+if __name__ == "__main__":
+    # Benchmark: truncating a long chat history, as is done for every reply.
+    import random
+    import timeit
+
+    rng = random.Random(0)
+    words = ["the", "function", "returns", "a", "list", "of", "tokens", "def", "(", ")", "\n"]
+    history = [Message.system("You are a helpful assistant.")] + [
+        Message.mk(rng.choice(["user", "assistant"]), " ".join(rng.choices(words, k=rng.randrange(10, 200))))
+        for _ in range(1000)
+    ]
+    budget = ContextBudget.for_model("gpt-4-32k")
+
+    def legacy(messages: List[Message]) -> List[Message]:
+        # the previous implementation: sizes aren't kept and the tail is built with `insert(0, ...)`.
+        def size(msg: Message) -> int:
+            return budget.count(msg.content) + budget.tokens_per_message
+
+        max_size = budget.max_non_system_messages_size(size(messages[0]))
+        tail_messages: List[Message] = []
+        running_length = 0
+        for msg in reversed(messages[1:]):
+            running_length += size(msg)
+            if running_length > max_size:
+                break
+            tail_messages.insert(0, msg)
+        return [messages[0]] + tail_messages
+
+    assert legacy(history) == budget.truncate_messages(history)
+    print(f"{len(history)} messages, {len(budget.truncate_messages(history))} kept")
+    for name, fn in [("legacy", legacy), ("truncate_messages", budget.truncate_messages)]:
+        t = timeit.timeit(lambda: fn(history), number=100) / 100
+        print(f"{name:>18}: {t * 1e3:.3f}ms")
@@ -1,6 +1,7 @@
 import functools
+import hashlib
 import weakref
-from typing import Literal, Optional, Tuple
+from typing import Any, Dict, Iterable, Literal, Optional, Tuple
 
 from pydantic import BaseModel, SecretStr
 
@@ -18,13 +19,15 @@ class ModelConfig(BaseModel):
     def __eq__(self, other):
         return hash(self) == hash(other)
 
-    def create_chat(self) -> AbstractChatCompletionProvider:
-        c = create_client(self.chatModel, self.openaiKey)
+    def create_chat(self, user: Any = None) -> AbstractChatCompletionProvider:
+        """See `create_client`, and `use_client` when `user` is given."""
+        c = _create_or_use_client(self.chatModel, self.openaiKey, user)
         assert isinstance(c, AbstractChatCompletionProvider)
         return c
 
-    def create_completions(self) -> AbstractCodeCompletionProvider:
-        return create_client(self.completionsModel, self.openaiKey)
+    def create_completions(self, user: Any = None) -> AbstractCodeCompletionProvider:
+        """See `create_client`, and `use_client` when `user` is given."""
+        return _create_or_use_client(self.completionsModel, self.openaiKey, user)
 
     @classmethod
     def default(cls):
@@ -34,7 +37,21 @@ class ModelConfig(BaseModel):
         )
 
 
-CLIENTS = weakref.WeakValueDictionary()
+ClientKey = Tuple[str, Optional[str]]
+
+CLIENTS: "weakref.WeakValueDictionary[ClientKey, AbstractCodeCompletionProvider]" = (
+    weakref.WeakValueDictionary()
+)
+_held: Dict[ClientKey, AbstractCodeCompletionProvider] = {}
+""" The clients that some user of `use_client` still uses. """
+_users: Dict[ClientKey, "weakref.WeakSet[Any]"] = {}
+
+
+def client_key(config: str, openai_api_key: Optional[SecretStr] = None) -> ClientKey:
+    """The key of a client in `CLIENTS`. The API key is hashed so that it isn't kept in plain text."""
+    if openai_api_key is None:
+        return (config, None)
+    return (config, hashlib.sha256(openai_api_key.get_secret_value().encode()).hexdigest())
 
 
 def create_client(
@@ -45,15 +62,48 @@ def create_client(
     Note that it uses a WeakValueDictionary, so if the client is no longer referenced, it will be garbage collected.
     This is useful because it means you can call create_client multiple times without allocating the same model, but
     if you need to dispose a model this won't keep a reference that prevents it from being garbage collected.
+    See `use_client` to keep a client for as long as a session uses it.
     """
-    global CLIENTS
+    key = client_key(config, openai_api_key)
+    client = CLIENTS.get(key)
+    if client is None:
+        client = CLIENTS[key] = create_client_core(config, openai_api_key)
+    return client
 
-    if config in CLIENTS:
-        return CLIENTS[config]
-    else:
-        client = create_client_core(config, openai_api_key)
-        CLIENTS[config] = client
-        return client
+
+def use_client(
+    config: str, openai_api_key: Optional[SecretStr], user: Any
+) -> AbstractCodeCompletionProvider:
+    """Same as `create_client`, but the client is also kept for `user` (eg an `LspServer`) until it calls
+    `release_clients`. The sessions share the clients, and a client that several sessions use is kept until the
+    last one of them releases it."""
+    key = client_key(config, openai_api_key)
+    client = _held[key] = create_client(config, openai_api_key)
+    _users.setdefault(key, weakref.WeakSet()).add(user)
+    return client
+
+
+def release_clients(user: Any, keep: Iterable[Any] = ()):
+    """Stops keeping the clients of `user`, except the ones in `keep` (eg the clients of its new config).
+    The clients that no user needs anymore are dropped, so that eg a local model is unloaded as soon as
+    nothing else references it. Calling it more than once is harmless."""
+    keep = list(keep)
+    for key, users in list(_users.items()):
+        client = _held.get(key)
+        if user in users and not any(client is c for c in keep):
+            users.discard(user)
+        if not users:
+            # also drops the clients of users that were collected without releasing them.
+            del _users[key]
+            _held.pop(key, None)
+
+
+def _create_or_use_client(
+    config: str, openai_api_key: Optional[SecretStr], user: Any
+) -> AbstractCodeCompletionProvider:
+    if user is None:
+        return create_client(config, openai_api_key)
+    return use_client(config, openai_api_key, user)
 
 
 def parse_type_name_path(config: str) -> Tuple[str, str, str]:
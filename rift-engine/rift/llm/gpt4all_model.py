@@ -2,7 +2,6 @@ import asyncio
 import ctypes
 import logging
 import threading
-from functools import cache
 from pathlib import Path
 from typing import List, Optional, Any
 
@@ -23,41 +22,18 @@ from rift.llm.abstract import (
     ChatResult,
     InsertCodeResult,
 )
+from rift.llm.budget import ContextBudget
 from rift.llm.openai_types import Message
+from rift.llm.tokens import get_token_cache
 from rift.util.TextStream import TextStream
-from rift.llm.openai_client import (
-    truncate_messages,
-    create_system_message_chat_truncated,
-    messages_size,
-    calc_max_system_message_size,
-)
+from rift.llm.openai_client import create_chat_messages
 
 logger = logging.getLogger(__name__)
 
-from threading import Lock
-
-# ENCODER = get_encoding("cl100k_base")
 # from transformers import LlamaTokenizer
 import transformers
 
 # ENCODER = LlamaTokenizer.from_pretrained("oobabooga/llama-tokenizer")
-ENCODER_LOCK = Lock()
-
-
-def message_length(msg: Message):
-    with ENCODER_LOCK:
-        return get_num_tokens(msg.content)
-
-
-def auto_truncate(messages: List[Message]):
-    tail_messages: List[Message] = []
-    running_length = 0
-    for msg in reversed(messages[1:]):
-        running_length += message_length(msg)
-        if running_length > 1536:
-            break
-        tail_messages.insert(0, msg)
-    return [messages[0]] + tail_messages
 
 
 generate_lock = asyncio.Lock()
@@ -168,6 +144,17 @@ class Gpt4AllSettings(BaseSettings):
             return model
 
 
+def build_chat_prompt(msgs: List[Message]) -> str:
+    result = """### Instruction:
+    The prompt below is a conversation to respond to. Write an appropriate and helpful response.
+    \n### Prompt: """
+
+    for msg in msgs:
+        result += f"[{msg.role}]\n{msg.content}" + "\n"
+
+    return result + "[assistant]\n" + "### Response\n"
+
+
 class Gpt4AllModel(AbstractCodeCompletionProvider, AbstractChatCompletionProvider):
     def __init__(self, config: Optional[Gpt4AllSettings] = None):
         if config is None:
@@ -176,15 +163,26 @@ class Gpt4AllModel(AbstractCodeCompletionProvider, AbstractChatCompletionProvide
         logger.info(f"creating gpt4all model {self.config}")
         self.name = config.model_name
         self._model_future = None
-        self.ENCODER = model_name_to_tokenizer(self.config.model_name)
+        self.ENCODER = get_token_cache(
+            f"gpt4all:{self.name}", lambda: model_name_to_tokenizer(self.name)
+        )
+        self.budget = ContextBudget(
+            context_size=2048,
+            completion_size=256,
+            system_message_size=768,
+            encoder=self.ENCODER,
+            tokens_per_message=max(
+                self.ENCODER.count(f"[{role}]\n\n") for role in ("system", "user", "assistant")
+            ),
+            reply_priming=self.ENCODER.count(build_chat_prompt([])),
+        )
         
 
     async def load(self):
         await self._get_model()
 
-    @cache
     def get_num_tokens(self, content):
-        return len(self.ENCODER.encode(content))        
+        return self.ENCODER.count(content)
 
     @property
     async def model(self):
@@ -224,53 +222,11 @@ class Gpt4AllModel(AbstractCodeCompletionProvider, AbstractChatCompletionProvide
         logger.debug("run_chat called")
         model = await self._get_model()
         chatstream = TextStream()
-        non_system_messages = []
-        for msg in messages:
-            logger.debug(str(msg))
-            non_system_messages.append(Message.mk(role=msg.role, content=msg.content))
-        non_system_messages += [Message.user(content=message)]
-        non_system_messages_size = messages_size(non_system_messages)
-        max_system_msg_size = calc_max_system_message_size(non_system_messages_size, max_system_message_size=768, max_context_size=2048, max_len_sampled_completion=256)
-        # logger.info(f"{max_system_msg_size=}")
-        system_message = create_system_message_chat_truncated(
-            document or "", max_system_msg_size, cursor_offset, cursor_offset, documents, encoder=self.ENCODER
-        )
-        # logger.info(f"{system_message=}")
-        messages = (
-            [
-                #                 Message.system(
-                #                     f"""
-                # You are an expert software engineer and world-class systems architect with deep technical and design knowledge. Answer the user's questions about the code as helpfully as possible, quoting verbatim from the current file to support your claims.
-                # Current file:
-                # ```
-                # {document}
-                # ```
-                # Answer the user's question."""
-                #                 )
-                system_message
-            ]
-            + [Message.mk(role=msg.role, content=msg.content) for msg in messages]
-            + [Message.user(content=message)]
+        messages = create_chat_messages(
+            document or "", messages, message, cursor_offset, documents, budget=self.budget
         )
-
-        num_old_messages = len(messages)
-        # messages = auto_truncate(messages)
-        messages = truncate_messages(messages, max_context_size=2048, max_len_sampled_completion=256)
-
-        logger.info(f"Truncated {num_old_messages - len(messages)} due to context length overflow.")
-
-        def build_prompt(msgs: List[Message]) -> str:
-            result = """### Instruction:
-            The prompt below is a conversation to respond to. Write an appropriate and helpful response.
-            \n### Prompt: """
-
-            for msg in msgs:
-                result += f"[{msg.role}]\n{msg.content}" + "\n"
-
-            return result + "[assistant]\n" + "### Response\n"
-
         inner_model = model.model
-        prompt = build_prompt(messages)
+        prompt = build_chat_prompt(messages)
 
         logger.info(f"Created chat prompt with {len(prompt)} characters.")
 
@@ -0,0 +1,192 @@
+"""
+Pooled HTTP connections to the model APIs.
+
+Every request to a model API used to go through an `aiohttp.ClientSession` owned by the client that made it.
+The clients are only cached while they are used (see `rift.llm.create.create_client`), so when the last session
+using one went away its HTTP session was dropped without being closed, and the next client started over with a cold
+connection: a new DNS lookup, TCP handshake and TLS handshake for the first request of every chat.
+
+Instead there is one `ConnectionPool` per base URL for the lifetime of the process. It owns the session and
+its connector, whose limits, keep-alive, DNS cache and timeouts are set by `HttpSettings`. The clients pass
+their own headers with each request, so clients with different keys share the connections to the same API.
+
+The pools are closed when the last `LspServer` using them shuts down, see `use_pools` and `release_pools`.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from typing import Any, Dict, Optional, Set
+
+import aiohttp
+from pydantic import BaseSettings
+
+logger = logging.getLogger(__name__)
+
+
+class HttpSettings(BaseSettings):
+    limit: int = 100
+    """ Maximum number of connections open at once, over all the hosts. """
+    limit_per_host: int = 16
+    """ Maximum number of connections open at once to the same host. """
+    keepalive_timeout: float = 60.0
+    """ Seconds that an idle connection is kept open for the next request. """
+    ttl_dns_cache: Optional[int] = 300
+    """ Seconds that DNS lookups are cached for, None caches them forever. """
+    connect_timeout: Optional[float] = 10.0
+    """ Seconds to get a connection, from the pool or by opening a new one. """
+    read_timeout: Optional[float] = 120.0
+    """ Seconds to wait for the next bytes of a response. Completions are streamed, so this is the longest
+    pause between two chunks rather than the time that a whole completion can take. """
+    total_timeout: Optional[float] = None
+    """ Seconds that a whole request can take, None for no limit. """
+
+    class Config:
+        env_prefix = "RIFT_HTTP_"
+
+    @property
+    def timeout(self) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(
+            total=self.total_timeout,
+            connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+
+
+class ConnectionPool:
+    """The connections to the API at `base_url`."""
+
+    requests: int
+    connections_created: int
+    connections_reused: int
+    """ Number of requests that were sent on a connection kept alive from a previous request. """
+
+    def __init__(self, base_url: str, settings: Optional[HttpSettings] = None):
+        self.base_url = base_url
+        self.settings = settings or HttpSettings()
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing: Set[asyncio.Task] = set()
+
+    def __str__(self):
+        return f"{self.__class__.__name__} {self.base_url}"
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The session to send the requests with, created on first use. Must be used from a running loop."""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            # the connections of a session belong to the loop it was made in, so a new loop gets a new session.
+            self._drop_session()
+            self._session = self._create_session()
+            self._loop = loop
+        return self._session
+
+    def _drop_session(self):
+        """Closes the session of a previous loop, without waiting for it."""
+        session, loop, self._session, self._loop = self._session, self._loop, None, None
+        if session is None or session.closed:
+            return
+        logger.debug(f"{self} closing the session of a previous loop")
+        if loop is not None and not loop.is_closed():
+            # the connections are closed on their own loop, as soon as it runs again if it has stopped.
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+            return
+        # the loop is gone and its connections with it, there is nothing left to close but the session.
+        task = asyncio.get_running_loop().create_task(session.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        settings = self.settings
+        connector = aiohttp.TCPConnector(
+            limit=settings.limit,
+            limit_per_host=settings.limit_per_host,
+            keepalive_timeout=settings.keepalive_timeout,
+            ttl_dns_cache=settings.ttl_dns_cache,
+            use_dns_cache=True,
+        )
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_connection_create_end.append(self._on_connection_create_end)
+        trace.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        logger.debug(f"{self} opening a session")
+        return aiohttp.ClientSession(
+            base_url=self.base_url,
+            connector=connector,
+            timeout=settings.timeout,
+            trace_configs=[trace],
+        )
+
+    async def _on_request_start(self, session, ctx, params):
+        self.requests += 1
+
+    async def _on_connection_create_end(self, session, ctx, params):
+        self.connections_created += 1
+
+    async def _on_connection_reuseconn(self, session, ctx, params):
+        self.connections_reused += 1
+
+    @property
+    def closed(self) -> bool:
+        return self._session is None or self._session.closed
+
+    async def close(self):
+        """Closes the session and its connections. The pool can still be used, it then opens a new session."""
+        session, self._session, self._loop = self._session, None, None
+        if session is not None and not session.closed:
+            logger.debug(f"{self} closing, {self.stats()}")
+            await session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        connections = self.connections_created + self.connections_reused
+        return {
+            "base_url": self.base_url,
+            "requests": self.requests,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "reuse_rate": self.connections_reused / connections if connections else 0.0,
+        }
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+_users: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+
+def get_pool(base_url: str, settings: Optional[HttpSettings] = None) -> ConnectionPool:
+    """The process-wide `ConnectionPool` of `base_url`. `settings` are only used when the pool is created."""
+    with _pools_lock:
+        pool = _pools.get(base_url)
+        if pool is None:
+            pool = _pools[base_url] = ConnectionPool(base_url, settings)
+        return pool
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    return {base_url: pool.stats() for base_url, pool in list(_pools.items())}
+
+
+async def close_pools():
+    for pool in list(_pools.values()):
+        await pool.close()
+
+
+def use_pools(user: Any):
+    """Registers `user` (eg an `LspServer`) as using the pools, they stay open until it calls `release_pools`."""
+    _users.add(user)
+
+
+async def release_pools(user: Any) -> bool:
+    """Closes the pools if `user` was the last one using them, and then returns True.
+    Calling it more than once is harmless."""
+    if user not in _users:
+        return False
+    _users.discard(user)
+    if _users:
+        return False
+    await close_pools()
+    return True
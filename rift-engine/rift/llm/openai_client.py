@@ -4,13 +4,13 @@ import logging
 import random
 from contextvars import ContextVar
 from dataclasses import dataclass
-from functools import cache, cached_property
-from threading import Lock
+from functools import cached_property
 from typing import (
     Any,
     AsyncGenerator,
     Awaitable,
     Coroutine,
+    Dict,
     List,
     Literal,
     Optional,
@@ -33,12 +33,15 @@ from rift.llm.abstract import (
     EditCodeResult,
     InsertCodeResult,
 )
+from rift.llm.budget import ContextBudget
+from rift.llm.http import ConnectionPool, get_pool
 from rift.llm.openai_types import (
     ChatCompletionChunk,
     ChatCompletionRequest,
     ChatCompletionResponse,
     Message,
 )
+from rift.llm.tokens import get_token_cache
 from rift.util.TextStream import TextStream
 
 logger = logging.getLogger(__name__)
@@ -46,10 +49,10 @@ logger = logging.getLogger(__name__)
 I = TypeVar("I", bound=BaseModel)
 O = TypeVar("O", bound=BaseModel)
 
-from tiktoken import get_encoding
+ENCODER = get_token_cache("cl100k_base")
 
-ENCODER = get_encoding("cl100k_base")
-ENCODER_LOCK = Lock()
+BUDGETS: Dict[Optional[str], ContextBudget] = {}
+""" The `ContextBudget` of each model, see `OpenAIClient.budget`. """
 
 
 @dataclass
@@ -63,22 +66,8 @@ class OpenAIError(Exception):
         return self.message
 
 
-@cache
 def get_num_tokens(content: str):
-    return len(ENCODER.encode(content))
-
-
-def message_size(msg: Message):
-    with ENCODER_LOCK:
-        length = get_num_tokens(msg.content)
-        # every message follows <im_start>{role/name}\n{content}<im_end>\n
-        # see https://platform.openai.com/docs/guides/gpt/managing-tokens
-        length += 6
-        return length
-
-
-def messages_size(messages: List[Message]) -> int:
-    return sum([len(msg.content) for msg in messages])
+    return ENCODER.count(content)
 
 
 def split_sizes(size1: int, size2: int, max_size: int) -> tuple[int, int]:
@@ -101,54 +90,7 @@ def split_sizes(size1: int, size2: int, max_size: int) -> tuple[int, int]:
 
 def split_lists(list1: list, list2: list, max_size: int) -> tuple[list, list]:
     size1, size2 = split_sizes(len(list1), len(list2), max_size)
-    return list1[-size1:], list2[:size2]
-
-
-"""
-Contents Order in the Context:
-
-1) System Message: This includes an introduction and the current file content.
-2) Non-System Messages: These are the previous dialogue turns in the chat, both from the user and the system.
-3) Model's Responses Buffer: This is a reserved space for the response that the model will generate.
-
-Truncation Strategy for Sizes:
-
-1) System Message Size: Limited to the maximum of either MAX_SYSTEM_MESSAGE_SIZE tokens or the remaining tokens available after accounting for non-system messages and the model's responses buffer.
-2) Non-System Messages Size: Limited to the number of tokens available after considering the size of the system message and the model's responses buffer.
-3) Model's Responses Buffer Size: Always reserved to MAX_LEN_SAMPLED_COMPLETION tokens.
-
-The system message size can dynamically increase beyond MAX_SYSTEM_MESSAGE_SIZE if there is remaining space within the MAX_CONTEXT_SIZE after accounting for non-system messages and the model's responses.
-"""
-
-MAX_CONTEXT_SIZE = 4096  # Total token limit for GPT models
-MAX_LEN_SAMPLED_COMPLETION = 768  # Reserved tokens for model's responses
-MAX_SYSTEM_MESSAGE_SIZE = 1024  # Token limit for system message
-
-
-def calc_max_non_system_msgs_size(
-    system_message_size: int,
-    max_context_size: int = MAX_CONTEXT_SIZE,
-    max_len_sampled_completion: int = MAX_LEN_SAMPLED_COMPLETION,
-) -> int:
-    """Maximum size of the non-system messages"""
-    return max_context_size - max_len_sampled_completion - system_message_size
-
-
-def calc_max_system_message_size(
-    non_system_messages_size: int,
-    max_system_message_size: int = MAX_SYSTEM_MESSAGE_SIZE,
-    max_context_size: int = MAX_CONTEXT_SIZE,
-    max_len_sampled_completion: int = MAX_LEN_SAMPLED_COMPLETION,
-) -> int:
-    """Maximum size of the system message"""
-
-    # Calculate the maximum size for the system message. It's either the maximum defined limit
-    # or the remaining tokens in the context size after accounting for model responses and non-system messages,
-    # whichever is larger. This ensures that the system message can take advantage of spare space, if available.
-    return max(
-        max_system_message_size,
-        max_context_size - max_len_sampled_completion - non_system_messages_size,
-    )
+    return list1[len(list1) - size1 :], list2[:size2]
 
 
 def format_visible_files(documents: Optional[List[lsp.Document]] = None) -> str:
@@ -191,16 +133,15 @@ def truncate_around_region(
     region_start,
     region_end: Optional[int] = None,
     max_size: Optional[int] = None,
+    encoder=ENCODER,
 ):
     if region_end is None:
         region_end = region_start
+    max_size = max(max_size or 0, 0)
     if region_start:
-        before_cursor: str = document[:region_start]
-        region: str = document[region_start:region_end]
-        after_cursor: str = document[region_end:]
-        tokens_before_cursor: List[int] = ENCODER.encode(before_cursor)
-        tokens_after_cursor: List[int] = ENCODER.encode(after_cursor)
-        region_tokens: List[int] = ENCODE.encode(region)
+        tokens_before_cursor, region_tokens, tokens_after_cursor = encoder.encode_parts(
+            document, [region_start, region_end]
+        )
         (tokens_before_cursor, tokens_after_cursor) = split_lists(
             tokens_before_cursor, tokens_after_cursor, max_size
         )
@@ -210,7 +151,7 @@ def truncate_around_region(
         tokens: List[int] = tokens_before_cursor + region_tokens + tokens_after_cursor
     else:
         # if there is no cursor offset provided, simply take the last max_size tokens
-        tokens = document_tokens[-max_size:]
+        tokens = document_tokens[len(document_tokens) - max_size :]
         logger.debug(f"Truncating document to last {len(tokens)} tokens")
     return tokens
 
@@ -222,73 +163,214 @@ def create_system_message_chat_truncated(
     cursor_offset_end: Optional[int] = None,
     document_list: Optional[List[lsp.Document]] = None,
     current_file_weight: float = 0.5,
-    encoder = ENCODER,
+    budget: Optional[ContextBudget] = None,
 ) -> Message:
     """
     Create system message with up to max_size tokens
     """
-    # logging.getLogger().info(f"{max_size=}")
+    if budget is None:
+        budget = ContextBudget()
+    encoder = budget.encoder
     hardcoded_message = create_system_message_chat("")
-    hardcoded_message_size = message_size(hardcoded_message)
-    max_size = max_size - hardcoded_message_size
+    hardcoded_message_size = budget.message_size(hardcoded_message)
 
-    if document_list:
-        # truncate the main document as necessary
-        max_document_size = int(current_file_weight * max_size)
-    else:
-        max_document_size = max_size
+    def build(max_size: int) -> List[Message]:
+        if document_list:
+            # truncate the main document as necessary
+            max_document_size = int(current_file_weight * max_size)
+        else:
+            max_document_size = max_size
+
+        document_tokens = encoder.encode(document)
+        if len(document_tokens) > max_document_size:
+            document_tokens = truncate_around_region(
+                document,
+                document_tokens,
+                cursor_offset_start,
+                cursor_offset_end,
+                max_document_size,
+                encoder=encoder,
+            )
+        truncated_document = encoder.decode(document_tokens)
 
-    document_tokens = encoder.encode(document)
-    if len(document_tokens) > max_document_size:
-        document_tokens: List[int] = truncate_around_region(
-            document, document_tokens, cursor_offset_start, cursor_offset_end, max_document_size
-        )
-    truncated_document = encoder.decode(document_tokens)
-
-    truncated_document_list = []
-    logger.info(f"document list = {document_list}")
-    if document_list:
-        max_document_list_size = ((1.0 - current_file_weight) * max_size) // len(document_list)
-        max_document_list_size = int(max_document_list_size)
-        for doc in document_list:
-            # TODO: Need a check for using up our limit
-            document_contents = doc.document.text
-            # logger.info(f"{document_contents=}")
-            tokens = encoder.encode(document_contents)
-            logger.info("got tokens")
-            if len(tokens) > max_document_list_size:
-                tokens = tokens[:max_document_list_size]
-                logger.info("truncated tokens")
-                logger.debug(f"Truncating document to first {len(tokens)} tokens")
-            logger.info("creating new doc")
-            new_doc = lsp.Document(doc.uri, document=lsp.DocumentContext(encoder.decode(tokens)))
-            logger.info("created new doc")
-            truncated_document_list.append(new_doc)
-
-    return create_system_message_chat(truncated_document, truncated_document_list)
-
-
-def truncate_messages(
+        truncated_document_list = []
+        if document_list:
+            max_document_list_size = ((1.0 - current_file_weight) * max_size) // len(document_list)
+            max_document_list_size = int(max_document_list_size)
+            for doc in document_list:
+                tokens = encoder.encode(doc.document.text)
+                if len(tokens) > max_document_list_size:
+                    tokens = tokens[:max_document_list_size]
+                    logger.debug(f"Truncating document to first {len(tokens)} tokens")
+                new_doc = lsp.Document(doc.uri, document=lsp.DocumentContext(encoder.decode(tokens)))
+                truncated_document_list.append(new_doc)
+
+        return [create_system_message_chat(truncated_document, truncated_document_list)]
+
+    return budget.fit(build, max(max_size - hardcoded_message_size, 0), limit=max_size)[0]
+
+
+def create_chat_messages(
+    document: str,
     messages: List[Message],
-    max_context_size: int = MAX_CONTEXT_SIZE,
-    max_len_sampled_completion=MAX_LEN_SAMPLED_COMPLETION,
-):
-    system_message_size = message_size(messages[0])
-    max_size = calc_max_non_system_msgs_size(
-        system_message_size,
-        max_context_size=max_context_size,
-        max_len_sampled_completion=max_len_sampled_completion,
+    message: str,
+    cursor_offset: Optional[int] = None,
+    documents: Optional[List[lsp.Document]] = None,
+    budget: Optional[ContextBudget] = None,
+) -> List[Message]:
+    """The messages of a chat prompt: the system message with as much of the documents as fits in the budget,
+    then as many of the latest messages as fit."""
+    if budget is None:
+        budget = ContextBudget()
+    # the messages are kept as they are so that their sizes are only computed once, see `ContextBudget.message_size`.
+    non_system_messages = [
+        msg if isinstance(msg, Message) else Message.mk(role=msg.role, content=msg.content)
+        for msg in messages
+    ]
+    non_system_messages.append(Message.user(content=message))
+    max_system_msg_size = budget.max_system_message_size(budget.messages_size(non_system_messages))
+    system_message = create_system_message_chat_truncated(
+        document, max_system_msg_size, cursor_offset, cursor_offset, documents, budget=budget
     )
-    # logger.info(f"{max_size=}")
-    tail_messages: List[Message] = []
-    running_length = 0
-    for msg in reversed(messages[1:]):
-        # logger.info(f"{running_length=}")
-        running_length += message_size(msg)
-        if running_length > max_size:
-            break
-        tail_messages.insert(0, msg)
-    return [messages[0]] + tail_messages
+    messages = [system_message] + non_system_messages
+    # Truncate the messages to ensure that the total set of messages (system and non-system) fit within the context window
+    truncated = budget.truncate_messages(messages)
+    if len(truncated) < len(messages):
+        logger.info(
+            f"Truncated {len(messages) - len(truncated)} non-system messages due to context length overflow."
+        )
+    return truncated
+
+
+def create_edit_code_messages(
+    document: str,
+    cursor_offset_start: int,
+    cursor_offset_end: int,
+    goal=None,
+    latest_region: Optional[str] = None,
+    documents: Optional[List[lsp.Document]] = None,
+    current_file_weight: float = 0.5,
+    budget: Optional[ContextBudget] = None,
+) -> List[Message]:
+    """The messages of an `edit_code` prompt, with as much of the document around the region and of the
+    other documents as fits in the budget."""
+    if budget is None:
+        budget = ContextBudget()
+    encoder = budget.encoder
+    if goal is None:
+        goal = f"""
+        Generate code to replace the given `region`. Write a partial code snippet without imports if needed.
+        """
+
+    def create_messages(
+        before_cursor: str,
+        region: str,
+        after_cursor: str,
+        documents: Optional[List[lsp.Document]] = None,
+    ) -> List[Message]:
+        user_message = (
+            f"Please generate code completing the task which will replace the below region: {goal}\n"
+            "==== PREFIX ====\n"
+            f"{before_cursor}"
+            "==== REGION ====\n"
+            f"{latest_region or region}\n"
+            "==== SUFFIX ====\n"
+            f"{after_cursor}\n"
+        )
+        user_message = format_visible_files(documents) + user_message
+
+        return [
+            Message.system(
+                "You are a brilliant coder and an expert software engineer and world-class systems architect with deep technical and design knowledge. You value:\n"
+                "- Conciseness\n"
+                "- DRY principle\n"
+                "- Self-documenting code with plenty of comments\n"
+                "- Modularity\n"
+                "- Deduplicated code\n"
+                "- Readable code\n"
+                "- Abstracting things away to functions for reusability\n"
+                "- Logical thinking\n"
+                "\n\n"
+                "You will be presented with a *task* and a source code file split into three parts: a *prefix*, *region*, and *suffix*. "
+                "The task will specify a change or new code that will replace the given region.\n You will receive the source code in the following format:\n"
+                "==== PREFIX ====\n"
+                "${source code file before the region}\n"
+                "==== REGION ====\n"
+                "${region}\n"
+                "==== SUFFIX ====\n"
+                "{source code file after the region}\n\n"
+                "When presented with a task, you will:\n(1) write a detailed and elegant plan to solve this task,\n(2) write your solution for it surrounded by triple backticks, and\n(3) write a 1-2 sentence summary of your solution.\n"
+                f"Your solution will be added verbatim to replace the given region. Do *not* repeat the prefix or suffix in any way.\n"
+                "The solution should directly replaces the given region. If the region is empty, just write something that will replace the empty string. *Do not repeat the prefix or suffix in any way*. If the region is in the middle of a function definition or class declaration, do not repeat the function signature or class declaration. Write a partial code snippet without imports if needed. Preserve indentation.\n"
+                f"For example, if the source code looks like this:\n"
+                "==== PREFIX ====\n"
+                "def hello_world():\n    \n"
+                "==== REGION ====\n"
+                "\n"
+                "==== SUFFIX ====\n"
+                "if __name__ == '__main__':\n    hello_world()\n\n"
+                "And the task is 'implement this function and return 0', then a good response would be\n"
+                "We will implement hello world by first using the Python `print` statement and then returning the integer literal 0.\n"
+                "```\n"
+                "# print hello world\n"
+                "    print('hello world!')\n"
+                "    # return the integer 0\n"
+                "    return 0\n"
+                "```\n"
+                "I added an implementation of the rest of the `hello_world` function which uses the Python `print` statement to print 'hello_world' before returning the integer literal 0.\n"
+            ),
+            Message.assistant("Hello! How can I help you today?"),
+            Message.user(user_message),
+        ]
+
+    messages_skeleton = create_messages("", "", "")
+    max_size = budget.prompt_size - budget.messages_size(messages_skeleton)
+
+    before_cursor = document[:cursor_offset_start]
+    region = document[cursor_offset_start:cursor_offset_end]
+    after_cursor = document[cursor_offset_end:]
+    document_size = budget.count(document)
+
+    def build(max_size: int) -> List[Message]:
+        # rescale `max_size_document` if we need to make room for the other documents
+        max_size_document = int(max_size * (current_file_weight if documents else 1.0))
+
+        # calculate truncation for the ur-document
+        truncated_before, truncated_after = before_cursor, after_cursor
+        if document_size > max_size_document:
+            tokens_before_cursor, _, tokens_after_cursor = encoder.encode_parts(
+                document, [cursor_offset_start, cursor_offset_end]
+            )
+            (tokens_before_cursor, tokens_after_cursor) = split_lists(
+                tokens_before_cursor, tokens_after_cursor, max_size_document
+            )
+            logger.debug(
+                f"Truncating document to ({len(tokens_before_cursor)}, {len(tokens_after_cursor)}) tokens around cursor"
+            )
+            truncated_before = encoder.decode(tokens_before_cursor)
+            truncated_after = encoder.decode(tokens_after_cursor)
+
+        # calculate truncation for the other context documents, if necessary
+        truncated_documents = []
+        if documents:
+            max_document_list_size = ((1.0 - current_file_weight) * max_size) // len(documents)
+            max_document_list_size = int(max_document_list_size)
+            for doc in documents:
+                tokens = encoder.encode(doc.document.text)
+                if len(tokens) > max_document_list_size:
+                    tokens = tokens[:max_document_list_size]
+                    logger.debug(f"Truncating document to first {len(tokens)} tokens")
+                doc = lsp.Document(uri=doc.uri, document=lsp.DocumentContext(encoder.decode(tokens)))
+                truncated_documents.append(doc)
+
+        return create_messages(
+            before_cursor=truncated_before,
+            region=region,
+            after_cursor=truncated_after,
+            documents=truncated_documents,
+        )
+
+    return budget.fit(build, max(max_size, 0))
 
 
 class OpenAIClient(BaseSettings, AbstractCodeCompletionProvider, AbstractChatCompletionProvider):
@@ -327,12 +409,20 @@ class OpenAIClient(BaseSettings, AbstractCodeCompletionProvider, AbstractChatCom
             "User-Agent": __name__,
         }
 
-    @cached_property
+    @property
+    def budget(self) -> ContextBudget:
+        budget = BUDGETS.get(self.default_model)
+        if budget is None:
+            budget = BUDGETS[self.default_model] = ContextBudget.for_model(self.default_model)
+        return budget
+
+    @property
+    def pool(self) -> ConnectionPool:
+        return get_pool(self.base_url)
+
+    @property
     def session(self) -> aiohttp.ClientSession:
-        return aiohttp.ClientSession(
-            base_url=self.base_url,
-            headers=self.headers,
-        )
+        return self.pool.session
 
     async def handle_error(self, resp: aiohttp.ClientResponse):
         status_code = resp.status
@@ -384,7 +474,9 @@ class OpenAIClient(BaseSettings, AbstractCodeCompletionProvider, AbstractChatCom
         payload = params.dict(exclude_none=True)
         payload["stream"] = True
         path = self._make_path(endpoint)
-        async with self.session.post(path, params=self.url_query, json=payload) as resp:
+        async with self.session.post(
+            path, params=self.url_query, json=payload, headers=self.headers
+        ) as resp:
             if not resp.ok:
                 await self.handle_error(resp)
             while True:
@@ -417,7 +509,9 @@ class OpenAIClient(BaseSettings, AbstractCodeCompletionProvider, AbstractChatCom
             raise ValueError("To use streaming please use the _post_streaming method")
         payload = params.dict(exclude_none=True)
         path = self._make_path(endpoint)
-        async with self.session.post(path, params=self.url_query, json=payload) as resp:
+        async with self.session.post(
+            path, params=self.url_query, json=payload, headers=self.headers
+        ) as resp:
             if not resp.ok:
                 await self.handle_error(resp)
             assert resp.content_type == "application/json"
@@ -447,7 +541,7 @@ class OpenAIClient(BaseSettings, AbstractCodeCompletionProvider, AbstractChatCom
             messages=messages,
             stream=stream,
             logit_bias=logit_bias,
-            max_tokens=MAX_LEN_SAMPLED_COMPLETION,
+            max_tokens=self.budget.completion_size,
             **kwargs,
         )
         if self.default_model:
@@ -475,28 +569,8 @@ class OpenAIClient(BaseSettings, AbstractCodeCompletionProvider, AbstractChatCom
         documents: Optional[List[lsp.Document]] = None,
     ) -> ChatResult:
         chatstream = TextStream()
-        non_system_messages = []
-        for msg in messages:
-            logger.debug(str(msg))
-            non_system_messages.append(Message.mk(role=msg.role, content=msg.content))
-        non_system_messages += [Message.user(content=message)]
-        non_system_messages_size = messages_size(non_system_messages)
-
-        max_system_msg_size = calc_max_system_message_size(non_system_messages_size)
-        # logger.info(f"{max_system_msg_size=}")
-
-        # logger.info(f"{documents=}")
-        system_message = create_system_message_chat_truncated(
-            document or "", max_system_msg_size, cursor_offset, cursor_offset, documents
-        )
-
-        messages = [system_message] + non_system_messages
-
-        num_old_messages = len(messages)
-        # Truncate the messages to ensure that the total set of messages (system and non-system) fit within MAX_CONTEXT_SIZE
-        messages = truncate_messages(messages)
-        logger.info(
-            f"Truncated {num_old_messages - len(messages)} non-system messages due to context length overflow."
+        messages = create_chat_messages(
+            document or "", messages, message, cursor_offset, documents, budget=self.budget
         )
 
         stream = TextStream.from_aiter(
@@ -527,115 +601,15 @@ class OpenAIClient(BaseSettings, AbstractCodeCompletionProvider, AbstractChatCom
         current_file_weight: float = 0.5,
     ) -> EditCodeResult:
         # logger.info(f"[edit_code] entered {latest_region=}")
-        if goal is None:
-            goal = f"""
-            Generate code to replace the given `region`. Write a partial code snippet without imports if needed.
-            """
-
-        def create_messages(
-            before_cursor: str,
-            region: str,
-            after_cursor: str,
-            documents: Optional[List[lsp.Document]] = None,
-        ) -> List[Message]:
-            user_message = (
-                f"Please generate code completing the task which will replace the below region: {goal}\n"
-                "==== PREFIX ====\n"
-                f"{before_cursor}"
-                "==== REGION ====\n"
-                f"{latest_region or region}\n"
-                "==== SUFFIX ====\n"
-                f"{after_cursor}\n"
-            )
-            user_message = format_visible_files(documents) + user_message
-
-            return [
-                Message.system(
-                    "You are a brilliant coder and an expert software engineer and world-class systems architect with deep technical and design knowledge. You value:\n"
-                    "- Conciseness\n"
-                    "- DRY principle\n"
-                    "- Self-documenting code with plenty of comments\n"
-                    "- Modularity\n"
-                    "- Deduplicated code\n"
-                    "- Readable code\n"
-                    "- Abstracting things away to functions for reusability\n"
-                    "- Logical thinking\n"
-                    "\n\n"
-                    "You will be presented with a *task* and a source code file split into three parts: a *prefix*, *region*, and *suffix*. "
-                    "The task will specify a change or new code that will replace the given region.\n You will receive the source code in the following format:\n"
-                    "==== PREFIX ====\n"
-                    "${source code file before the region}\n"
-                    "==== REGION ====\n"
-                    "${region}\n"
-                    "==== SUFFIX ====\n"
-                    "{source code file after the region}\n\n"
-                    "When presented with a task, you will:\n(1) write a detailed and elegant plan to solve this task,\n(2) write your solution for it surrounded by triple backticks, and\n(3) write a 1-2 sentence summary of your solution.\n"
-                    f"Your solution will be added verbatim to replace the given region. Do *not* repeat the prefix or suffix in any way.\n"
-                    "The solution should directly replaces the given region. If the region is empty, just write something that will replace the empty string. *Do not repeat the prefix or suffix in any way*. If the region is in the middle of a function definition or class declaration, do not repeat the function signature or class declaration. Write a partial code snippet without imports if needed. Preserve indentation.\n"
-                    f"For example, if the source code looks like this:\n"
-                    "==== PREFIX ====\n"
-                    "def hello_world():\n    \n"
-                    "==== REGION ====\n"
-                    "\n"
-                    "==== SUFFIX ====\n"
-                    "if __name__ == '__main__':\n    hello_world()\n\n"
-                    "And the task is 'implement this function and return 0', then a good response would be\n"
-                    "We will implement hello world by first using the Python `print` statement and then returning the integer literal 0.\n"
-                    "```\n"
-                    "# print hello world\n"
-                    "    print('hello world!')\n"
-                    "    # return the integer 0\n"
-                    "    return 0\n"
-                    "```\n"
-                    "I added an implementation of the rest of the `hello_world` function which uses the Python `print` statement to print 'hello_world' before returning the integer literal 0.\n"
-                ),
-                Message.assistant("Hello! How can I help you today?"),
-                Message.user(user_message),
-            ]
-
-        messages_skeleton = create_messages("", "", "")
-        max_size = MAX_CONTEXT_SIZE - MAX_LEN_SAMPLED_COMPLETION - messages_size(messages_skeleton)
-
-        # rescale `max_size_document` if we need to make room for the other documents
-        max_size_document = int(max_size * (current_file_weight if documents else 1.0))
-
-        before_cursor = document[:cursor_offset_start]
-        region = document[cursor_offset_start:cursor_offset_end]
-        after_cursor = document[cursor_offset_end:]
-
-        # calculate truncation for the ur-document
-        if get_num_tokens(document) > max_size_document:
-            tokens_before_cursor = ENCODER.encode(before_cursor)
-            tokens_after_cursor = ENCODER.encode(after_cursor)
-            (tokens_before_cursor, tokens_after_cursor) = split_lists(
-                tokens_before_cursor, tokens_after_cursor, max_size_document
-            )
-            logger.debug(
-                f"Truncating document to ({len(tokens_before_cursor)}, {len(tokens_after_cursor)}) tokens around cursor"
-            )
-            before_cursor = ENCODER.decode(tokens_before_cursor)
-            after_cursor = ENCODER.decode(tokens_after_cursor)
-
-        # calculate truncation for the other context documents, if necessary
-        truncated_documents = []
-        if documents:
-            max_document_list_size = ((1.0 - current_file_weight) * max_size) // len(documents)
-            max_document_list_size = int(max_document_list_size)
-            for doc in documents:
-                tokens = ENCODER.encode(doc.document.text)
-                if len(tokens) > max_document_list_size:
-                    tokens = tokens[:max_document_list_size]
-                    logger.debug(f"Truncating document to first {len(tokens)} tokens")
-                doc = lsp.Document(
-                    uri=doc.uri, document=lsp.DocumentContext(ENCODER.decode(tokens))
-                )
-                truncated_documents.append(doc)
-
-        messages = create_messages(
-            before_cursor=before_cursor,
-            region=region,
-            after_cursor=after_cursor,
-            documents=truncated_documents,
+        messages = create_edit_code_messages(
+            document,
+            cursor_offset_start,
+            cursor_offset_end,
+            goal=goal,
+            latest_region=latest_region,
+            documents=documents,
+            current_file_weight=current_file_weight,
+            budget=self.budget,
         )
         # logger.info(f"{messages=}")
 
@@ -3,7 +3,7 @@ from abc import ABC, abstractmethod
 from datetime import datetime
 from typing import Any, Literal, Optional, Union
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 """ Type definitions for interacting with the OpenAI API """
 
@@ -21,6 +21,8 @@ class Message(BaseModel):
     content: str
     name: Optional[str] = None
     """System messages can come with a 'name' parameter. """
+    _token_sizes: dict = PrivateAttr(default_factory=dict)
+    """ Number of tokens of the content and name, by encoder, see `ContextBudget.message_size`. """
 
     @classmethod
     def mk(cls, role: str, content: str):
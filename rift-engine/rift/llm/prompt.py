@@ -2,15 +2,14 @@ from abc import ABC, abstractmethod, abstractproperty
 from dataclasses import dataclass
 from typing import Callable, List, Optional, Tuple
 
-from tiktoken import get_encoding
-
 from rift.llm.openai_types import Message, MessageRole
+from rift.llm.tokens import get_token_cache
 
-ENCODER = get_encoding("cl100k_base")
+ENCODER = get_token_cache("cl100k_base")
 
 
 def token_length(string: str) -> int:
-    return len(ENCODER.encode(string))
+    return ENCODER.count(string)
 
 
 class Prompt(ABC):
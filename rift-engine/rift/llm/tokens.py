@@ -0,0 +1,338 @@
+"""
+Shared tokenization service.
+
+Prompts are rebuilt from the same documents over and over (every chat message, every edit re-truncates the
+open files), so the tokens of a text are cached by a hash of its content. The cache is an LRU bounded by the
+memory taken by the cached tokens, rather than by the number of entries, so that a few huge files can't pin
+an unbounded amount of memory. The texts themselves are not kept.
+
+`TokenCache` has the `encode` and `decode` methods of the encoders that it wraps, so it can be passed
+anywhere an encoder is expected.
+
+The documents open in the editor change with every keystroke, so caching their tokens by content doesn't
+help. Instead the server keeps a `DocumentTokens` for each of them (see `TokenCache.track`), which only
+re-tokenizes the parts of the document around the edits, and the cache answers for their current text from it.
+"""
+import hashlib
+import logging
+import re
+import threading
+import weakref
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = 64 * 1024 * 1024
+ENTRY_OVERHEAD = 128
+""" Rough number of bytes taken by an entry of the cache besides its tokens. """
+
+
+def content_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+BLOCK_SIZE = 4096
+""" Approximate number of characters of the blocks that `DocumentTokens` tokenizes documents in. """
+LINE_WITH_TEXT = re.compile(r"[^\S\n]*\S")
+
+
+def block_starts(text: str) -> List[int]:
+    """Offsets where `text` can be cut into blocks of about `BLOCK_SIZE` characters, starting with 0.
+
+    The cuts are at the start of lines that aren't blank. The pretokenizer of cl100k_base never puts the
+    newline that ends a line in the same word as the text of the next line (blank lines and indentation are
+    another matter), so tokenizing the blocks separately gives the same tokens as tokenizing the whole text. For other encoders the tokens might differ a little at the cuts,
+    but they still decode to the same text.
+    """
+    starts = [0]
+    i = BLOCK_SIZE
+    while i < len(text):
+        i = text.find("\n", i) + 1
+        if i == 0:
+            break
+        if LINE_WITH_TEXT.match(text, i):
+            starts.append(i)
+            i += BLOCK_SIZE
+    return starts
+
+
+class DocumentTokens:
+    """The tokens of a document that is being edited, see `TokenCache.track`.
+
+    The document is tokenized in blocks (see `block_starts`). `update` marks the blocks that an edit touches
+    as stale and they are tokenized again the next time that the tokens are read, so the cost of an edit
+    is the size of the blocks around it, not the size of the document.
+    """
+
+    document: Any
+    """ The current version of the document, a `rift.lsp.DocumentContext`. """
+    length: int
+
+    def __init__(self, encoder: Any, document: Any, cache: Optional["TokenCache"] = None):
+        self.encoder = encoder
+        self.document = document
+        self.length = len(document.rope)
+        self._cache = cache
+        """ The cache that tracks the document, told when its length changes. """
+        self._starts: List[int] = [0]
+        """ `_starts[i]` is the offset of block `i`. """
+        self._blocks: List[Optional[array]] = [None]
+        """ The tokens of each block, None when they need to be computed again. """
+        self._all: Optional[array] = None
+
+    def __len__(self):
+        self._refresh()
+        return sum(len(b) for b in self._blocks)
+
+    def update(self, document: Any, edits: Iterable[Tuple[int, int, str]]):
+        """Updates the blocks for `document`, which was made by replacing `[start, end)` with `text`
+        for each of the edits in turn."""
+        starts, blocks = self._starts, self._blocks
+        length = self.length
+        for start, end, text in edits:
+            i = bisect_right(starts, start) - 1
+            j = bisect_right(starts, end)
+            # blocks i to j - 1 are touched by the edit, they become a single stale block.
+            del starts[i + 1 : j]
+            blocks[i:j] = [None]
+            delta = len(text) - (end - start)
+            for k in range(i + 1, len(starts)):
+                starts[k] += delta
+            self.length += delta
+        self.document = document
+        self._all = None
+        if self._cache is not None and self.length != length:
+            self._cache._move(self, length)
+
+    def _refresh(self):
+        starts, blocks = self._starts, self._blocks
+        k = 0
+        while k < len(blocks):
+            if blocks[k] is not None:
+                k += 1
+                continue
+            a = starts[k]
+            b = starts[k + 1] if k + 1 < len(starts) else self.length
+            text = self.document.rope.slice(a, b)
+            if k > 0 and not LINE_WITH_TEXT.match(text):
+                # the block doesn't start at a safe cut anymore, merge it into the previous one.
+                del starts[k], blocks[k]
+                blocks[k - 1] = None
+                k -= 1
+                continue
+            if not text and len(blocks) > 1:
+                del starts[k], blocks[k]
+                starts[0] = 0
+                continue
+            cuts = block_starts(text)
+            ends = cuts[1:] + [len(text)]
+            starts[k : k + 1] = [a + c for c in cuts]
+            blocks[k : k + 1] = [array("I", self.encoder.encode(text[c:e])) for c, e in zip(cuts, ends)]
+            k += len(cuts)
+
+    def tokens(self) -> array:
+        if self._all is None:
+            self._refresh()
+            self._all = array("I")
+            for block in self._blocks:
+                self._all.extend(block)  # type: ignore
+        return self._all
+
+    def _tokens_between(self, a: int, b: int) -> List[int]:
+        result = []
+        if a >= b:
+            return result
+        starts, blocks = self._starts, self._blocks
+        for k in range(bisect_right(starts, a) - 1, len(blocks)):
+            s = starts[k]
+            if s >= b:
+                break
+            e = starts[k + 1] if k + 1 < len(starts) else self.length
+            if a <= s and e <= b:
+                result.extend(blocks[k])  # type: ignore
+            else:
+                result.extend(self.encoder.encode(self.document.rope.slice(max(a, s), min(b, e))))
+        return result
+
+    def split(self, offsets: List[int]) -> List[List[int]]:
+        """The tokens of the parts of the document between the given offsets, see `TokenCache.encode_parts`.
+        Only the blocks that contain the offsets are tokenized again."""
+        self._refresh()
+        bounds = [0, *offsets, self.length]
+        return [self._tokens_between(a, b) for a, b in zip(bounds, bounds[1:])]
+
+
+class TokenCache:
+    """Caches the tokens of the texts encoded with `encoder`."""
+
+    hits: int
+    document_hits: int
+    """ Number of texts that were found in the tracked documents. """
+    misses: int
+    evictions: int
+    size: int
+    """ Approximate number of bytes taken by the cached tokens. """
+
+    def __init__(self, encoder: Any, max_bytes: int = MAX_BYTES):
+        self.encoder = encoder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.document_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries: OrderedDict[bytes, array] = OrderedDict()
+        self._lock = threading.Lock()
+        self._documents: Dict[int, "weakref.WeakSet[DocumentTokens]"] = {}
+        """ The tracked documents by length, so that a text is only compared with the documents as long as it. """
+
+    def __len__(self):
+        return len(self._entries)
+
+    def track(self, document: Any) -> DocumentTokens:
+        """Keeps the tokens of `document`, a `rift.lsp.DocumentContext`, for as long as the returned
+        `DocumentTokens` is alive. Pass the next versions of the document to `DocumentTokens.update`.
+        The texts equal to the current version of the document are then tokenized from it."""
+        tokens = DocumentTokens(self.encoder, document, self)
+        with self._lock:
+            self._documents.setdefault(tokens.length, weakref.WeakSet()).add(tokens)
+        return tokens
+
+    def untrack(self, tokens: DocumentTokens):
+        """Stops answering from `tokens`, eg when its document is closed."""
+        with self._lock:
+            self._discard(tokens, tokens.length)
+        tokens._cache = None
+
+    def _discard(self, tokens: DocumentTokens, length: int):
+        same = self._documents.get(length)
+        if same is not None:
+            same.discard(tokens)
+            if not same:
+                del self._documents[length]
+
+    def _move(self, tokens: DocumentTokens, length: int):
+        """Called by `tokens` when its length changed from `length`."""
+        with self._lock:
+            self._discard(tokens, length)
+            self._documents.setdefault(tokens.length, weakref.WeakSet()).add(tokens)
+
+    def _document(self, text: str) -> Optional[DocumentTokens]:
+        same = self._documents.get(len(text))
+        if not same:
+            return None
+        for tokens in list(same):
+            if tokens.document.text == text:
+                self.document_hits += 1
+                return tokens
+        return None
+
+    def _tokens(self, text: str) -> array:
+        document = self._document(text)
+        if document is not None:
+            return document.tokens()
+        key = content_key(text)
+        with self._lock:
+            tokens = self._entries.get(key)
+            if tokens is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+        # encode outside of the lock, the same text being encoded twice concurrently is harmless.
+        tokens = array("I", self.encoder.encode(text))
+        cost = tokens.itemsize * len(tokens) + ENTRY_OVERHEAD
+        if cost > self.max_bytes:
+            return tokens
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = tokens
+                self.size += cost
+                while self.size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.size -= evicted.itemsize * len(evicted) + ENTRY_OVERHEAD
+                    self.evictions += 1
+        return tokens
+
+    def encode(self, text: str, **kwargs) -> List[int]:
+        if kwargs:
+            # eg `allowed_special`, these change the tokens so they don't go through the cache.
+            return self.encoder.encode(text, **kwargs)
+        return self._tokens(text).tolist()
+
+    def decode(self, tokens: List[int]) -> str:
+        return self.encoder.decode(tokens)
+
+    def encode_parts(self, text: str, offsets: List[int]) -> List[List[int]]:
+        """The tokens of each of the parts of `text` cut at the given (sorted) offsets, eg the text before
+        the cursor and the text after it."""
+        document = self._document(text)
+        if document is not None:
+            return document.split(offsets)
+        bounds = [0, *offsets, len(text)]
+        return [self.encode(text[a:b]) for a, b in zip(bounds, bounds[1:])]
+
+    def count(self, text: str) -> int:
+        """Number of tokens of `text`."""
+        return len(self._tokens(text))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.document_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "document_hits": self.document_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.document_hits) / lookups if lookups else 0.0,
+        }
+
+
+class LazyEncoding:
+    """The tiktoken encoding `name`, loaded on first use: tiktoken downloads it the first time."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._encoding = None
+
+    @property
+    def encoding(self):
+        if self._encoding is None:
+            from tiktoken import get_encoding
+
+            self._encoding = get_encoding(self.name)
+        return self._encoding
+
+    def encode(self, text: str, **kwargs) -> List[int]:
+        return self.encoding.encode(text, **kwargs)
+
+    def decode(self, tokens: List[int]) -> str:
+        return self.encoding.decode(tokens)
+
+
+_shared: Dict[str, TokenCache] = {}
+_shared_lock = threading.Lock()
+
+
+def get_token_cache(
+    encoding_name: str = "cl100k_base", create_encoder: Optional[Callable[[], Any]] = None
+) -> TokenCache:
+    """The process-wide `TokenCache` of the encoding `encoding_name`. This is a tiktoken encoding unless
+    `create_encoder` is given, it is then called to make the encoder the first time that the cache is asked for,
+    eg for the tokenizer of a local model."""
+    with _shared_lock:
+        cache = _shared.get(encoding_name)
+        if cache is None:
+            encoder = create_encoder() if create_encoder is not None else LazyEncoding(encoding_name)
+            cache = _shared[encoding_name] = TokenCache(encoder)
+        return cache
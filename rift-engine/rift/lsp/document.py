@@ -2,10 +2,8 @@
 Author: E.W.Ayers <contact@edayers.com>
 This file is adapted from  https://github.com/EdAyers/sss
 """
-import bisect
 import contextlib
-import functools
-import re
+import copy
 from contextvars import ContextVar
 from dataclasses import dataclass, replace
 from enum import Enum
@@ -22,6 +20,10 @@ import logging
 
 from rift.util.misc import set_ctx
 
+from .line_index import LineIndex
+from .rope import LINE_BREAK, Rope
+from .utf16 import Utf16Table, utf16_table
+
 logger = logging.getLogger(__name__)
 
 
@@ -216,112 +218,185 @@ class TextDocumentContentChangeEvent:
         return replace(range, start=self.map_pos(range.start), end=self.map_pos(range.end))
 
 
-SURROGATE_KEY_END = re.compile("[\ud800-\udbff]$", re.UNICODE)
+class _field_property(property):
+    """A property that backs a dataclass field.
+
+    The property isn't visible on the class, so the dataclass doesn't take it as the default value of the field.
+    """
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            raise AttributeError("_field_property")
+        return super().__get__(obj, objtype)
 
 
 @dataclass
 class DocumentContext:
     text: str
+    """The text of the document.
+
+    Under the hood the text is stored as a `Rope` (see `DocumentContext.rope`), so that applying an
+    edit with `apply_change` doesn't copy the whole document. Reading `text` materialises the string
+    once per version of the document.
+    """
+
+    # `text` stays a dataclass field so that `ofdict`, `todict` and `replace` keep working,
+    # but it is backed by the rope.
+    @_field_property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = str(self._rope)
+        return self._text
+
+    @text.setter
+    def text(self, text: Union[str, Rope]):
+        if isinstance(text, Rope):
+            self._rope = text
+            self._text = None
+        else:
+            self._rope = Rope.of_str(text)
+            self._text = text
+        # None means the index hasn't been built yet, False means use the rope instead.
+        self._line_index: Union[LineIndex, None, bool] = None
 
     def __str__(self):
-        return text
+        return self.text
+
+    @property
+    def rope(self) -> Rope:
+        return self._rope
 
     @property
     def line_count(self):
-        """One plus the number of newlines in the document."""
-        return len(self.line_offsets)
+        """One plus the number of line breaks in the document."""
+        return self._rope.newlines + 1
 
-    @functools.cached_property
+    @property
     def line_offsets(self):
-        if self.text == "":
-            return [0]
-        lines = self.text.splitlines(keepends=True)
-        assert len(lines) > 0
-        offsets = list(cumsum(map(len, lines)))
-        assert len(offsets) == len(lines)
-        assert offsets[-1] == len(self.text)
-        assert offsets[0] == len(lines[0])
+        """The offset of the end of each of the `line_count` lines (including the line break). A document
+        that ends with a line break ends with an empty line.
+
+        This is O(n), use `get_line_start_offset` and `get_line_end_offset` instead.
+        """
+        offsets = [m.end() for m in LINE_BREAK.finditer(self.text)]
+        offsets.append(len(self._rope))
         return offsets
 
+    def _get_line_index(self) -> Optional[LineIndex]:
+        """The line index is built on first use and then handed from each version of the document
+        to the next by `apply_change`, which patches it in place.
+        Older versions fall back to the O(log n) lookups on the rope."""
+        index = self._line_index
+        if index is None:
+            index = self._line_index = LineIndex.of_rope(self._rope)
+        elif index is False:
+            return None
+        return index
+
     def get_line_start_offset(self, line_index: int) -> int:
-        if line_index == 0:
-            return 0
-        if line_index >= self.line_count:
-            return len(self.text)
-        return self.line_offsets[line_index - 1]
+        index = self._get_line_index()
+        if index is None:
+            return self._rope.line_start(line_index)
+        return index.line_start(line_index)
 
     def get_line_end_offset(self, line_index: int) -> int:
-        if line_index >= self.line_count:
-            return len(self.text)
-        return self.line_offsets[line_index]
+        return self.get_line_start_offset(line_index + 1)
+
+    def get_line_of_offset(self, offset: int) -> int:
+        index = self._get_line_index()
+        if index is None:
+            return self._rope.line_of_offset(offset)
+        return index.line_of_offset(offset)
 
     def get_line(self, index: int) -> str:
-        return self.text[self.get_line_start_offset(index) : self.get_line_end_offset(index)]
+        return self._rope.slice(self.get_line_start_offset(index), self.get_line_end_offset(index))
 
     @property
     def position_encoding(self):
         return position_encoding_context.get()
 
+    def _line_table(self, start: int, end: int) -> Optional[Utf16Table]:
+        """UTF-16 column table for the line between the given offsets, None if the line is all in the BMP."""
+        rope = self._rope
+        if rope.astral == 0 or rope.astral_before(end) == rope.astral_before(start):
+            return None
+        return utf16_table(rope.slice(start, end))
+
     def position_to_offset(self, position: Position):
-        s = self.line_offsets
         if position.line >= self.line_count:
             # not a strictly valid position but map to end of string.
-            return len(self.text)
-        line = self.get_line(position.line)
-        offset = s[position.line - 1] if position.line > 0 else 0
+            return len(self._rope)
         assert self.position_encoding == PositionEncodingKind.UTF16
-        enc = "utf-16-le"
-        word_length = 2
-        if SURROGATE_KEY_END.match(line) is not None:
-            # caught a half of a surrogate pair.
-            line = line[:-1]
-        try:
-            line_encoded = line.encode(enc)
-        except UnicodeEncodeError:
-            # this can happen if we read half a surrogate pair.
-            logger.exception(
-                f"line is not valid unicode, returning position of line start:\n{line}"
-            )
-            return offset
-        line_encoded = line_encoded[: position.character * word_length]
-        try:
-            line_decoded = line_encoded.decode(enc)
-        except UnicodeDecodeError:
-            # this can happen if the line is not valid utf-16.
-            # eg half a surrogate pair?
-            # error for now but should be possible to recover.
-
-            raise RuntimeError(
-                f"failed to find offset for {position.line}, {position.character} \n{line}"
-            )
-        offset += len(line_decoded)
-        return offset
+        start = self.get_line_start_offset(position.line)
+        end = self.get_line_end_offset(position.line)
+        table = self._line_table(start, end)
+        if table is None:
+            return min(start + max(position.character, 0), end)
+        return start + table.to_code_points(position.character)
 
     def offset_to_position(self, offset: int) -> Position:
-        s = self.line_offsets
-        line_idx = bisect.bisect_right(s, offset)
-        if line_idx > self.line_count:
-            line_idx = self.line_count - 1
-        line = self.get_line(line_idx)
+        offset = min(max(offset, 0), len(self._rope))
+        line_idx = self.get_line_of_offset(offset)
         assert self.position_encoding == PositionEncodingKind.UTF16
-        enc = "utf-16-le"
-        word_length = 2
-        acc = s[line_idx - 1] if line_idx > 0 else 0
-        line_offset = offset - acc
-        subline = line[:line_offset]
-        if SURROGATE_KEY_END.match(subline) is not None:
-            # caught half a surrogate pair
-            subline = subline[:-1]
-        try:
-            char = len(subline.encode(enc))
-        except UnicodeEncodeError as e:
-            logger.error(f"failed to encode line, falling back to counting bytes:\n{subline}\n{e}")
-            char = len(subline) * 2
-
-        assert char % word_length == 0
-        char = char // 2
+        start = self.get_line_start_offset(line_idx)
+        table = self._line_table(start, self.get_line_end_offset(line_idx))
+        char = offset - start
+        if table is not None:
+            char = table.to_code_units(char)
         return Position(line=line_idx, character=char)
 
+    def positions_to_offsets(self, positions: Iterable[Position]) -> list[int]:
+        """Bulk version of `position_to_offset`, results are in the same order as the given positions.
+
+        The positions are sorted so that each line is only looked up once.
+        """
+        positions = list(positions)
+        assert self.position_encoding == PositionEncodingKind.UTF16
+        order = sorted(range(len(positions)), key=lambda i: positions[i].line)
+        result = [0] * len(positions)
+        size, line_count = len(self._rope), self.line_count
+        line, start, end, table = -1, 0, 0, None
+        for i in order:
+            pos = positions[i]
+            if pos.line >= line_count:
+                result[i] = size
+                continue
+            if pos.line != line:
+                line = pos.line
+                start = self.get_line_start_offset(line)
+                end = self.get_line_end_offset(line)
+                table = self._line_table(start, end)
+            if table is None:
+                result[i] = min(start + max(pos.character, 0), end)
+            else:
+                result[i] = start + table.to_code_points(pos.character)
+        return result
+
+    def offsets_to_positions(self, offsets: Iterable[int]) -> list[Position]:
+        """Bulk version of `offset_to_position`, results are in the same order as the given offsets.
+
+        The offsets are sorted so that consecutive offsets on the same line share a single line lookup.
+        """
+        offsets = list(offsets)
+        assert self.position_encoding == PositionEncodingKind.UTF16
+        order = sorted(range(len(offsets)), key=offsets.__getitem__)
+        result: list[Position] = [None] * len(offsets)  # type: ignore
+        size, last_line = len(self._rope), self.line_count - 1
+        line, start, end, table = -1, 0, -1, None
+        for i in order:
+            offset = min(max(offsets[i], 0), size)
+            # `end` is the start of the next line, except on the last line where it is included.
+            if line < 0 or (offset >= end and line < last_line):
+                line = self.get_line_of_offset(offset)
+                start = self.get_line_start_offset(line)
+                end = self.get_line_end_offset(line)
+                table = self._line_table(start, end)
+            char = offset - start
+            if table is not None:
+                char = table.to_code_units(char)
+            result[i] = Position(line=line, character=char)
+        return result
+
     def add_position(self, position: Position, delta_offset: int) -> Position:
         offset = self.position_to_offset(position)
         result = self.offset_to_position(offset + delta_offset)
@@ -333,6 +408,65 @@ class DocumentContext:
             self.position_to_offset(range.end),
         )
 
+    def apply_change(self, change: "TextDocumentContentChangeEvent"):
+        """Returns a new document with the given change applied.
+
+        This is O(log n) in the size of the document. `self` is not modified, so it remains a valid
+        snapshot of the document before the change.
+        """
+        if change.range is None:
+            return replace(self, text=change.text)
+        start, end = self.range_to_offsets(change.range)
+        after = replace(self, text=self._rope.replace(start, end, change.text))
+        index = self._line_index
+        if index:
+            text = change.text
+            # a "\r" and a "\n" on either side of the edit can become or stop being a single line break.
+            if self._rope.char(start - 1) == "\r":
+                start, text = start - 1, "\r" + text
+            if self._rope.char(end) == "\n":
+                end, text = end + 1, text + "\n"
+            index.apply_edit(start, end, text)
+            after._line_index = index
+            self._line_index = False
+        return after
+
+    def apply_changes(self, changes: Iterable["TextDocumentContentChangeEvent"], **kwargs):
+        """Applies each of the changes in turn and then replaces any fields given in `kwargs`."""
+        doc = self
+        for change in changes:
+            doc = doc.apply_change(change)
+        if kwargs:
+            after = replace(doc, text=doc.rope, **kwargs)
+            if doc is not self:
+                after._line_index, doc._line_index = doc._line_index, False
+            doc = after
+        return doc
+
+    def edit_offsets(
+        self, changes: Iterable["TextDocumentContentChangeEvent"]
+    ) -> list[tuple[int, int, str]]:
+        """The changes as `(start, end, text)` replacements, each in the offsets of the document that it is
+        applied to by `apply_changes`. A change without a range replaces the whole document."""
+        changes = list(changes)
+        doc = self.snapshot()
+        edits = []
+        for i, change in enumerate(changes):
+            if change.range is None:
+                edits.append((0, len(doc.rope), change.text))
+            else:
+                edits.append((*doc.range_to_offsets(change.range), change.text))
+            if i + 1 < len(changes):
+                doc = doc.apply_change(change)
+        return edits
+
+    def snapshot(self):
+        """An O(1) copy of the document. Edits are never made in place so the snapshot always
+        reflects the document at the time it was taken."""
+        doc = copy.copy(self)
+        doc._line_index = False
+        return doc
+
     # [todo] enter, exit does setdoc
 
 
@@ -375,3 +509,4 @@ class TextDocumentItem(DocumentContext):
     @property
     def id(self):
         return TextDocumentIdentifier(uri=self.uri, version=self.version)
+
@@ -0,0 +1,96 @@
+"""
+Incrementally maintained index of line start offsets.
+
+The index is an ``array('q')`` of the offsets where each line starts.
+Edits patch the array in place: the entries for the replaced lines are spliced out and the
+entries after the edit are shifted lazily.
+The pending shift only applies to entries at or after ``_shift_from``; it is moved along
+when the next edit happens, so repeatedly editing the same region of a file only touches
+the lines near the edit.
+"""
+from array import array
+from bisect import bisect_right
+
+from .rope import LINE_BREAK, Rope
+
+
+class LineIndex:
+    __slots__ = ("_starts", "_shift_from", "_shift", "length")
+
+    _starts: array
+    """ `_starts[i]` is the offset of line `i`, not counting the pending shift. """
+    _shift_from: int
+    _shift: int
+    """ Pending offset to add to every entry with index `>= _shift_from`. """
+    length: int
+    """ Length of the indexed text. """
+
+    def __init__(self, starts: array, length: int):
+        self._starts = starts
+        self._shift_from = len(starts)
+        self._shift = 0
+        self.length = length
+
+    @classmethod
+    def of_str(cls, text: str) -> "LineIndex":
+        starts = array("q", [0])
+        starts.extend(m.end() for m in LINE_BREAK.finditer(text))
+        return cls(starts, len(text))
+
+    @classmethod
+    def of_rope(cls, rope: Rope) -> "LineIndex":
+        starts = array("q", [0])
+        base = 0
+        for chunk in rope.chunks():
+            starts.extend(base + m.end() for m in LINE_BREAK.finditer(chunk))
+            base += len(chunk)
+        return cls(starts, base)
+
+    @property
+    def line_count(self) -> int:
+        return len(self._starts)
+
+    def line_start(self, line: int) -> int:
+        """Offset of the start of the given line. Lines past the end map to the end of the text."""
+        if line <= 0:
+            return 0
+        if line >= len(self._starts):
+            return self.length
+        x = self._starts[line]
+        return x + self._shift if line >= self._shift_from else x
+
+    def line_of_offset(self, offset: int) -> int:
+        """Index of the line containing the given offset."""
+        starts, s = self._starts, self._shift_from
+        i = bisect_right(starts, offset, 0, s)
+        if i == s and s < len(starts):
+            i = bisect_right(starts, offset - self._shift, s, len(starts))
+        return i - 1
+
+    def _move_shift(self, to: int):
+        starts, s, d = self._starts, self._shift_from, self._shift
+        if d != 0:
+            if to > s:
+                starts[s:to] = array("q", [x + d for x in starts[s:to]])
+            elif to < s:
+                starts[to:s] = array("q", [x - d for x in starts[to:s]])
+        self._shift_from = to
+
+    def apply_edit(self, start: int, end: int, text: str):
+        """Updates the index in place for the text between `start` and `end` being replaced by `text`.
+
+        An edit can join a `"\\r"` and a `"\\n"` into a single line break or split them apart, so the edit
+        has to include the `"\\r"` right before it and the `"\\n"` right after it, if there are any.
+        """
+        start_line = self.line_of_offset(start)
+        end_line = self.line_of_offset(end)
+        # make the entries up to and including end_line exact.
+        self._move_shift(end_line + 1)
+        new_starts = array("q", [start + m.end() for m in LINE_BREAK.finditer(text)])
+        self._starts[start_line + 1 : end_line + 1] = new_starts
+        delta = len(text) - (end - start)
+        self._shift_from = start_line + 1 + len(new_starts)
+        self._shift += delta
+        self.length += delta
+        if self._shift_from == len(self._starts):
+            self._shift = 0
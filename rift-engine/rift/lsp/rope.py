@@ -0,0 +1,308 @@
+"""
+Persistent rope used to store the text of open documents.
+
+Editors send a stream of small incremental edits to documents that can be tens of thousands of lines long.
+Storing the text as a single ``str`` means that every keystroke copies the whole document.
+A ``Rope`` is an immutable, height-balanced binary tree whose leaves are chunks of text.
+Replacing a range only rebuilds the O(log n) nodes on the path to the edit and every
+previous version of the document remains valid, so holding on to an old rope is a free snapshot.
+
+Each node also caches the number of line breaks below it, which gives an O(log n) line index.
+As in LSP, ``"\\r\\n"``, ``"\\n"`` and ``"\\r"`` are line breaks. A ``"\\r\\n"`` is never split between two
+leaves, so the line breaks of a rope are the line breaks of each of its leaves.
+Nodes also count the characters outside the basic multilingual plane, so that UTF-16 conversions can
+skip lines that don't contain any.
+"""
+import re
+from typing import Iterator, Optional
+
+from .utf16 import count_astral
+
+LEAF_SIZE = 1024
+"""Maximum number of characters stored in a single leaf."""
+LINE_BREAK = re.compile("\r\n|\r|\n")
+
+
+class Rope:
+    """An immutable string supporting O(log n) edits and line lookups.
+
+    You shouldn't construct these directly, use ``Rope.of_str`` instead.
+    """
+
+    __slots__ = ("left", "right", "chunk", "length", "newlines", "astral", "height", "cr_end", "lf_start")
+
+    left: Optional["Rope"]
+    right: Optional["Rope"]
+    chunk: str
+    """ The text of the leaf. Always empty for internal nodes. """
+    length: int
+    """ Number of code points in the rope. """
+    newlines: int
+    """ Number of line breaks in the rope. """
+    astral: int
+    """ Number of characters that take two UTF-16 code units. """
+    height: int
+    """ Leaves have height 0. """
+    cr_end: bool
+    """ Whether the rope ends with a `"\\r"`. """
+    lf_start: bool
+    """ Whether the rope starts with a `"\\n"`. """
+
+    def __init__(self, left: Optional["Rope"] = None, right: Optional["Rope"] = None, chunk=""):
+        self.left = left
+        self.right = right
+        self.chunk = chunk
+        if left is None or right is None:
+            assert left is None and right is None
+            self.length = len(chunk)
+            self.newlines = chunk.count("\n") + chunk.count("\r") - chunk.count("\r\n")
+            self.astral = count_astral(chunk)
+            self.height = 0
+            self.cr_end = chunk.endswith("\r")
+            self.lf_start = chunk.startswith("\n")
+        else:
+            self.length = left.length + right.length
+            self.newlines = left.newlines + right.newlines
+            self.astral = left.astral + right.astral
+            self.height = max(left.height, right.height) + 1
+            self.cr_end = right.cr_end
+            self.lf_start = left.lf_start
+
+    @classmethod
+    def of_str(cls, text: str) -> "Rope":
+        """Builds a balanced rope from the given string in O(n)."""
+        if len(text) <= LEAF_SIZE:
+            return Rope(chunk=text)
+        cuts = list(range(0, len(text), LEAF_SIZE)) + [len(text)]
+        for k in range(1, len(cuts) - 1):
+            if text[cuts[k] - 1] == "\r" and text[cuts[k]] == "\n":
+                cuts[k] -= 1
+        nodes = [Rope(chunk=text[a:b]) for a, b in zip(cuts, cuts[1:])]
+        while len(nodes) > 1:
+            paired = [Rope(nodes[i], nodes[i + 1]) for i in range(0, len(nodes) - 1, 2)]
+            if len(nodes) % 2 == 1:
+                paired.append(nodes[-1])
+            nodes = paired
+        return nodes[0]
+
+    @property
+    def is_leaf(self) -> bool:
+        return self.height == 0
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return "".join(self.chunks())
+
+    def __repr__(self):
+        return f"Rope(length={self.length}, newlines={self.newlines}, height={self.height})"
+
+    def __add__(self, other: "Rope") -> "Rope":
+        return _join(self, other)
+
+    def __getitem__(self, key: slice) -> str:
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("ropes only support contiguous slicing")
+        start, stop, _ = key.indices(self.length)
+        return self.slice(start, stop)
+
+    def chunks(self) -> Iterator[str]:
+        """Yields the leaf chunks from left to right."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.is_leaf:
+                if node.chunk:
+                    yield node.chunk
+            else:
+                stack.append(node.right)
+                stack.append(node.left)
+
+    def slice(self, start: int, end: int) -> str:
+        """Returns the text between the given offsets. O(log n + end - start)."""
+        start = max(start, 0)
+        end = min(end, self.length)
+        if start >= end:
+            return ""
+        acc: list[str] = []
+        _collect(self, start, end, acc)
+        return "".join(acc)
+
+    def char(self, offset: int) -> str:
+        """The character at the given offset, or "" past the end of the rope."""
+        if not 0 <= offset < self.length:
+            return ""
+        node = self
+        while not node.is_leaf:
+            if offset < node.left.length:
+                node = node.left
+            else:
+                offset -= node.left.length
+                node = node.right
+        return node.chunk[offset]
+
+    def split(self, offset: int) -> tuple["Rope", "Rope"]:
+        """Splits the rope into the text before and after the given offset."""
+        return _split(self, offset)
+
+    def replace(self, start: int, end: int, text: str) -> "Rope":
+        """Returns a new rope where the text between ``start`` and ``end`` is replaced with ``text``."""
+        if not (0 <= start <= end <= self.length):
+            raise IndexError(f"invalid range {start}:{end} for rope of length {self.length}")
+        before, rest = _split(self, start)
+        _, after = _split(rest, end - start)
+        return _join(_join(before, Rope.of_str(text)), after)
+
+    def line_start(self, line: int) -> int:
+        """Offset of the first character of the given line.
+
+        Lines past the end of the rope are mapped to the end of the rope.
+        """
+        if line <= 0:
+            return 0
+        if line > self.newlines:
+            return self.length
+        node, offset, k = self, 0, line
+        while not node.is_leaf:
+            if k <= node.left.newlines:
+                node = node.left
+            else:
+                k -= node.left.newlines
+                offset += node.left.length
+                node = node.right
+        breaks = LINE_BREAK.finditer(node.chunk)
+        for _ in range(k - 1):
+            next(breaks)
+        return offset + next(breaks).end()
+
+    def line_of_offset(self, offset: int) -> int:
+        """Index of the line containing the given offset, this is the number of line breaks before the offset."""
+        offset = min(max(offset, 0), self.length)
+        node, n = self, 0
+        while not node.is_leaf:
+            if offset <= node.left.length:
+                node = node.left
+            else:
+                n += node.left.newlines
+                offset -= node.left.length
+                node = node.right
+        return n + _breaks_before(node.chunk, offset)
+
+    def astral_before(self, offset: int) -> int:
+        """Number of astral characters before the given offset."""
+        offset = min(max(offset, 0), self.length)
+        node, n = self, 0
+        while not node.is_leaf and node.astral > 0:
+            if offset <= node.left.length:
+                node = node.left
+            else:
+                n += node.left.astral
+                offset -= node.left.length
+                node = node.right
+        if node.astral == 0:
+            return n
+        return n + count_astral(node.chunk, 0, offset)
+
+
+EMPTY = Rope()
+
+
+def _breaks_before(chunk: str, offset: int) -> int:
+    n = len(LINE_BREAK.findall(chunk, 0, offset))
+    if 0 < offset < len(chunk) and chunk[offset - 1] == "\r" and chunk[offset] == "\n":
+        # the offset is inside a "\r\n", the line break isn't before it.
+        n -= 1
+    return n
+
+
+def _collect(node: Rope, start: int, end: int, acc: list[str]):
+    if node.is_leaf:
+        acc.append(node.chunk[start:end])
+        return
+    n = node.left.length
+    if start < n:
+        _collect(node.left, start, min(end, n), acc)
+    if end > n:
+        _collect(node.right, max(start - n, 0), end - n, acc)
+
+
+def _split(node: Rope, i: int) -> tuple[Rope, Rope]:
+    if i <= 0:
+        return EMPTY, node
+    if i >= node.length:
+        return node, EMPTY
+    if node.is_leaf:
+        return Rope(chunk=node.chunk[:i]), Rope(chunk=node.chunk[i:])
+    n = node.left.length
+    if i == n:
+        return node.left, node.right
+    elif i < n:
+        a, b = _split(node.left, i)
+        return a, _join(b, node.right)
+    else:
+        a, b = _split(node.right, i - n)
+        return _join(node.left, a), b
+
+
+def _join(a: Rope, b: Rope) -> Rope:
+    if a.length == 0:
+        return b
+    if b.length == 0:
+        return a
+    if a.cr_end and b.lf_start:
+        # keep the "\r\n" in a single leaf.
+        head, _ = _split(a, a.length - 1)
+        _, tail = _split(b, 1)
+        return _join(_join(head, Rope(chunk="\r\n")), tail)
+    # merge small leaves into their neighbour so that typing doesn't fragment the tree.
+    if b.is_leaf:
+        merged = _append_chunk(a, b.chunk)
+        if merged is not None:
+            return merged
+    if a.is_leaf:
+        merged = _prepend_chunk(b, a.chunk)
+        if merged is not None:
+            return merged
+    return _concat(a, b)
+
+
+def _append_chunk(node: Rope, chunk: str) -> Optional[Rope]:
+    if node.is_leaf:
+        if len(node.chunk) + len(chunk) > LEAF_SIZE:
+            return None
+        return Rope(chunk=node.chunk + chunk)
+    r = _append_chunk(node.right, chunk)
+    return None if r is None else Rope(node.left, r)
+
+
+def _prepend_chunk(node: Rope, chunk: str) -> Optional[Rope]:
+    if node.is_leaf:
+        if len(node.chunk) + len(chunk) > LEAF_SIZE:
+            return None
+        return Rope(chunk=chunk + node.chunk)
+    l = _prepend_chunk(node.left, chunk)
+    return None if l is None else Rope(l, node.right)
+
+
+def _concat(a: Rope, b: Rope) -> Rope:
+    """AVL join: descend the spine of the taller tree and rebalance on the way back up."""
+    if a.height > b.height + 1:
+        return _balance(a.left, _concat(a.right, b))
+    if b.height > a.height + 1:
+        return _balance(_concat(a, b.left), b.right)
+    return Rope(a, b)
+
+
+def _balance(l: Rope, r: Rope) -> Rope:
+    if l.height > r.height + 1:
+        if l.left.height >= l.right.height:
+            return Rope(l.left, _balance(l.right, r))
+        lr = l.right
+        return Rope(_balance(l.left, lr.left), _balance(lr.right, r))
+    if r.height > l.height + 1:
+        if r.right.height >= r.left.height:
+            return Rope(_balance(l, r.left), r.right)
+        rl = r.left
+        return Rope(_balance(l, rl.left), _balance(rl.right, r.right))
+    return Rope(l, r)
@@ -31,11 +31,16 @@ logger = logging.getLogger("LSP")
 class LspServer(ExtraRpc):
     capabilities: ServerCapabilities
     position_encoding = "utf-16"
-    # [todo] consider using io.StringIO for the documents because they are mutating.
     documents: dict[lsp.DocumentUri, lsp.TextDocumentItem]
     change_callbacks: defaultdict[lsp.DocumentUri, set[Callable]]
     fts: dict[str, asyncio.Future]
     """set of open documents, the server will keep these synced with the client editor automatically."""
+    request_timeout = 120.0
+    """ Requests to the editor that don't wait on the user should not take this long. """
+    interactive_methods = frozenset(
+        ["workspace/applyEdit", "window/showMessageRequest", "window/showDocument"]
+    )
+    """ `workspace/applyEdit` waits for the user when the edit needs confirmation. """
 
     def __init__(self, transport):
         self.change_callbacks = defaultdict(set)
@@ -44,6 +49,15 @@ class LspServer(ExtraRpc):
         self.fts = dict()
         super().__init__(transport, init_mode=InitializationMode.ExpectInit)
 
+    def notification_key(self, req) -> Optional[str]:
+        """Notifications about the same document, eg `textDocument/didChange`, are handled in order."""
+        params = req.params
+        if isinstance(params, dict):
+            document = params.get("textDocument")
+            if isinstance(document, dict):
+                return document.get("uri")
+        return None
+
     @rpc_method("initialize")
     async def on_initialize(self, params: InitializeParams) -> InitializeResult:
         # [todo] inject lsp capabilities here.
@@ -84,20 +98,23 @@ class LspServer(ExtraRpc):
     async def apply_range_edit(
         self, uri: lsp.DocumentUri, range: lsp.Range, text: str, version: int = 0
     ):
+        return await self.apply_range_edits(
+            uri, [lsp.TextEdit(range=range, newText=text)], version=version
+        )
+
+    async def apply_range_edits(
+        self, uri: lsp.DocumentUri, edits: list[lsp.TextEdit], version: int = 0
+    ):
+        """Applies several edits to a document in a single `workspace/applyEdit` request.
+        The ranges of the edits all refer to the document before any of them are applied."""
         assert version is not None, "version must be given, or we get no edit."
         textDocument = lsp.TextDocumentIdentifier(uri=uri, version=version)  # [todo] version
-        newText = text
         params = lsp.ApplyWorkspaceEditParams(
             edit=lsp.WorkspaceEdit(
                 documentChanges=[
                     lsp.TextDocumentEdit(
                         textDocument=textDocument,
-                        edits=[
-                            lsp.TextEdit(
-                                range=range,
-                                newText=newText,
-                            )
-                        ],
+                        edits=edits,
                     )
                 ]
             )
@@ -128,10 +145,8 @@ class LspServer(ExtraRpc):
         if document is None:
             logger.error(f"document {item_id.uri} not opened")
             return
-        text = document.text
-        for change in params.contentChanges:
-            text = change.apply(text)
-        document_after = replace(document, version=item_id.version, text=text)
+        # `document` is left untouched so that callbacks and agents can keep it as a snapshot.
+        document_after = document.apply_changes(params.contentChanges, version=item_id.version)
         self.documents[item_id.uri] = document_after
 
         kwargs: Any = dict(before=document, after=document_after, changes=params)
@@ -282,7 +282,7 @@ class ServerCapabilities:
     # diagnosticProvider
     # workspaceSymbolProvider
     # workspace
-    # experimental : Any = field(default = None)
+    experimental: Optional[Any] = field(default=None)
 
 
 @dataclass
@@ -0,0 +1,84 @@
+"""
+Conversions between code point offsets (Python string indices) and UTF-16 code unit columns (LSP positions).
+
+The two only differ for characters outside the basic multilingual plane ('astral' characters, eg emoji),
+which take up two UTF-16 code units but a single code point.
+Lines without astral characters use the identity conversion, for other lines we lazily build a `Utf16Table`
+that records where the astral characters are, so converting a column is a bisection rather than
+re-encoding the line.
+"""
+import functools
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable, Optional
+
+ASTRAL = re.compile("[\U00010000-\U0010ffff]")
+
+
+def count_astral(text: str, start: int = 0, end: Optional[int] = None) -> int:
+    """Number of characters outside of the basic multilingual plane in ``text[start:end]``."""
+    if text.isascii():
+        return 0
+    if end is None:
+        end = len(text)
+    return sum(1 for _ in ASTRAL.finditer(text, start, end))
+
+
+def utf16_len(text: str) -> int:
+    """Length of the text in UTF-16 code units."""
+    return len(text) + count_astral(text)
+
+
+class Utf16Table:
+    """Column table for a single line that contains astral characters."""
+
+    __slots__ = ("length", "_indices", "_ends")
+
+    length: int
+    """ Length of the line in code points. """
+    _indices: array
+    """ Code point index of each astral character. """
+    _ends: array
+    """ UTF-16 column just after each astral character. """
+
+    def __init__(self, line: str):
+        self.length = len(line)
+        self._indices = array("q", [m.start() for m in ASTRAL.finditer(line)])
+        self._ends = array("q", [i + k + 2 for k, i in enumerate(self._indices)])
+
+    def to_code_points(self, column: int) -> int:
+        """Converts a UTF-16 column to a code point index.
+
+        Columns in the middle of a surrogate pair are rounded down and columns
+        past the end of the line are clamped to the end of the line.
+        """
+        if column <= 0:
+            return 0
+        j = bisect_right(self._ends, column)
+        index = column - j
+        if j < len(self._ends) and self._ends[j] - 1 == column:
+            index -= 1
+        return min(index, self.length)
+
+    def to_code_units(self, index: int) -> int:
+        """Converts a code point index to a UTF-16 column."""
+        index = min(max(index, 0), self.length)
+        return index + bisect_left(self._indices, index)
+
+    def to_code_points_many(self, columns: Iterable[int]) -> list[int]:
+        """Bulk version of `to_code_points`."""
+        return [self.to_code_points(c) for c in columns]
+
+    def to_code_units_many(self, indices: Iterable[int]) -> list[int]:
+        """Bulk version of `to_code_units`."""
+        return [self.to_code_units(i) for i in indices]
+
+
+@functools.lru_cache(maxsize=1024)
+def utf16_table(line: str) -> Optional[Utf16Table]:
+    """Gets the column table for the given line, or None if the line has no astral characters
+    (in which case UTF-16 columns and code point indices coincide)."""
+    if line.isascii() or ASTRAL.search(line) is None:
+        return None
+    return Utf16Table(line)
@@ -0,0 +1,172 @@
+"""
+Codecs for turning JSON-RPC messages into bytes and back.
+
+`RpcServer` encodes and decodes every frame through a `Codec`. The stdlib codec uses `MyJsonEncoder`, which
+calls `todict` for every node of the tree that isn't a plain JSON value. When `orjson` is installed we use it
+instead (see `dumps_bytes`): it serializes lists, dicts and scalars natively and only calls back into Python
+for the other nodes. `msgspec` is used for decoding when it is installed and `orjson` isn't.
+"""
+import json
+import logging
+from abc import ABC, abstractmethod
+from typing import Any
+
+from rift.util.ofdict import MyJsonEncoder, dumps_bytes
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+logger = logging.getLogger(__name__)
+
+
+class Codec(ABC):
+    name: str
+
+    @abstractmethod
+    def encode(self, obj: Any) -> bytes:
+        """Encodes a message, converting Python objects to JSON with `todict`."""
+        ...
+
+    @abstractmethod
+    def decode(self, data: bytes) -> Any:
+        """Decodes a message to JSON-like Python objects.
+
+        Raises:
+          json.JSONDecodeError: if the data isn't valid JSON.
+        """
+        ...
+
+
+class StdlibCodec(Codec):
+    name = "json"
+
+    def __init__(self):
+        self.encoder = MyJsonEncoder()
+
+    def encode(self, obj: Any) -> bytes:
+        return self.encoder.encode(obj).encode()
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+
+    def __init__(self):
+        assert orjson is not None
+
+    def encode(self, obj: Any) -> bytes:
+        return dumps_bytes(obj)
+
+    def decode(self, data: bytes) -> Any:
+        # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+        return orjson.loads(data)
+
+
+class MsgspecCodec(StdlibCodec):
+    """Stdlib encoding and msgspec decoding.
+    msgspec always encodes dataclasses itself, which would skip our `todict` conventions."""
+
+    name = "msgspec"
+
+    def __init__(self):
+        assert msgspec is not None
+        super().__init__()
+        self.decoder = msgspec.json.Decoder()
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            return self.decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise json.JSONDecodeError(str(e), data.decode(errors="replace"), 0) from e
+
+
+def default_codec() -> Codec:
+    """The fastest codec that is installed."""
+    if orjson is not None:
+        return OrjsonCodec()
+    if msgspec is not None:
+        return MsgspecCodec()
+    return StdlibCodec()
+
+
+if __name__ == "__main__":
+    # Micro-benchmark on a synthetic recording of the traffic of a code edit session:
+    # didChange notifications from the editor, applyEdit requests and progress notifications
+    # carrying the chat history.
+    import timeit
+
+    import rift.lsp.types as lsp
+    from rift.rpc.jsonrpc import Request, Response
+
+    history = [
+        {"role": "user", "content": f"please refactor function number {i} " * 5}
+        if i % 2
+        else {"role": "assistant", "content": "ok " * 40}
+        for i in range(30)
+    ]
+    uri = "file:///project/main.py"
+    traffic: list[Any] = []
+    for i in range(200):
+        traffic.append(
+            Request(
+                method="textDocument/didChange",
+                params=lsp.DidChangeTextDocumentParams(
+                    textDocument=lsp.TextDocumentIdentifier(uri=uri, version=i),
+                    contentChanges=[
+                        lsp.TextDocumentContentChangeEvent(
+                            lsp.Range.mk(i, 0, i, 4), f"x_{i} = {i}\n"
+                        )
+                    ],
+                ),
+            )
+        )
+        traffic.append(
+            Request(
+                method="workspace/applyEdit",
+                id=i,
+                params=lsp.ApplyWorkspaceEditParams(
+                    edit=lsp.WorkspaceEdit(
+                        documentChanges=[
+                            lsp.TextDocumentEdit(
+                                textDocument=lsp.TextDocumentIdentifier(uri=uri, version=0),
+                                edits=[lsp.TextEdit(lsp.Range.mk(i, 0, i + 1, 0), "y = 1\n")],
+                            )
+                        ]
+                    )
+                ),
+            )
+        )
+        traffic.append(
+            Request(
+                method="morph/rift_chat_1_send_progress",
+                params={"id": 1, "status": "running", "payload": {"messages": history}},
+            )
+        )
+        traffic.append(Response(id=i, result={"applied": True}))
+
+    codecs: list[Codec] = [StdlibCodec()]
+    if orjson is not None:
+        codecs.append(OrjsonCodec())
+    if msgspec is not None:
+        codecs.append(MsgspecCodec())
+    reference = MyJsonEncoder()
+    print(f"{len(traffic)} messages, {sum(len(reference.encode(m)) for m in traffic)} bytes")
+    print(f"{'codec':>10} {'encode (us/msg)':>16} {'decode (us/msg)':>16}")
+    baseline = lambda: [reference.encode(m).encode() for m in traffic]
+    t = timeit.timeit(baseline, number=5) / 5 / len(traffic)
+    print(f"{'baseline':>10} {t * 1e6:>16.1f} {'':>16}")
+    for codec in codecs:
+        encoded = [codec.encode(m) for m in traffic]
+        assert [json.loads(e) for e in encoded] == [json.loads(reference.encode(m)) for m in traffic]
+        enc = timeit.timeit(lambda: [codec.encode(m) for m in traffic], number=5) / 5 / len(traffic)
+        dec = timeit.timeit(lambda: [codec.decode(e) for e in encoded], number=5) / 5 / len(traffic)
+        print(f"{codec.name:>10} {enc * 1e6:>16.1f} {dec * 1e6:>16.1f}")
@@ -4,9 +4,19 @@ This file is adapted from  https://github.com/EdAyers/sss
 """
 import asyncio
 import logging
+import time
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Any, AsyncGenerator, AsyncIterator, Callable, Generic, Optional, Union
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Callable,
+    Generic,
+    Hashable,
+    Optional,
+    Union,
+)
 from uuid import uuid4
 
 try:
@@ -14,6 +24,7 @@ try:
 except:
     from typing_extensions import TypeAlias, TypeVar
 
+from .codec import Codec
 from .jsonrpc import InitializationMode, RpcServer, rpc_method
 from .transport import Transport
 
@@ -21,6 +32,8 @@ ProgressToken: TypeAlias = Union[str, int]
 
 logger = logging.getLogger(__name__)
 
+PROGRESS_INTERVAL = 0.05
+
 
 class WorkDoneProgressParams:
     workDoneToken: Optional[ProgressToken]
@@ -108,14 +121,23 @@ class ExtraRpc(RpcServer):
     """
 
     _my_progress: defaultdict[ProgressToken, set[RequestFutureWithProgress]]
+    progress_interval: float = PROGRESS_INTERVAL
+    """ Minimum time in seconds between two notifications sent with `notify_throttled` with the same key. """
+    _throttle_sent: dict[tuple[str, Any], float]
+    _throttle_pending: dict[tuple[str, Any], tuple[Any, Optional[Callable[[Any], Any]]]]
+    _throttle_tasks: dict[tuple[str, Any], asyncio.Task]
 
     def __init__(
         self,
         transport: Transport,
         init_mode: InitializationMode = InitializationMode.NoInit,
+        codec: Optional[Codec] = None,
     ):
-        super().__init__(transport, init_mode=init_mode)
+        super().__init__(transport, init_mode=init_mode, codec=codec)
         self._my_progress = defaultdict(set)
+        self._throttle_sent = {}
+        self._throttle_pending = {}
+        self._throttle_tasks = {}
 
     def request_with_progress(self, method: str, params: WorkDoneProgressParams):
         """Same as `request` but params include a 'progress token' that lets
@@ -143,10 +165,76 @@ class ExtraRpc(RpcServer):
         for rfwp in self._my_progress[token]:
             rfwp._put(params.value)
 
-    async def send_progress_notification(self, token: ProgressToken, value: Any):
-        await self.notify("$/progress", ProgressNotification(token, value))
+    @rpc_method("morph/metrics")
+    def on_metrics(self, params: Any) -> dict[str, Any]:
+        """Returns `metrics_snapshot`: per-method counts and latency quantiles, requests in flight and bytes sent and received."""
+        return self.metrics_snapshot()
+
+    async def send_progress_notification(
+        self, token: ProgressToken, value: Any, final: bool = False
+    ):
+        await self.notify_throttled(
+            "$/progress", ProgressNotification(token, value), key=token, final=final
+        )
+
+    async def notify_throttled(
+        self,
+        method: str,
+        params: Any,
+        key: Optional[Hashable] = None,
+        final: bool = False,
+        encode: Optional[Callable[[Any], Any]] = None,
+    ):
+        """Same as `notify`, but sends at most one notification per `progress_interval` for each
+        `(method, key)`. Updates that arrive in the meantime replace each other and only the latest one is
+        sent when the interval is over.
+
+        Use `final=True` for the last update: the pending update, if any, is sent first and then this one,
+        straight away.
+
+        `encode`, if given, is called on `params` when the notification is actually sent, and its result is
+        sent instead. This is for params that depend on what was sent before, eg deltas: updates that are
+        replaced before they are sent are never encoded.
+        """
+        k = (method, key)
+        if final:
+            flush = self._throttle_tasks.pop(k, None)
+            if flush is not None:
+                flush.cancel()
+            pending = self._throttle_pending.pop(k, None)
+            self._throttle_sent.pop(k, None)
+            if pending is not None:
+                await self._notify_encoded(method, *pending)
+            await self._notify_encoded(method, params, encode)
+            return
+        now = time.monotonic()
+        last = self._throttle_sent.get(k)
+        if k not in self._throttle_tasks and (last is None or now - last >= self.progress_interval):
+            self._throttle_sent[k] = now
+            await self._notify_encoded(method, params, encode)
+            return
+        self._throttle_pending[k] = (params, encode)
+        if k not in self._throttle_tasks:
+            delay = last + self.progress_interval - now
+            self._throttle_tasks[k] = asyncio.create_task(self._flush_throttled(k, delay))
+
+    async def _notify_encoded(
+        self, method: str, params: Any, encode: Optional[Callable[[Any], Any]]
+    ):
+        await self.notify(method, params if encode is None else encode(params))
+
+    async def _flush_throttled(self, k: tuple[str, Any], delay: float):
+        await asyncio.sleep(delay)
+        pending = self._throttle_pending.pop(k, None)
+        del self._throttle_tasks[k]
+        if pending is None:
+            return
+        self._throttle_sent[k] = time.monotonic()
+        try:
+            await self._notify_encoded(k[0], *pending)
+        except Exception as e:
+            logger.debug(f"failed to send throttled {k[0]}: {e}")
 
-    # [todo] support throttling progress reporting
     # [todo] common progress use cases like partial results and progress bars.
     # [todo] make sure cancellations are properly handled with progress reporting.
     # [todo] move $/cancelRequest handler here
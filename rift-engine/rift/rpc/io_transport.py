@@ -4,6 +4,8 @@ This file is adapted from  https://github.com/EdAyers/sss
 """
 import asyncio
 import sys
+from dataclasses import dataclass
+from typing import Optional
 
 from .transport import Transport, TransportClosedError, TransportClosedOK, TransportError
 
@@ -21,64 +23,130 @@ async def create_pipe_streams(in_pipe, out_pipe):
     return reader, writer
 
 
+@dataclass
+class TransportCounters:
+    """Running totals of the traffic through a transport."""
+
+    messages_sent: int = 0
+    bytes_sent: int = 0
+    writes: int = 0
+    """ Number of `writer.write` calls, each of which carries one or more messages. """
+    messages_received: int = 0
+    bytes_received: int = 0
+
+
 class AsyncStreamTransport(Transport):
     """Create a transport from a asyncio StreamReader, StreamWriter pair.
 
     We assume the message protocol is that described in LSP
     https://microsoft.github.io/language-server-protocol/specifications/lsp/3.17/specification/#baseProtocol
 
-    That is, a sequence of newline delimited http-like header strings, terminated by a double newline.
+    That is, a sequence of "\\r\\n" delimited http-like header strings, terminated by a double "\\r\\n".
+    Headers delimited by "\\n" alone are accepted too.
     One of the headers needs to be "content-length" integer, and then that number of bytes is read from the stream.
+
+    Messages sent during the same tick of the event loop (or while the previous batch is draining) are written
+    to the stream together, so a burst of notifications costs a single write and a single drain.
     """
 
+    counters: TransportCounters
+
     def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         self.reader = reader
         self.writer = writer
+        self.counters = TransportCounters()
+        self._queue: list[bytes] = []
+        self._batch: Optional[asyncio.Future[None]] = None
+        """ Resolved once the messages in `_queue` have been written and drained. """
+        self._flusher: Optional[asyncio.Task] = None
 
     async def recv(self):
         """Recieves data from the stream. If EOF is reached, raises TransportClosedOK error."""
-        # read the header
-        header = {}
+        # read the header, a line at a time so that "\n" line endings are accepted too.
+        content_length = None
+        header_size = 0
         while True:
-            line = await self.reader.readline()
+            try:
+                line = await self.reader.readline()
+            except ValueError as e:
+                raise TransportError(f"header is too long") from e
             if line == b"":
-                assert self.reader.at_eof()
-                if len(header) == 0:
+                if header_size == 0:
                     raise TransportClosedOK("end of stream")
-                else:
-                    raise TransportClosedError(f"unexpected end of stream")
-            try:
-                # [todo] should be 'latin-1' encoding?
-                line = line.decode().strip()
-            except UnicodeDecodeError as e:
-                raise TransportError(f"invalid utf-8 in header:\n{line}'")
-            if line == "":
+                raise TransportClosedError(f"unexpected end of stream")
+            header_size += len(line)
+            line = line.strip()
+            if line == b"":
                 break
-            if ":" not in line:
-                if "HTTP/" in line:
+            k, sep, v = line.partition(b":")
+            if not sep:
+                if b"HTTP/" in line:
                     # [todo] gracefully return a valid http 400 error and a message about
                     # how to get started with rift.
                     raise TransportError(
                         f"Looks like you're trying to use Rift with a web browser. Please read the getting started docs to learn how to use Rift."
                     )
-                raise TransportError(f"invalid header, expecting a colon:\n{line}")
-            k, v = line.split(":", 1)
-            header[k.lower()] = v
-        content_length = header.get("content-length")
+                raise TransportError(f"invalid header, expecting a colon:\n{line!r}")
+            if k.strip().lower() == b"content-length":
+                try:
+                    content_length = int(v)
+                except ValueError as e:
+                    raise TransportError(f"invalid content-length: {v!r}") from e
         if content_length is None:
             raise TransportError("invalid datagram: no content-length in header")
-        content_length = int(content_length)
         # read the body
         try:
             data = await self.reader.readexactly(content_length)
-            return data
         except asyncio.IncompleteReadError as e:
             raise TransportClosedError("unexpected end of stream") from e
+        self.counters.messages_received += 1
+        self.counters.bytes_received += header_size + content_length
+        return data
 
-    async def send(self, data: bytes, header={}):
-        header["Content-Length"] = len(data)
-        header = "".join(f"{k}:{v}\r\n" for k, v in header.items())
-        header += "\r\n"
-        self.writer.write(header.encode())
-        self.writer.write(data)
-        await self.writer.drain()
+    async def send(self, data: bytes, header: Optional[dict] = None):
+        """Queues the message and waits until it has been written to the stream and drained."""
+        if header:
+            header = {**header, "Content-Length": len(data)}
+            head = "".join(f"{k}:{v}\r\n" for k, v in header.items()).encode() + b"\r\n"
+        else:
+            head = b"Content-Length:%d\r\n\r\n" % len(data)
+        self._queue.append(head)
+        self._queue.append(data)
+        self.counters.messages_sent += 1
+        self.counters.bytes_sent += len(head) + len(data)
+        if self._batch is None:
+            self._batch = asyncio.get_running_loop().create_future()
+        batch = self._batch
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush())
+        # shield so that a cancelled sender doesn't cancel the batch for everybody else.
+        await asyncio.shield(batch)
+
+    async def _flush(self):
+        # the task first runs on the next tick, so everything sent during this tick goes out together.
+        batch = None
+        try:
+            while self._queue:
+                queue, batch = self._queue, self._batch
+                self._queue, self._batch = [], None
+                try:
+                    self.writer.write(b"".join(queue))
+                    self.counters.writes += 1
+                    await self.writer.drain()
+                except Exception as e:
+                    if batch is not None and not batch.done():
+                        batch.set_exception(e)
+                        # the exception is raised in the senders, don't warn that it wasn't retrieved.
+                        batch.exception()
+                    continue
+                if batch is not None and not batch.done():
+                    batch.set_result(None)
+        except asyncio.CancelledError:
+            # nothing is going to write the queued messages anymore, let their senders return.
+            pending, self._queue, self._batch = self._batch, [], None
+            for b in (batch, pending):
+                if b is not None and not b.done():
+                    b.cancel()
+            raise
+        finally:
+            self._flusher = None
@@ -6,16 +6,22 @@ import asyncio
 import inspect
 import json
 import logging
+import math
 import sys
+import time
 import warnings
 from asyncio import Future, Task
 from dataclasses import MISSING, asdict, dataclass, field, is_dataclass
 from enum import Enum
 from functools import partial, singledispatch
-from typing import Any, Optional, Union
+from pathlib import Path
+from typing import Any, Hashable, Optional, Union
 
-from rift.util.ofdict import MyJsonEncoder, ofdict, todict, todict_dataclass
+from rift.util.ofdict import dumps_bytes, ofdict_decoder, todict, todict_dataclass
 
+from .codec import Codec, default_codec
+from .metrics import MethodStats, RpcMetrics
+from .scheduler import HIGH_WATERMARK, MAX_CONCURRENCY, NotificationScheduler
 from .transport import Transport, TransportClosedError, TransportClosedOK, TransportError
 
 logger = logging.getLogger(__name__)
@@ -68,9 +74,6 @@ class ErrorCode(Enum):
     """ The client cancelled a request and the server has detected the cancel. """
 
 
-encoder = MyJsonEncoder()
-
-
 @dataclass
 class Request:
     """A request object for JSON-RPC.
@@ -92,7 +95,7 @@ class Request:
 
     def to_bytes(self):
         """Encode the request as bytes. Note that this will automatically convert Python objects to JSON using MyJsonEncoder."""
-        return encoder.encode(self).encode()
+        return dumps_bytes(self)
 
     def __str__(self):
         if self.id is None:
@@ -166,13 +169,33 @@ class Response:
     jsonrpc: str = field(default="2.0")
 
     def __todict__(self):
-        d = todict_dataclass(self)
-        if "error" not in d and "result" not in d:
-            d["result"] = None
+        # same as `todict_dataclass`, but every response goes through here so skip the reflection.
+        d: dict[str, Any] = {}
+        if self.id is not None:
+            d["id"] = self.id
+        if self.result is not None or self.error is None:
+            d["result"] = self.result
+        if self.error is not None:
+            d["error"] = self.error
+        d["jsonrpc"] = self.jsonrpc
         return d
 
     def to_bytes(self):
-        return encoder.encode(self).encode()
+        return dumps_bytes(self)
+
+
+@dataclass
+class MethodRecord:
+    """Everything the dispatcher needs to call a method, computed once when it is registered."""
+
+    fn: Any
+    """ The method with the dispatcher's extra kwargs bound. """
+    param_type: Any
+    return_type: Any
+    decode: Any
+    """ Converts the JSON params to `param_type`, see `ofdict_decoder`. """
+    is_async: bool
+    stats: MethodStats
 
 
 class Dispatcher:
@@ -183,20 +206,33 @@ class Dispatcher:
     If the python function's argument and return type are annotated, then the dispatcher will use
     `todict` and `fromdict` to convert the arguments to and from JSON.
 
+    The signature of each method is inspected once, when it's registered, and the dispatcher keeps
+    call counts and latency histograms for each method (see `stats`).
     """
 
+    records: dict[str, MethodRecord]
+
     def __init__(self, methods=None, extra_kwargs={}):
         self.methods = methods or {}
         self.extra_kwargs = extra_kwargs
+        self.records = {}
 
     def __contains__(self, method):
         return method in self.methods
 
-    def __getitem__(self, method):
-        return partial(self.methods[method], **self.extra_kwargs)
-
-    def param_type(self, method):
-        fn = self.methods[method]
+    def record(self, method: str) -> Optional[MethodRecord]:
+        """The dispatch record of the method, or None if there is no such method."""
+        r = self.records.get(method)
+        fn = self.methods.get(method)
+        if r is None or r.fn.func is not fn:
+            if fn is None:
+                return None
+            # registered directly in `self.methods`, or through a dispatcher sharing them.
+            r = self._make_record(fn)
+            self.records[method] = r
+        return r
+
+    def _make_record(self, fn) -> MethodRecord:
         sig = inspect.signature(fn)
         if len(sig.parameters) == 0:
             T = Any
@@ -205,16 +241,32 @@ class Dispatcher:
             T = P.annotation
             if T is inspect.Parameter.empty:
                 T = Any
-        return T
+        R = sig.return_annotation
+        if R is inspect.Signature.empty:
+            R = Any
+        return MethodRecord(
+            fn=partial(fn, **self.extra_kwargs),
+            param_type=T,
+            return_type=R,
+            decode=ofdict_decoder(T),
+            is_async=inspect.iscoroutinefunction(fn),
+            stats=MethodStats(),
+        )
+
+    def _require(self, method) -> MethodRecord:
+        r = self.record(method)
+        if r is None:
+            raise KeyError(method)
+        return r
+
+    def __getitem__(self, method):
+        return self._require(method).fn
+
+    def param_type(self, method):
+        return self._require(method).param_type
 
     def return_type(self, method):
-        fn = self.methods[method]
-        sig = inspect.signature(fn)
-        a = sig.return_annotation
-        if a is inspect.Signature.empty:
-            return Any
-        else:
-            return a
+        return self._require(method).return_type
 
     def register(self, name=None):
         def core(fn):
@@ -222,6 +274,7 @@ class Dispatcher:
             if funcname in self.methods:
                 warnings.warn(f"method with name {funcname} already registered, overwriting")
             self.methods[funcname] = fn
+            self.records[funcname] = self._make_record(fn)
             return fn
 
         return core
@@ -230,11 +283,27 @@ class Dispatcher:
         return Dispatcher(self.methods, {**self.extra_kwargs, **kwargs})
 
     async def dispatch(self, method: str, params: Any):
-        fn = self[method]
-        result = fn(params)
-        if asyncio.iscoroutine(result):
-            result = await result
-        return result
+        return await self.call(self._require(method), params)
+
+    async def call(self, r: MethodRecord, params: Any):
+        """Calls the method of the record with already decoded params."""
+        start = time.perf_counter()
+        error = True
+        try:
+            if r.is_async:
+                result = await r.fn(params)
+            else:
+                result = r.fn(params)
+                if asyncio.iscoroutine(result):
+                    result = await result
+            error = False
+            return result
+        finally:
+            r.stats.record(time.perf_counter() - start, error)
+
+    def stats(self) -> dict[str, MethodStats]:
+        """The stats of the methods that have been called at least once."""
+        return {method: r.stats for method, r in self.records.items() if r.stats.calls > 0}
 
 
 server_count = 0
@@ -265,6 +334,20 @@ class ExitNotification(Exception):
     """Thrown when the server recieved an exit notifaction from its peer."""
 
 
+class RequestTimeoutError(TimeoutError):
+    """Raised by `RpcServer.request` when the peer doesn't respond in time."""
+
+    def __init__(self, method: str, id: "RequestId", timeout: float):
+        super().__init__(f"request {method}:{id} timed out after {timeout}s")
+        self.method = method
+        self.id = id
+        self.timeout = timeout
+
+
+REAPER_INTERVAL = 30.0
+""" Seconds between two checks for requests that the peer hasn't responded to. """
+
+
 def rpc_method(name: Optional[str] = None):
     """Decorate your method with this to say that you are implementing a JSON-RPC method.
 
@@ -369,7 +452,6 @@ class RpcServer:
 
     [todo] rename to RpcConnection, then RpcServer and RpcClient handle the different Init conventions for
     lifecycle.
-    [todo] add warnings if requests go unanswered for too long.
     """
 
     dispatcher: Dispatcher
@@ -385,7 +467,21 @@ class RpcServer:
     their_requests: dict[RequestId, Task]
     """ Requests that my peer has made to me. """
     notification_tasks: set[asyncio.Task]
-    """ Tasks running from notifications that my peer has sent to me. """
+    """ Tasks that aren't run by the scheduler, eg `$/cancelRequest` notifications. """
+    scheduler: NotificationScheduler
+    """ Runs the handlers of the notifications that my peer has sent to me, see `notification_key`. """
+    max_concurrent_notifications: int = MAX_CONCURRENCY
+    notification_high_watermark: int = HIGH_WATERMARK
+    codec: Codec
+    """ Used to encode and decode every message, defaults to the fastest JSON library installed. """
+    metrics: Optional[RpcMetrics]
+    """ Set by `enable_metrics`. """
+    request_timeout: Optional[float] = None
+    """ Default timeout in seconds of `request`, None to wait forever. """
+    interactive_methods: frozenset[str] = frozenset()
+    """ Requests that can wait on the user, eg to confirm an edit. `request_timeout` doesn't apply to them. """
+    stale_request_age: float = 60.0
+    """ Requests that have been waiting for a response for longer than this are logged by the reaper. """
 
     def __init__(
         self,
@@ -393,6 +489,7 @@ class RpcServer:
         dispatcher=None,
         name=None,
         init_mode: InitializationMode = InitializationMode.NoInit,
+        codec: Optional[Codec] = None,
     ):
         if not isinstance(transport, Transport):
             raise TypeError(
@@ -416,6 +513,15 @@ class RpcServer:
         self.their_requests = {}
         self.request_counter = 1000 * server_count
         self.notification_tasks = set()
+        self.scheduler = NotificationScheduler(
+            self._on_request,
+            max_concurrency=self.max_concurrent_notifications,
+            high_watermark=self.notification_high_watermark,
+        )
+        self.codec = codec or default_codec()
+        self.metrics = None
+        self._my_request_starts = {}
+        self._background_tasks = set()
 
         for name, method in inspect.getmembers(self, predicate=inspect.ismethod):
             rpc_method = getattr(method, "rpc_method", None)
@@ -427,8 +533,35 @@ class RpcServer:
     def __str__(self):
         return self.name
 
+    def notification_key(self, req: Request) -> Optional[Hashable]:
+        """Notifications with the same key are handled one at a time, in the order that they arrived.
+        Notifications with key None are handled concurrently. Override this to order notifications.
+
+        Requests wait for the notifications with their key that arrived before them to start, or for all of
+        the earlier notifications if their key is None."""
+        return None
+
+    def enable_metrics(self, dump_path: Optional[Union[str, Path]] = None) -> RpcMetrics:
+        """Starts recording the latencies of our requests, the number of requests in flight and the bytes sent
+        and received, see `metrics_snapshot`. If `dump_path` is given, the metrics are written there as JSON
+        when the server stops."""
+        if self.metrics is None:
+            self.metrics = RpcMetrics()
+        if dump_path is not None:
+            self.metrics.dump_path = Path(dump_path)
+        return self.metrics
+
+    def metrics_snapshot(self) -> dict[str, Any]:
+        """JSON-like summary of the metrics. Without `enable_metrics`, only the stats of the methods that
+        the peer called and the current number of requests in flight are filled in."""
+        return (self.metrics or RpcMetrics()).snapshot(self)
+
     async def _send(self, r: Union[Response, Request]):
-        await self.transport.send(r.to_bytes())
+        data = self.codec.encode(r)
+        if self.metrics is not None:
+            self.metrics.messages_out += 1
+            self.metrics.bytes_out += len(data)
+        await self.transport.send(data)
 
     async def notify(self, method: str, params: Optional[Any]):
         """Send a notification to the peer."""
@@ -439,7 +572,9 @@ class RpcServer:
         req = Request(method=method, params=params)
         await self._send(req)
 
-    async def request(self, method: str, params: Optional[Any]) -> asyncio.Future[Any]:
+    async def request(
+        self, method: str, params: Optional[Any], timeout: Optional[float] = None
+    ) -> asyncio.Future[Any]:
         """Send a request to the peer and wait for a response.
 
         Args:
@@ -449,19 +584,23 @@ class RpcServer:
         Returns:
             An awaitable that yields a json-like python object (ie something that you would get from `json.loads()`) representing the response from the peer.
 
+            - timeout: seconds to wait for the response, defaults to `self.request_timeout`, or forever for the
+              `interactive_methods`. Pass `math.inf` to wait forever.
+
         Raises:
             - RuntimeError: if the server is not in the running state.
             - ResponseError: if the peer responds with an error, you can use ResponseError.code to determine the cause of the error.
+            - RequestTimeoutError: if the peer doesn't respond in time. The peer is sent a `$/cancelRequest` notification.
 
-        Todo:
-           - Cancellation support: rather than a coro it should return a cancellable future.
-           - timeout?
+        If the calling task is cancelled, the peer is also sent a `$/cancelRequest` notification.
         """
         if self.status != RpcServerStatus.running:
             if self.init_mode != InitializationMode.SendInit or method != "initialize":
                 raise RuntimeError(
                     f"can't make new requests while server is in {self.status.name} state"
                 )
+        if timeout is None:
+            timeout = math.inf if method in self.interactive_methods else self.request_timeout
         self.request_counter += 1
         id = self.request_counter
         req = Request(method=method, id=id, params=params)
@@ -473,8 +612,61 @@ class RpcServer:
         if id in self.my_requests:
             raise RuntimeError(f"non-unique request id {id} found")
         self.my_requests[id] = fut
-        await self._send(req)
-        return await fut
+        self._my_request_starts[id] = (method, time.monotonic())
+        if self.metrics is not None:
+            self.metrics.observe("my_requests", len(self.my_requests))
+        start = time.perf_counter()
+        error = True
+        try:
+            await self._send(req)
+            if timeout is None or timeout == math.inf:
+                result = await fut
+            else:
+                result = await asyncio.wait_for(fut, timeout)
+            error = False
+            return result
+        except asyncio.TimeoutError:
+            await self._abandon_request(id)
+            raise RequestTimeoutError(method, id, timeout)
+        except asyncio.CancelledError:
+            # we can't await while being cancelled, send the cancel notification in the background.
+            if self.my_requests.get(id) is fut:
+                task = asyncio.create_task(self._abandon_request(id))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+            raise
+        finally:
+            self._my_request_starts.pop(id, None)
+            if self.metrics is not None:
+                self.metrics.record_outgoing(method, time.perf_counter() - start, error)
+
+    async def _abandon_request(self, id: RequestId):
+        """Forgets a request that we are no longer waiting for and tells the peer to cancel it."""
+        if self.my_requests.pop(id, None) is None:
+            return
+        if self.status != RpcServerStatus.running:
+            return
+        try:
+            await self.notify("$/cancelRequest", {"id": id})
+        except Exception as e:
+            logger.debug(f"{self} failed to send $/cancelRequest for {id}: {e}")
+
+    async def _reap_requests(self):
+        """Periodically reports the requests that the peer has been sitting on for a long time,
+        and drops the entries of requests that nobody is waiting for anymore."""
+        while True:
+            await asyncio.sleep(REAPER_INTERVAL)
+            now = time.monotonic()
+            for id, fut in list(self.my_requests.items()):
+                if fut.done():
+                    del self.my_requests[id]
+                    continue
+                method, started = self._my_request_starts.get(id, ("?", now))
+                age = now - started
+                if age >= self.stale_request_age:
+                    logger.warning(
+                        f"{self} has been waiting {age:.0f}s for a response to request {method}:{id}"
+                    )
 
     async def _send_init(self, init_param):
         """Send an initialization request to the peer."""
@@ -511,17 +703,25 @@ class RpcServer:
             task = asyncio.create_task(self._send_init(init_param))
             self.notification_tasks.add(task)
             task.add_done_callback(self.notification_tasks.discard)
+        reaper = asyncio.create_task(self._reap_requests())
         try:
             while True:
                 try:
                     data = await self.transport.recv()
-                    messages = json.loads(data)
+                    if self.metrics is not None:
+                        self.metrics.messages_in += 1
+                        self.metrics.bytes_in += len(data)
+                    messages = self.codec.decode(data)
                     if isinstance(messages, dict):
                         # datagram contains a single message
                         messages = [messages]
                     elif not isinstance(messages, list):
                         raise TypeError(f"expected list or dict, got {type(messages)}")
                     for message in messages:
+                        if not self.scheduler.has_capacity and self._is_scheduled(message):
+                            # backpressure only holds back notifications, so that everything read before
+                            # them (eg the responses that running handlers wait for) is routed.
+                            await self.scheduler.wait_for_capacity()
                         self._handle_message(message)
                 except TransportClosedOK as e:
                     logger.info(f"{self.name} transport closed gracefully: {e}")
@@ -556,9 +756,13 @@ class RpcServer:
             (_, e, _) = sys.exc_info()  # sys.exception() is 3.11 only
             if e is None:
                 e = ConnectionError(f"{self} shutdown")
+            reaper.cancel()
             for fut in self.my_requests.values():
-                fut.set_exception(e)
+                if not fut.done():
+                    fut.set_exception(e)
             self._shutdown()
+            if self.metrics is not None:
+                self.metrics.dump(self)
 
     def _shutdown(self):
         # [todo] also send cancel notifications to all our pending request futures.
@@ -566,14 +770,25 @@ class RpcServer:
             t.cancel("shutdown")
         for t in self.notification_tasks:
             t.cancel("shutdown")
+        self.scheduler.close()
         self.status = RpcServerStatus.shutdown
         logger.info(f"{self} entered shutdown state")
 
+    def _is_scheduled(self, message: Any) -> bool:
+        """Whether the message is a notification that `_handle_message` submits to the scheduler."""
+        return (
+            isinstance(message, dict)
+            and message.get("id") is None
+            and "result" not in message
+            and "error" not in message
+            and message.get("method") not in ("$/cancelRequest", "exit")
+        )
+
     def _handle_message(self, message: Any):
         # logger.info(f"incoming message {message=}")
         if "result" in message or "error" in message:
             # message is a Response
-            res = ofdict(Response, message)
+            res = ofdict_decoder(Response)(message)
             if res.id not in self.my_requests:
                 logger.error(f"received response for unknown request: {res}")
                 return
@@ -587,7 +802,7 @@ class RpcServer:
                     fut.set_result(res.result)
         else:
             # message is a Request.
-            req = ofdict(Request, message)
+            req = ofdict_decoder(Request)(message)
             if req.method == "exit":
                 # exit notification should kill the server immediately.
                 if self.status != RpcServerStatus.shutdown:
@@ -596,25 +811,38 @@ class RpcServer:
                 raise ExitNotification()
             if req.method == "shutdown":
                 self._shutdown()
+            id = req.id
+            if id is None and req.method != "$/cancelRequest":
+                # Request is a notification, no response expected.
+                self.scheduler.submit(req, self.notification_key(req))
+                if self.metrics is not None:
+                    self.metrics.observe("queued_notifications", self.scheduler.queued)
+                    self.metrics.observe("notification_tasks", len(self.scheduler.tasks))
+                return
+            # requests run straight away, but not before the notifications that arrived before them.
+            after = [] if id is None else self.scheduler.barrier(self.notification_key(req))
             task = asyncio.create_task(
-                self._on_request(req),
+                self._on_request(req, after),
                 name=f"{self.name} handle {req}",
             )
-            id = req.id
             if id is not None:
                 # Request expects a reponse
                 if id in self.their_requests:
                     raise invalid_request(f"request id {id} is already in use")
                 self.their_requests[id] = task
                 task.add_done_callback(lambda _: self.their_requests.pop(id))
+                if self.metrics is not None:
+                    self.metrics.observe("their_requests", len(self.their_requests))
             else:
-                # Request is a notification, no response expected.
+                # cancellations skip the scheduler so that they don't queue up behind what they cancel.
                 self.notification_tasks.add(task)
                 task.add_done_callback(self.notification_tasks.discard)
 
-    async def _on_request(self, req: Request) -> None:
-        """Handles a request from the peer."""
+    async def _on_request(self, req: Request, after: Optional[list[asyncio.Future]] = None) -> None:
+        """Handles a request from the peer, once the futures in `after` are done (see `NotificationScheduler.barrier`)."""
         try:
+            if after:
+                await asyncio.wait(after)
             result = await self._on_request_core(req)
         except asyncio.CancelledError as e:
             if not req.is_notification:
@@ -681,15 +909,15 @@ class RpcServer:
             # if t is None then the request has already completed and removed itself from self.their_requests
             return None
 
-        if req.method not in self.dispatcher:
+        record = self.dispatcher.record(req.method)
+        if record is None:
             raise method_not_found(req.method)
 
-        T = self.dispatcher.param_type(req.method)
         try:
-            params = ofdict(T, req.params)
+            params = record.decode(req.params)
         except TypeError as e:
-            message = f"{req.method} {type(e).__name__} failed to decode params to {T}: {e}"
+            message = f"{req.method} {type(e).__name__} failed to decode params to {record.param_type}: {e}"
             logger.exception(message)
             raise invalid_params(message)
-        result = await self.dispatcher.dispatch(req.method, params)
+        result = await self.dispatcher.call(record, params)
         return result
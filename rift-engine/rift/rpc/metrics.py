@@ -0,0 +1,123 @@
+"""
+Metrics for `RpcServer`.
+
+The dispatcher always keeps a `MethodStats` for each method that the peer calls (see `Dispatcher.stats`).
+Everything else here is opt-in, with `RpcServer.enable_metrics`: the latencies of the requests that we send
+to the peer (eg how long the editor takes to answer `workspace/applyEdit`), the number of requests and
+notifications in flight and the bytes sent and received.
+"""
+import json
+import logging
+import math
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from .jsonrpc import RpcServer
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, math.inf
+)  # fmt: skip
+""" Upper bounds in seconds of the buckets of the method latency histograms. """
+
+
+@dataclass
+class MethodStats:
+    """Call count and latency histogram of a JSON-RPC method."""
+
+    calls: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    buckets: list[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    """ `buckets[i]` is the number of calls that took at most `LATENCY_BUCKETS[i]` seconds and more than `LATENCY_BUCKETS[i - 1]`. """
+
+    def record(self, elapsed: float, error: bool = False):
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if error:
+            self.errors += 1
+        self.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket containing the `q`-quantile of the latencies."""
+        rank = q * self.calls
+        acc = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            acc += count
+            if acc >= rank and acc > 0:
+                return min(bound, self.max_time)
+        return 0.0
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean": self.total_time / self.calls if self.calls else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max_time,
+        }
+
+
+@dataclass
+class RpcMetrics:
+    """The opt-in metrics of an `RpcServer`."""
+
+    dump_path: Optional[Path] = None
+    """ If set, the metrics are written to this file as JSON when the server stops. """
+    started: float = field(default_factory=time.monotonic)
+    outgoing: dict[str, MethodStats] = field(default_factory=dict)
+    """ Latencies of the requests that we sent to the peer, by method. """
+    max_in_flight: dict[str, int] = field(default_factory=dict)
+    messages_in: int = 0
+    messages_out: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+    def record_outgoing(self, method: str, elapsed: float, error: bool):
+        stats = self.outgoing.get(method)
+        if stats is None:
+            stats = self.outgoing[method] = MethodStats()
+        stats.record(elapsed, error)
+
+    def observe(self, name: str, size: int):
+        """Records the current size of one of the in-flight collections of the server."""
+        if size > self.max_in_flight.get(name, 0):
+            self.max_in_flight[name] = size
+
+    def snapshot(self, server: "RpcServer") -> dict[str, Any]:
+        in_flight = {
+            "their_requests": len(server.their_requests),
+            "notification_tasks": len(server.notification_tasks) + len(server.scheduler.tasks),
+            "queued_notifications": server.scheduler.queued,
+            "my_requests": len(server.my_requests),
+        }
+        return {
+            "uptime": time.monotonic() - self.started,
+            "incoming": {m: s.summary() for m, s in sorted(server.dispatcher.stats().items())},
+            "outgoing": {m: s.summary() for m, s in sorted(self.outgoing.items())},
+            "in_flight": in_flight,
+            "max_in_flight": {k: max(v, self.max_in_flight.get(k, 0)) for k, v in in_flight.items()},
+            "messages_in": self.messages_in,
+            "messages_out": self.messages_out,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+    def dump(self, server: "RpcServer"):
+        if self.dump_path is None:
+            return
+        try:
+            self.dump_path.write_text(json.dumps(self.snapshot(server), indent=2))
+            logger.info(f"wrote metrics of {server} to {self.dump_path}")
+        except OSError as e:
+            logger.error(f"failed to write metrics to {self.dump_path}: {e}")
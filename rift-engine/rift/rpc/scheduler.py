@@ -0,0 +1,155 @@
+"""
+Scheduling of the handlers of incoming notifications.
+
+Notifications that share a key (eg `textDocument/didChange` for the same document) are handled one at a
+time, in the order they arrived, so that their handlers can't race. At most `max_concurrency` handlers run
+at once; the others wait in their queue. When more than `high_watermark` notifications are waiting, the
+next notification isn't submitted until the queues drain below `low_watermark`, which pauses
+`RpcServer.listen_forever`. Responses and cancellations read before that notification are still routed.
+
+Requests aren't queued, but they must not overtake the notifications that arrived before them (eg a request
+about a document has to see the `didChange` that was sent before it), see `barrier`.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = 32
+HIGH_WATERMARK = 256
+BACKPRESSURE_TIMEOUT = 5.0
+"""Longest time that reading is paused for. Handlers might be waiting on a response that is sent after the
+notification that we are holding back."""
+
+
+class NotificationScheduler:
+    queued: int
+    """ Number of notifications waiting for their handler to start. """
+    tasks: set[asyncio.Task]
+    """ The running handlers. """
+
+    def __init__(
+        self,
+        run: Callable[[Any], Awaitable[None]],
+        max_concurrency: int = MAX_CONCURRENCY,
+        high_watermark: int = HIGH_WATERMARK,
+        low_watermark: Optional[int] = None,
+    ):
+        self.run = run
+        self.max_concurrency = max_concurrency
+        self.high_watermark = high_watermark
+        self.low_watermark = high_watermark // 2 if low_watermark is None else low_watermark
+        self.queued = 0
+        self.tasks = set()
+        # a lane exists while it has queued or running notifications.
+        # Invariant: each lane is either running one notification or listed exactly once in `_ready`.
+        # the items of the lanes are `(seq, notification)`, `seq` counts the submitted notifications.
+        self._lanes: dict[Hashable, deque] = {}
+        self._ready: deque[Hashable] = deque()
+        self._seq = 0
+        self._started: dict[int, asyncio.Future] = {}
+        """ Futures resolved when the notification with the given seq starts, see `barrier`. """
+        self._has_capacity = asyncio.Event()
+        self._has_capacity.set()
+        self._closed = False
+
+    def submit(self, notification: Any, key: Optional[Hashable] = None):
+        """Queues the notification. Notifications with the same key are run in order, one at a time.
+        Notifications without a key can run in any order."""
+        if self._closed:
+            return
+        if key is None:
+            key = object()
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = deque()
+            self._ready.append(key)
+        self._seq += 1
+        lane.append((self._seq, notification))
+        self.queued += 1
+        if self.queued > self.high_watermark:
+            self._has_capacity.clear()
+        self._pump()
+
+    def _pump(self):
+        while len(self.tasks) < self.max_concurrency and self._ready:
+            key = self._ready.popleft()
+            seq, notification = self._lanes[key].popleft()
+            self.queued -= 1
+            started = self._started.pop(seq, None)
+            if started is not None:
+                started.set_result(None)
+            task = asyncio.create_task(self._run_one(key, notification))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        if self.queued <= self.low_watermark:
+            self._has_capacity.set()
+
+    async def _run_one(self, key: Hashable, notification: Any):
+        try:
+            await self.run(notification)
+        finally:
+            if not self._closed:
+                lane = self._lanes[key]
+                if lane:
+                    self._ready.append(key)
+                else:
+                    del self._lanes[key]
+                self.tasks.discard(asyncio.current_task())
+                self._pump()
+
+    def barrier(self, key: Optional[Hashable] = None) -> list[asyncio.Future]:
+        """Futures that resolve once the notifications queued so far have started: the notifications with
+        `key` if it is given, all of them otherwise. Wait for them with `asyncio.wait`, so that a cancelled
+        waiter doesn't cancel them.
+
+        Handlers like `textDocument/didChange` apply the change before their first `await`, so a request
+        that waits on the barrier sees the state left by the notifications that arrived before it.
+        """
+        if key is not None:
+            lanes = [self._lanes[key]] if key in self._lanes else []
+        else:
+            lanes = list(self._lanes.values())
+        futures = []
+        for lane in lanes:
+            if lane:
+                # the notifications of a lane start in order, so it's enough to wait for the last one.
+                seq = lane[-1][0]
+                future = self._started.get(seq)
+                if future is None:
+                    future = self._started[seq] = asyncio.get_running_loop().create_future()
+                futures.append(future)
+        return futures
+
+    @property
+    def has_capacity(self) -> bool:
+        return self._has_capacity.is_set()
+
+    async def wait_for_capacity(self):
+        """Returns once there are few enough queued notifications to read more messages."""
+        if self._has_capacity.is_set():
+            return
+        logger.debug(f"{self.queued} notifications queued, pausing reads")
+        try:
+            await asyncio.wait_for(self._has_capacity.wait(), BACKPRESSURE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"{self.queued} notifications still queued after {BACKPRESSURE_TIMEOUT}s, resuming reads"
+            )
+
+    def close(self):
+        """Drops the queued notifications and cancels the running handlers."""
+        self._closed = True
+        self._lanes.clear()
+        self._ready.clear()
+        self.queued = 0
+        self._has_capacity.set()
+        # the requests waiting on the dropped notifications go ahead, they fail because we are shut down.
+        for future in self._started.values():
+            if not future.done():
+                future.set_result(None)
+        self._started.clear()
+        for task in self.tasks:
+            task.cancel("shutdown")
@@ -1,12 +1,16 @@
 import asyncio
 import logging
+import multiprocessing
 import sys
 import time
+from pathlib import Path
 from typing import Literal, Optional, Union
 
 from rift.__about__ import __version__
 from rift.rpc.io_transport import AsyncStreamTransport, create_pipe_streams
+from rift.rpc.transport import Transport
 from rift.server.lsp import LspServer
+from rift.server.sessions import MAX_SESSIONS, SessionRegistry
 
 try:
     from rift.llm.gpt4all_model import Gpt4AllModel, Gpt4AllSettings
@@ -54,31 +58,44 @@ ModelType = Literal["openai", "hf", "gpt4all"]
 
 
 class CodeCapabilitiesServer:
-    server: Optional[LspServer] = None
+    sessions: SessionRegistry[LspServer]
+    """ One session per editor connection. """
 
     def __init__(
         self,
         lsp_host: LspHost = "127.0.0.1",
         lsp_port: LspPort = 7797,
+        metrics: bool = False,
+        metrics_file: Optional[str] = None,
+        max_connections: int = MAX_SESSIONS,
     ):
         self.lsp_host = lsp_host
         self.lsp_port = lsp_port
+        self.metrics = metrics or metrics_file is not None
+        self.metrics_file = metrics_file
+        self.sessions = SessionRegistry(max_connections)
+
+    def create_server(self, transport: Transport) -> LspServer:
+        server = LspServer(transport)
+        if self.metrics:
+            # the server gets the next session: `SessionRegistry.serve` opens it straight away.
+            server.enable_metrics(self.metrics_path(self.sessions.next_id))
+        return server
+
+    def metrics_path(self, session_id: int) -> Optional[Path]:
+        """Where the metrics of a session are written: `metrics_file` with the session id added to its name,
+        so that the sessions don't overwrite each other's metrics."""
+        if self.metrics_file is None:
+            return None
+        path = Path(self.metrics_file)
+        return path.with_name(f"{path.stem}-{session_id}{path.suffix}")
 
     async def on_lsp_connection(self, reader, writer):
-        transport = AsyncStreamTransport(reader, writer)
-        await self.run_lsp(transport)
+        await self.sessions.on_connection(reader, writer, self.create_server)
 
     async def run_lsp(self, transport):
-        server = LspServer(transport)
-        self.server = server
-        try:
-            logger.info("[CodeCapabilitiesServer] listening...")
-            await server.listen_forever()
-        except Exception as e:
-            logger.error("caught: " + str(e))
-            logger.info(
-                f"connection closed, but Rift is still running and accepting new connections."
-            )
+        logger.info("[CodeCapabilitiesServer] listening...")
+        await self.sessions.serve(self.create_server(transport))
 
     async def run_lsp_tcp_client_mode(self):
         assert isinstance(self.lsp_host, str)
@@ -137,6 +154,9 @@ def create_metaserver(
     port: LspPort = 7797,
     version=False,
     debug=False,
+    metrics=False,
+    metrics_file: Optional[str] = None,
+    max_connections: int = MAX_SESSIONS,
 ) -> CodeCapabilitiesServer:
     """
     Main entry point for the rift server
@@ -147,6 +167,10 @@ def create_metaserver(
         - chat_model_type: optional, defaults to same as model_type
         - version: if true, print version and exit.
         - debug: if true, print debug messages.
+        - metrics: if true, record RPC metrics, they can be requested with `morph/metrics`.
+        - metrics_file: if given, record RPC metrics and write them as JSON when a connection closes, to this file
+          with the id of the connection added to its name (eg `metrics-1.json`).
+        - max_connections: number of editors that can be connected at the same time.
     """
     if version:
         print(__version__)
@@ -166,7 +190,13 @@ def create_metaserver(
     rift_splash()
 
     logger.info(f"starting Rift server on {host}:{port}")
-    metaserver = CodeCapabilitiesServer(lsp_host=host, lsp_port=port)
+    metaserver = CodeCapabilitiesServer(
+        lsp_host=host,
+        lsp_port=port,
+        metrics=metrics,
+        metrics_file=metrics_file,
+        max_connections=max_connections,
+    )
     return metaserver
 
 
@@ -175,13 +205,20 @@ def main(
     port: LspPort = 7797,
     version=False,
     debug=False,
+    metrics=False,
+    metrics_file: Optional[str] = None,
+    max_connections: int = MAX_SESSIONS,
 ):
-    metaserver = create_metaserver(host, port, version, debug)
+    metaserver = create_metaserver(
+        host, port, version, debug, metrics, metrics_file, max_connections
+    )
     if metaserver:
         asyncio.run(metaserver.run_forever(), debug=debug)
 
 
 if __name__ == "__main__":
+    # the workers of the diff process pool start by running this module again when frozen by pyinstaller.
+    multiprocessing.freeze_support()
     import fire
 
     fire.Fire(main)
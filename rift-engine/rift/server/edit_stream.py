@@ -0,0 +1,153 @@
+"""
+Streams the contents of a region of a document to the editor while an agent is rewriting it.
+
+Agents call `EditStream.update` with the new text of the region as often as they like; this never waits
+on the editor. A background task sends at most one `workspace/applyEdit` request per frame, containing
+only the part of the region that changed since the last request, and waits for the editor to acknowledge
+it before sending the next one. Updates that arrive in the meantime are coalesced into the next frame.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+import rift.lsp.types as lsp
+from rift.util.text import common_prefix_length, common_suffix_length
+
+logger = logging.getLogger(__name__)
+
+FRAME_INTERVAL = 0.05
+"""Minimum time in seconds between two edits sent for the same region."""
+
+ACK_TIMEOUT = 2.0
+"""How long to wait for the editor to report our edit back with `textDocument/didChange`."""
+
+MAX_FAILURES = 10
+
+
+def minimal_edit(before: str, after: str) -> tuple[int, int, str]:
+    """Returns `(start, end, text)` such that `before[:start] + text + before[end:] == after`
+    with the common prefix and suffix trimmed off."""
+    p = common_prefix_length(before, after)
+    s = common_suffix_length(before, after, min(len(before), len(after)) - p)
+    return p, len(before) - s, after[p : len(after) - s]
+
+
+def offset_positions(
+    origin: lsp.Position, text: str, offsets: Iterable[int]
+) -> list[lsp.Position]:
+    """Converts offsets into `text` to document positions, given that `text` starts at `origin`."""
+    return [
+        lsp.Position(origin.line, origin.character + p.character)
+        if p.line == 0
+        else lsp.Position(origin.line + p.line, p.character)
+        for p in lsp.DocumentContext(text).offsets_to_positions(offsets)
+    ]
+
+
+class EditStream:
+    shown: str
+    """ The text of the region as last acknowledged by the editor. """
+    target: str
+    """ The text that the region should eventually have. """
+    range: lsp.Range
+    """ The range of the region in the document, as of the last acknowledged edit. """
+
+    def __init__(
+        self,
+        server,
+        uri: lsp.DocumentUri,
+        range: lsp.Range,
+        text: str,
+        change_futures: Optional[Dict[str, asyncio.Future]] = None,
+        on_flush: Optional[Callable[[str], Awaitable[None]]] = None,
+        interval: float = FRAME_INTERVAL,
+    ):
+        """
+        Args:
+            server: the `LspServer` to send the edits with.
+            range, text: the region and its current text in the document.
+            change_futures: if given, a future is registered for each edit under the new text of the region,
+                the agent's `on_change` should resolve it when the edit comes back from the editor.
+            on_flush: called with the new text of the region after each edit is acknowledged.
+        """
+        self.server = server
+        self.uri = uri
+        self.range = range
+        self.shown = text
+        self.target = text
+        self.change_futures = change_futures
+        self.on_flush = on_flush
+        self.interval = interval
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, text: str):
+        """Sets the new text of the region. Returns immediately."""
+        if self._closing:
+            raise RuntimeError("update() called after aclose()")
+        self.target = text
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self):
+        """Waits until the latest update has been sent to the editor."""
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+
+    def cancel(self):
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self.target != self.shown:
+                try:
+                    await self._flush()
+                except Exception as e:
+                    logger.error(f"failed to send edit: {e}")
+                    self._failures += 1
+                if self._failures >= MAX_FAILURES:
+                    logger.error(f"giving up on streaming edits to {self.uri}")
+                    return
+            if self.target != self.shown:
+                # updates arrived while we were sending, or the edit failed; go again next frame.
+                self._wakeup.set()
+            elif self._closing:
+                return
+            await asyncio.sleep(self.interval)
+
+    async def _flush(self):
+        target = self.target
+        start, end, text = minimal_edit(self.shown, target)
+        origin = self.range.start
+        start_pos, end_pos = offset_positions(origin, self.shown, [start, end])
+        edit = lsp.TextEdit(lsp.Range(start_pos, end_pos), text)
+        cf = None
+        if self.change_futures is not None:
+            cf = asyncio.get_running_loop().create_future()
+            self.change_futures[target] = cf
+        try:
+            response = await self.server.apply_range_edits(self.uri, [edit])
+            if not response.applied:
+                raise RuntimeError("edit was not applied")
+            self.shown = target
+            (end_of_region,) = offset_positions(origin, target, [len(target)])
+            self.range = lsp.Range(origin, end_of_region)
+            if cf is not None:
+                try:
+                    await asyncio.wait_for(cf, timeout=ACK_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.debug(f"no didChange for our edit to {self.uri}")
+        finally:
+            if cf is not None and self.change_futures.get(target) is cf:
+                del self.change_futures[target]
+        if self.on_flush is not None:
+            await self.on_flush(target)
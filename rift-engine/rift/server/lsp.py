@@ -10,10 +10,13 @@ from typing import Any, Dict, List, Optional, Tuple
 import rift.lsp.types as lsp
 from rift.agents import AGENT_REGISTRY, Agent, AgentParams, AgentRegistryResult
 from rift.llm.abstract import AbstractChatCompletionProvider, AbstractCodeCompletionProvider
-from rift.llm.create import ModelConfig, parse_type_name_path
+from rift.llm.create import ModelConfig, parse_type_name_path, release_clients
+from rift.llm.http import release_pools, use_pools
+from rift.llm.tokens import DocumentTokens, get_token_cache
 from rift.lsp import LspServer as BaseLspServer
 from rift.lsp import rpc_method
 from rift.rpc import RpcServerStatus
+from rift.util.file_diff import release_diff_pool, use_diff_pool
 from rift.util.ofdict import ofdict
 import pydantic
 
@@ -86,6 +89,10 @@ class LspServer(BaseLspServer):
     model_config: ModelConfig
     completions_model: Optional[AbstractCodeCompletionProvider] = None
     chat_model: Optional[AbstractChatCompletionProvider] = None
+    progress_deltas: bool = False
+    """ Whether the client asked for agent responses to be streamed as deltas. """
+    document_tokens: dict[lsp.DocumentUri, DocumentTokens]
+    """ Tokens of the open documents, so that building prompts from them doesn't tokenize them all again. """
 
     def __init__(self, transport):
         super().__init__(transport)
@@ -95,10 +102,66 @@ class LspServer(BaseLspServer):
             change=lsp.TextDocumentSyncKind.incremental,
         )
         self.active_agents = {}
+        self.document_tokens = {}
         self._loading_task = None
         self._chat_loading_task = None
         self.logger = logging.getLogger(f"rift")
         self.logger.addHandler(LspLogHandler(self))
+        use_pools(self)
+        use_diff_pool(self)
+
+    async def listen_forever(self, init_param=None):
+        try:
+            return await super().listen_forever(init_param)
+        finally:
+            # the editor can go away without sending a shutdown request.
+            await self._release_shared()
+
+    async def _release_shared(self):
+        # the models, the connections to the model APIs and the diff processes are shared with the other
+        # sessions, they are only stopped by the last one.
+        await release_pools(self)
+        release_diff_pool(self)
+        release_clients(self)
+        self.completions_model = self.chat_model = None
+
+    @rpc_method("shutdown")
+    async def on_shutdown(self, _: Any):
+        await self._release_shared()
+        return None
+
+    @rpc_method("initialize")
+    async def on_initialize(self, params: lsp.InitializeParams) -> lsp.InitializeResult:
+        options = params.initializationOptions
+        # see `rift.server.progress`
+        self.progress_deltas = isinstance(options, dict) and options.get("progressDeltas") is True
+        if self.progress_deltas:
+            self.capabilities.experimental = {"progressDeltas": True}
+        return await super().on_initialize(params)
+
+    @rpc_method("textDocument/didOpen")
+    def on_did_open(self, params: lsp.DidOpenTextDocumentParams):
+        super().on_did_open(params)
+        item = params.textDocument
+        self.document_tokens[item.uri] = get_token_cache().track(item)
+
+    @rpc_method("textDocument/didClose")
+    def on_did_close(self, params: lsp.DidCloseTextDocumentParams):
+        super().on_did_close(params)
+        tokens = self.document_tokens.pop(params.textDocument.uri, None)
+        if tokens is not None:
+            get_token_cache().untrack(tokens)
+
+    async def on_change(
+        self,
+        *,
+        before: lsp.TextDocumentItem,
+        after: lsp.TextDocumentItem,
+        changes: lsp.DidChangeTextDocumentParams,
+    ):
+        tokens = self.document_tokens.get(after.uri)
+        if tokens is not None:
+            tokens.update(after, before.edit_offsets(changes.contentChanges))
 
     @rpc_method("workspace/didChangeConfiguration")
     async def on_workspace_did_change_configuration(self, params: lsp.DidChangeConfigurationParams):
@@ -210,8 +273,10 @@ class LspServer(BaseLspServer):
         logger.info(f"{self} recieved model config {config}")
         for k, h in self.active_agents.items():
             asyncio.create_task(h.cancel("config changed"))
-        self.completions_model = config.create_completions()
-        self.chat_model = config.create_chat()
+        self.completions_model = config.create_completions(user=self)
+        self.chat_model = config.create_chat(user=self)
+        # the models of the previous config are unloaded, unless another session uses them too.
+        release_clients(self, keep=[self.completions_model, self.chat_model])
 
         self._loading_task = asyncio.gather(
             self.completions_model.load(),
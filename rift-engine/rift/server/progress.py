@@ -0,0 +1,70 @@
+"""
+Streaming of agent responses in progress notifications.
+
+By default every `morph/{agent}_send_progress` notification carries the whole response generated so far,
+so the bytes sent grow quadratically with the length of the response. Clients that pass
+`{"progressDeltas": true}` in their `initializationOptions` get deltas instead: the payload's `response`
+is replaced by `responseDelta = {"offset": n, "text": t}`, meaning that the new response is the first `n`
+characters of the previous one followed by `t`. The full response is still sent for the first update of
+a stream, every `FULL_RESPONSE_INTERVAL` updates so that clients can resync, and once it's done streaming.
+"""
+from typing import Any, Optional
+
+from rift.util.ofdict import todict
+from rift.util.text import common_prefix_length
+
+FULL_RESPONSE_INTERVAL = 20
+
+
+def _get(payload: Any, key: str) -> Any:
+    if isinstance(payload, dict):
+        return payload.get(key)
+    return getattr(payload, key, None)
+
+
+def is_partial_response(payload: Any) -> bool:
+    """True for the progress payloads that carry a `response` that is still being streamed.
+    Each of these supersedes the previous one, so they can be throttled."""
+    if payload is None:
+        return False
+    return _get(payload, "response") is not None and not _get(payload, "done_streaming")
+
+
+def apply_response_delta(previous: str, delta: dict) -> str:
+    """What clients do with a `responseDelta`."""
+    return previous[: delta["offset"]] + delta["text"]
+
+
+class ResponseDeltas:
+    """Encodes the responses of the progress payloads of one agent, in the order that they are sent."""
+
+    sent: Optional[str]
+    """ The response as the client has it, None at the start of a stream. """
+    count: int
+    """ Number of deltas sent since the last full response. """
+
+    def __init__(self):
+        self.sent = None
+        self.count = 0
+
+    def encode(self, payload: Any) -> Any:
+        response = _get(payload, "response")
+        if response is None:
+            return payload
+        if not is_partial_response(payload):
+            # the stream is over, start the next one with the full response.
+            self.sent = None
+            self.count = 0
+            return payload
+        if self.sent is None or self.count >= FULL_RESPONSE_INTERVAL:
+            self.sent = response
+            self.count = 0
+            return payload
+        offset = common_prefix_length(self.sent, response)
+        d = dict(payload) if isinstance(payload, dict) else todict(payload)
+        assert isinstance(d, dict)
+        del d["response"]
+        d["responseDelta"] = {"offset": offset, "text": response[offset:]}
+        self.sent = response
+        self.count += 1
+        return d
@@ -1,25 +1,44 @@
-import itertools
 import logging
-from dataclasses import dataclass
+from bisect import bisect_left, bisect_right
 from typing import Iterable, Union
 
+from rift.lsp.rope import LINE_BREAK
 from rift.lsp.types import Position, Range, TextDocumentContentChangeEvent
 from rift.util.ofdict import ofdict, todict
 
 logger = logging.getLogger(__name__)
 
 
+def _key(pos: Position) -> tuple[int, int]:
+    return (pos.line, pos.character)
+
+
 class RangeSet:
-    ranges: set[Range]
+    """A set of positions in a document, stored as a sorted list of disjoint ranges.
+
+    Ranges that overlap or touch are coalesced when they are added, so adding a range and
+    testing whether a position is in the set are both a bisection.
+    """
+
+    ranges: list[Range]
+    """ Disjoint, non-touching ranges sorted by position. """
+    _starts: list[tuple[int, int]]
+    _ends: list[tuple[int, int]]
 
     def __iter__(self):
         yield from self.ranges
 
+    def __len__(self):
+        return len(self.ranges)
+
     def __init__(self, ranges: "Iterable[Union[Range, RangeSet]]" = []):
-        self.ranges = set()
+        self.ranges = []
+        self._starts = []
+        self._ends = []
         for range in ranges:
             if isinstance(range, RangeSet):
-                self.ranges.update(range.ranges)
+                for r in range.ranges:
+                    self.add(r)
             elif isinstance(range, Range):
                 self.add(range)
             else:
@@ -35,66 +54,86 @@ class RangeSet:
 
     @property
     def is_empty(self):
-        return all(len(r) == 0 for r in self.ranges)
+        return all(r.start == r.end for r in self.ranges)
 
     def add(self, range: Range):
-        acc = range
-        ranges = set()
-        for r in self.ranges:
-            if acc.end in r or acc.start in r:
-                acc = Range.union([acc, r])
-            else:
-                ranges.add(r)
-        ranges.add(acc)
-        self.ranges = ranges
-        # logger.info("done adding")
+        start, end = _key(range.start), _key(range.end)
+        # the ranges[i:j] are exactly the ranges that overlap or touch the new range.
+        i = bisect_left(self._ends, start)
+        j = bisect_right(self._starts, end, lo=i)
+        if i < j:
+            if self._starts[i] < start:
+                start, range = self._starts[i], Range(self.ranges[i].start, range.end)
+            if self._ends[j - 1] > end:
+                end, range = self._ends[j - 1], Range(range.start, self.ranges[j - 1].end)
+        self.ranges[i:j] = [range]
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
 
     def normalize(self):
-        classes: list[Range] = []
-        for r in self.ranges:
-            if len(r) == 0:
-                continue
-            ins = []
-            outs = []
-            for c in classes:
-                if c.end in r or c.start in r:
-                    ins.append(c)
-                else:
-                    outs.append(c)
-            if len(ins) > 0:
-                x = Range.union([r] + ins)
-                outs.append(x)
-            else:
-                outs.append(r)
-            classes = outs
-        return RangeSet(classes)
+        """Returns a copy without the empty ranges."""
+        return RangeSet(r for r in self.ranges if r.start != r.end)
 
     def __contains__(self, pos: Position):
-        for range in self.ranges:
-            if pos in range:
-                return True
-        return False
+        key = _key(pos)
+        i = bisect_right(self._starts, key) - 1
+        return i >= 0 and key <= self._ends[i]
 
     def cover(self):
         if len(self.ranges) == 0:
             raise ValueError("empty range set")
-        return Range.union(self.ranges)
+        return Range(self.ranges[0].start, self.ranges[-1].end)
 
     def apply_edit(self, edit: TextDocumentContentChangeEvent):
+        """Updates the ranges for the given change to the document.
+
+        Ranges before the edit are kept, the parts of ranges that overlap the edited text are removed
+        and the ranges after the edit are moved along.
+        Positions are mapped directly, so this doesn't need the document context.
+        """
         if edit.range is None:
-            pass
-        ranges = set()
-        n = len(edit.text)
-        δ = n - len(edit.range)
-        for range in self.ranges:
-            if edit.range.end <= range.start:
-                ranges.add(range + δ)
-            elif edit.range.start >= range.end:
-                ranges.add(range)
-            else:
-                if edit.range.start in range:
-                    ranges.add(Range(range.start, edit.range.start))
-                if edit.range.end in range:
-                    ranges.add(Range(edit.range.start + n, range.end + δ))
-        self.ranges = ranges
-        # return RangeSet(ranges)
+            # the whole document got replaced.
+            self.ranges, self._starts, self._ends = [], [], []
+            return
+        e_start, e_end = edit.range.start, edit.range.end
+        s_key, e_key = _key(e_start), _key(e_end)
+        # position just after the inserted text.
+        lines = LINE_BREAK.split(edit.text)
+        last_width = len(lines[-1].encode("utf-16-le")) // 2
+        if len(lines) == 1:
+            inserted_end = Position(e_start.line, e_start.character + last_width)
+        else:
+            inserted_end = Position(e_start.line + len(lines) - 1, last_width)
+        line_delta = inserted_end.line - e_end.line
+
+        def map_pos(pos: Position) -> Position:
+            # only called on positions at or after the end of the edit.
+            if pos.line == e_end.line:
+                return Position(
+                    inserted_end.line, inserted_end.character + pos.character - e_end.character
+                )
+            return Position(pos.line + line_delta, pos.character)
+
+        # ranges[:i] end strictly before the edit, ranges[j:] start strictly after it.
+        i = bisect_left(self._ends, s_key)
+        j = bisect_right(self._starts, e_key, lo=i)
+        middle = []
+        for r in self.ranges[i:j]:
+            if _key(r.start) <= s_key:
+                middle.append(Range(r.start, e_start))
+            if _key(r.end) >= e_key:
+                middle.append(Range(inserted_end, map_pos(r.end)))
+        tail = [Range(map_pos(r.start), map_pos(r.end)) for r in self.ranges[j:]]
+        ranges = self.ranges[:i]
+        self.ranges, self._starts, self._ends = [], [], []
+        for r in ranges + middle + tail:
+            self._append(r)
+
+    def _append(self, range: Range):
+        """Adds a range that starts at or after every range in the set."""
+        if self.ranges and _key(range.start) <= self._ends[-1]:
+            self.add(range)
+            return
+        self.ranges.append(range)
+        self._starts.append(_key(range.start))
+        self._ends.append(_key(range.end))
@@ -0,0 +1,110 @@
+"""
+Registry of the editor connections to a running engine.
+
+Each connection gets its own `LspServer`, with its own documents and agents. The model clients are shared
+between the sessions, each session holds the ones it uses with `rift.llm.create.use_client` until it closes.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Generic, Iterator, Optional, TypeVar
+
+from rift.rpc.io_transport import AsyncStreamTransport
+from rift.rpc.jsonrpc import RpcServer
+from rift.rpc.transport import Transport
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSIONS = 16
+
+S = TypeVar("S", bound=RpcServer)
+
+
+class ConnectionLimitError(RuntimeError):
+    """Raised when a connection is opened while `max_sessions` sessions are already open."""
+
+
+@dataclass
+class Session(Generic[S]):
+    id: int
+    server: S
+    peer: Optional[Any] = None
+    """ The address of the editor, if connected over TCP. """
+    started: float = field(default_factory=time.monotonic)
+
+
+class SessionRegistry(Generic[S]):
+    sessions: dict[int, Session[S]]
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self._counter = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self) -> Iterator[Session[S]]:
+        return iter(list(self.sessions.values()))
+
+    def is_full(self) -> bool:
+        return len(self.sessions) >= self.max_sessions
+
+    @property
+    def next_id(self) -> int:
+        """The id of the next session to be opened."""
+        return self._counter + 1
+
+    def open(self, server: S, peer: Optional[Any] = None) -> Session[S]:
+        if self.is_full():
+            raise ConnectionLimitError(f"already serving {len(self.sessions)} connections")
+        self._counter += 1
+        session = Session(self._counter, server, peer)
+        self.sessions[session.id] = session
+        logger.info(f"session {session.id} opened ({peer or 'stdio'}), {len(self.sessions)} open")
+        return session
+
+    def close(self, session: Session[S]):
+        if self.sessions.pop(session.id, None) is not None:
+            logger.info(f"session {session.id} closed, {len(self.sessions)} open")
+
+    async def serve(self, server: S, peer: Optional[Any] = None):
+        """Runs `server` in a new session until its connection closes, and then closes the session."""
+        session = self.open(server, peer)
+        try:
+            await server.listen_forever()
+        except Exception as e:
+            logger.error("caught: " + str(e))
+            logger.info(
+                f"connection closed, but Rift is still running and accepting new connections."
+            )
+        finally:
+            self.close(session)
+
+    async def on_connection(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        create_server: Callable[[Transport], S],
+    ):
+        """Serves a TCP connection with a server made by `create_server`, or closes it straight away when
+        `max_sessions` sessions are already open. For `asyncio.start_server`."""
+        peer = writer.get_extra_info("peername")
+        if self.is_full():
+            logger.warning(
+                f"refusing connection from {peer}, already serving {len(self.sessions)} connections"
+            )
+            writer.close()
+            return
+        try:
+            await self.serve(create_server(AsyncStreamTransport(reader, writer)), peer)
+        finally:
+            writer.close()
+
+    @property
+    def latest(self) -> Optional[Session[S]]:
+        """The most recently opened session that is still open."""
+        if not self.sessions:
+            return None
+        return self.sessions[max(self.sessions)]
@@ -1,6 +1,10 @@
+import asyncio
+import multiprocessing
 import os
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
 from diff_match_patch import diff_match_patch
 
@@ -13,7 +17,7 @@ from rift.lsp import (
     TextEdit,
     WorkspaceEdit,
 )
-from rift.lsp.types import ChangeAnnotation
+from rift.lsp.types import ChangeAnnotation, ChangeAnnotationIdentifier
 
 
 @dataclass
@@ -47,33 +51,61 @@ def get_file_change(path: str, new_content: str) -> FileChange:
         return FileChange(uri=uri, old_content="", new_content=new_content, is_new_file=True)
 
 
+TEXT_EDIT_OVERHEAD = 100
+"""Rough size in bytes of the JSON for a `TextEdit` without its text, used to price hunks."""
+
+
+def hunks_from_diff(diff: List[Tuple[int, str]]) -> List[Tuple[int, int, str]]:
+    """Groups a diff into `(start, end, new_text)` replacements of the old text, where `start` and
+    `end` are offsets into the old text. Adjacent insertions and deletions form a single hunk."""
+    hunks = []
+    offset = 0
+    start: Optional[int] = None  # start of the current hunk
+    inserted: List[str] = []
+    for op, text in diff:
+        if op == 0:  # keep
+            if start is not None:
+                hunks.append((start, offset, "".join(inserted)))
+                start, inserted = None, []
+            offset += len(text)
+            continue
+        if start is None:
+            start = offset
+        if op == -1:  # remove
+            offset += len(text)
+        elif op == 1:  # add
+            inserted.append(text)
+    if start is not None:
+        hunks.append((start, offset, "".join(inserted)))
+    return hunks
+
+
 def edits_from_file_change(
     file_change: FileChange, user_confirmation: bool = False
 ) -> WorkspaceEdit:
+    """
+    Generate a WorkspaceEdit for a single FileChange.
+
+    Each changed hunk becomes its own TextEdit, unless sending the hunks would take more space than
+    sending the whole new file, in which case the whole file is replaced with a single TextEdit.
+    """
     dmp = diff_match_patch()
     diff = dmp.diff_lineMode(file_change.old_content, file_change.new_content, None)
     dmp.diff_cleanupSemantic(diff)
 
-    line = 0  # current line number
-    char = 0  # current character position within the line
-    edits = []  # list of TextEdit objects
     annotation_label = file_change.annotation_label or "rift"
 
-    new_text = ""
+    hunks = hunks_from_diff(diff)
+    hunks_size = sum(len(text) + TEXT_EDIT_OVERHEAD for _, _, text in hunks)
+    if hunks_size > len(file_change.new_content) + TEXT_EDIT_OVERHEAD:
+        hunks = [(0, len(file_change.old_content), file_change.new_content)]
 
-    for op, text in diff:
-        if op == -1:  # remove
-            pass
-        elif op == 0:  # keep
-            new_text += text
-        elif op == 1:  # add
-            new_text += text
-
-    lines = file_change.old_content.split("\n")
+    # convert all of the offsets to utf-16 positions in one pass over the old file.
+    document = lsp.DocumentContext(file_change.old_content)
+    positions = document.offsets_to_positions(x for start, end, _ in hunks for x in (start, end))
     edits = [
-        TextEdit(
-            Range.mk(0, 0, len(lines) - 1, len(lines[-1])), new_text, annotationId=annotation_label
-        )
+        TextEdit(Range(start, end), text, annotationId=annotation_label)
+        for (_, _, text), start, end in zip(hunks, positions[::2], positions[1::2])
     ]
 
     documentChanges = []
@@ -103,7 +135,14 @@ def edits_from_file_changes(
     Returns:
     WorkspaceEdit containing the aggregated documentChanges and changeAnnotations.
     """
+    return merge_workspace_edits(
+        edits_from_file_change(file_change=file_change, user_confirmation=user_confirmation)
+        for file_change in file_changes
+    )
+
 
+def merge_workspace_edits(edits: Iterable[WorkspaceEdit]) -> WorkspaceEdit:
+    """Aggregates the documentChanges and changeAnnotations of several WorkspaceEdits into one."""
     # List to store all document changes.
     documentChanges: List[
         Union[lsp.TextDocumentEdit, lsp.CreateFile, lsp.RenameFile, lsp.DeleteFile]
@@ -112,11 +151,7 @@ def edits_from_file_changes(
     # Dictionary to store all change annotations.
     changeAnnotations: Dict[ChangeAnnotationIdentifier, ChangeAnnotation] = dict()
 
-    # Iterate through each file change.
-    for file_change in file_changes:
-        # Generate a WorkspaceEdit for this file change.
-        edit = edits_from_file_change(file_change=file_change, user_confirmation=user_confirmation)
-
+    for edit in edits:
         # Add the document changes for this workspace edit to our list.
         documentChanges += edit.documentChanges
 
@@ -128,6 +163,106 @@ def edits_from_file_changes(
     return WorkspaceEdit(documentChanges=documentChanges, changeAnnotations=changeAnnotations)
 
 
+MAX_CONCURRENT_READS = 32
+"""Maximum number of files that `get_file_changes_async` reads at once."""
+
+MIN_POOL_DIFF_SIZE = 8192
+"""Files with fewer characters than this (old and new content together) are diffed on the event loop,
+since sending them to the process pool would cost more than diffing them."""
+
+MAX_DIFF_WORKERS = min(4, os.cpu_count() or 1)
+"""Number of processes of the pool that `edits_from_file_changes_async` diffs large files in."""
+
+_diff_pool: Optional[ProcessPoolExecutor] = None
+_diff_pool_users: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+
+def _get_diff_pool() -> ProcessPoolExecutor:
+    global _diff_pool
+    if _diff_pool is None:
+        # spawn rather than the platform's default: forking a process that runs an event loop and threads is
+        # unsafe, and spawn is what macOS and Windows use anyway. The entry points call
+        # `multiprocessing.freeze_support` so that the workers of a frozen binary don't start the server.
+        _diff_pool = ProcessPoolExecutor(
+            max_workers=MAX_DIFF_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _diff_pool
+
+
+def shutdown_diff_pool():
+    """Stops the processes of the diff pool, without waiting for them. The pool is started again if it is needed."""
+    global _diff_pool
+    pool, _diff_pool = _diff_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def use_diff_pool(user: Any):
+    """Registers `user` (eg an `LspServer`) as using the diff pool, it runs until the last user calls
+    `release_diff_pool`."""
+    _diff_pool_users.add(user)
+
+
+def release_diff_pool(user: Any):
+    """Stops the diff pool if `user` was the last one using it. Calling it more than once is harmless."""
+    if user not in _diff_pool_users:
+        return
+    _diff_pool_users.discard(user)
+    if not _diff_pool_users:
+        shutdown_diff_pool()
+
+
+async def get_file_changes_async(
+    files: Iterable[Tuple[str, str]], max_concurrency: int = MAX_CONCURRENT_READS
+) -> List[FileChange]:
+    """
+    Async version of `get_file_change` for many files at once.
+
+    Parameters:
+    files: `(path, new_content)` pairs.
+    max_concurrency: Maximum number of files read at the same time. The reads happen in the default
+        executor, so that they don't block the event loop.
+
+    Returns:
+    The FileChanges, in the same order as `files`.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def read(path: str, new_content: str) -> FileChange:
+        async with semaphore:
+            return await loop.run_in_executor(None, get_file_change, path, new_content)
+
+    return list(await asyncio.gather(*(read(path, content) for path, content in files)))
+
+
+async def edits_from_file_changes_async(
+    file_changes: List[FileChange],
+    user_confirmation: bool = False,
+    executor: Optional[Executor] = None,
+) -> WorkspaceEdit:
+    """
+    Async version of `edits_from_file_changes`.
+
+    diff_match_patch is pure Python, so the files are diffed in parallel in a process pool
+    (or the given `executor`) and the event loop stays responsive while they are diffed.
+    The edits are assembled into a single WorkspaceEdit, in the same order as `file_changes`.
+    """
+    loop = asyncio.get_running_loop()
+    if executor is None:
+        executor = _get_diff_pool()
+
+    async def diff(file_change: FileChange) -> WorkspaceEdit:
+        size = len(file_change.old_content) + len(file_change.new_content)
+        if size < MIN_POOL_DIFF_SIZE:
+            return edits_from_file_change(file_change, user_confirmation)
+        return await loop.run_in_executor(
+            executor, edits_from_file_change, file_change, user_confirmation
+        )
+
+    return merge_workspace_edits(await asyncio.gather(*(diff(fc) for fc in file_changes)))
+
+
 if __name__ == "__main__":
     file1 = "tests/diff/file1.txt"
     file2 = "tests/diff/file2.txt"
@@ -141,3 +276,59 @@ if __name__ == "__main__":
         file_change = get_file_change(path=dummy_path, new_content=dummy_content)
         workspace_edit = edits_from_file_change(file_change=file_change)
         print(f"\ntest_new_file: {workspace_edit}\n")
+
+    # Benchmark: a synthetic 200 file change set, diffed serially on the event loop vs with the async API.
+    # The interesting number is the longest time the event loop was blocked for.
+    import random
+    import tempfile
+    import time
+
+    async def benchmark():
+        rng = random.Random(0)
+        with tempfile.TemporaryDirectory() as root:
+            files = []
+            for i in range(200):
+                lines = [f"def f_{i}_{k}(x):\n    return x * {rng.randrange(100)}\n" for k in range(150)]
+                path = os.path.join(root, f"module_{i}.py")
+                with open(path, "w") as f:
+                    f.write("".join(lines))
+                for _ in range(5):
+                    k = rng.randrange(len(lines))
+                    lines[k] = lines[k].replace("return x", "return x + 1")
+                files.append((path, "".join(lines)))
+
+            async def run(fn):
+                max_stall = 0.0
+
+                async def ticker():
+                    nonlocal max_stall
+                    while True:
+                        t = time.perf_counter()
+                        await asyncio.sleep(0.001)
+                        max_stall = max(max_stall, time.perf_counter() - t)
+
+                tick = asyncio.create_task(ticker())
+                await asyncio.sleep(0.01)
+                t = time.perf_counter()
+                edit = await fn()
+                elapsed = time.perf_counter() - t
+                await asyncio.sleep(0.01)  # let the ticker see the last stall
+                tick.cancel()
+                return edit, elapsed, max_stall
+
+            async def serial():
+                changes = [get_file_change(path, content) for path, content in files]
+                return edits_from_file_changes(changes)
+
+            async def parallel():
+                changes = await get_file_changes_async(files)
+                return await edits_from_file_changes_async(changes)
+
+            await parallel()  # warm up the process pool
+            print(f"{'':>10} {'total (ms)':>12} {'max stall (ms)':>16}")
+            for name, fn in [("serial", serial), ("async", parallel)]:
+                edit, elapsed, stall = await run(fn)
+                assert len(edit.documentChanges) == len(files)
+                print(f"{name:>10} {elapsed * 1e3:>12.1f} {stall * 1e3:>16.1f}")
+
+    asyncio.run(benchmark())
@@ -0,0 +1,192 @@
+"""
+Incremental line diff between a fixed original text and a text that is being streamed in.
+
+Rerunning `diff_match_patch` over the whole original and the whole generated text for every new line
+costs O(n) per line and O(n²) over a generation. `StreamingLineDiff` instead keeps the alignment of the
+lines it has already seen and only has to place each new line:
+
+- a line equal to the next unmatched line of the original is matched with it;
+- otherwise, a line that occurs exactly once in the rest of the original (and isn't just whitespace or
+  punctuation) is an anchor: the original lines that were skipped over are deleted and it is matched;
+- any other line is an insertion, until the next match.
+
+Matched lines are never revisited, so placing each new line costs O(log n). The settled part of the diff is
+kept between updates and the original is addressed by offsets, so an update only copies the list of settled
+hunks and slices the strings of the last few hunks (in particular the rest of the original), rather than
+diffing or joining lines again.
+The output uses the same `(op, text)` format as `diff_match_patch`, with the original lines that
+haven't been reached yet reported as deleted.
+"""
+from bisect import bisect_left
+from typing import Optional
+
+DELETE = -1
+EQUAL = 0
+INSERT = 1
+
+Diff = list[tuple[int, str]]
+
+MIN_ANCHOR_LENGTH = 4
+"""Lines with fewer non-whitespace characters than this (eg `}` or `else:`) only match adjacent lines."""
+
+
+def _is_trivial(line: str) -> bool:
+    return len(line.strip()) < MIN_ANCHOR_LENGTH
+
+
+class StreamingLineDiff:
+    original: str
+    _lines: list[str]
+    """ Lines of the original, including their line breaks. """
+    _starts: list[int]
+    """ `_starts[k]` is the offset of line `k` in the original, followed by the length of the original. """
+    _positions: dict[str, list[int]]
+    """ For each line of the original, the sorted indices where it occurs. """
+    _i: int
+    """ Index of the first original line that hasn't been matched or deleted yet. """
+    _settled: Diff
+    """ The diff up to the last match, without the run of equal lines that ends with it. """
+    _equal: tuple[int, int]
+    """ Offsets in the original of the run of equal lines that ends with the last match. """
+    _pending: int
+    """ Offset in the generated text of the lines inserted since the last match. """
+    _text: str
+    """ The complete lines of the generated text consumed so far. """
+
+    def __init__(self, original: str):
+        self.original = original
+        self._lines = original.splitlines(keepends=True)
+        self._starts = [0]
+        self._positions = {}
+        for k, line in enumerate(self._lines):
+            self._starts.append(self._starts[-1] + len(line))
+            self._positions.setdefault(line, []).append(k)
+        self._reset()
+
+    def _reset(self):
+        self._i = 0
+        self._settled = []
+        self._equal = (0, 0)
+        self._pending = 0
+        self._text = ""
+
+    def _match(self, line: str) -> Optional[int]:
+        """Index of the original line that the given generated line should be matched with, if any."""
+        i = self._i
+        if i < len(self._lines) and self._lines[i] == line:
+            return i
+        if _is_trivial(line):
+            return None
+        positions = self._positions.get(line)
+        if positions is None:
+            return None
+        k = bisect_left(positions, i)
+        if k == len(positions) - 1:
+            # unique in the rest of the original
+            return positions[k]
+        return None
+
+    def _push(self, text: str, start: int, end: int):
+        """Places the line `text[start:end]` of the generated text."""
+        p = self._match(text[start:end])
+        if p is None:
+            return
+        starts = self._starts
+        if p > self._i or self._pending < start:
+            a, b = self._equal
+            if b > a:
+                self._settled.append((EQUAL, self.original[a:b]))
+            if p > self._i:
+                self._settled.append((DELETE, self.original[starts[self._i] : starts[p]]))
+            if self._pending < start:
+                self._settled.append((INSERT, text[self._pending : start]))
+            self._equal = (starts[p], starts[p])
+        self._equal = (self._equal[0], starts[p + 1])
+        self._i = p + 1
+        self._pending = end
+
+    def update(self, text: str) -> Diff:
+        """Returns the diff between the original and `text`.
+
+        `text` should extend the text given to the previous call; if it doesn't, the diff is recomputed
+        from scratch.
+        """
+        if not text.startswith(self._text):
+            self._reset()
+        end = text.rfind("\n") + 1
+        if end > len(self._text):
+            start = len(self._text)
+            for line in text[start:end].splitlines(keepends=True):
+                self._push(text, start, start + len(line))
+                start += len(line)
+            self._text = text[:end]
+        diff = list(self._settled)
+        a, b = self._equal
+        partial = text[end:]
+        if partial and self._pending == end and self.original.startswith(partial, b):
+            # the line being generated still agrees with the next original line.
+            b += len(partial)
+            partial = ""
+        if b > a:
+            diff.append((EQUAL, self.original[a:b]))
+        # the generated lines go above the original lines that haven't been reached yet.
+        inserted = text[self._pending : end] + partial
+        if inserted:
+            diff.append((INSERT, inserted))
+        rest = max(b, self._starts[self._i])
+        if rest < len(self.original):
+            diff.append((DELETE, self.original[rest:]))
+        return diff
+
+
+def diff_lines(original: str, text: str) -> Diff:
+    """One-shot version of `StreamingLineDiff`."""
+    return StreamingLineDiff(original).update(text)
+
+
+if __name__ == "__main__":
+    # Benchmark: stream a rewrite of a 1000 line region one line at a time, like `CodeEditAgent` does.
+    import random
+    import time
+
+    from diff_match_patch import diff_match_patch
+
+    rng = random.Random(0)
+    original_lines = [f"    value_{i} = compute({i}, {rng.randrange(100)})\n" for i in range(1000)]
+    new_lines = []
+    for line in original_lines:
+        r = rng.random()
+        if r < 0.05:
+            continue
+        elif r < 0.15:
+            new_lines.append(line.replace("compute", "compute_fast"))
+        else:
+            new_lines.append(line)
+        if rng.random() < 0.05:
+            new_lines.append("    # checked\n")
+    original = "".join(original_lines)
+    prefixes = ["".join(new_lines[:k]) for k in range(1, len(new_lines) + 1)]
+
+    # rerunning diff_match_patch is slow enough that we only time every 10th update.
+    dmp = diff_match_patch()
+    sample = prefixes[::10]
+    t = time.perf_counter()
+    for prefix in sample:
+        x, y, linearray = dmp.diff_linesToChars(original, prefix)
+        diff = dmp.diff_main(x, y, False)
+        dmp.diff_charsToLines(diff, linearray)
+        dmp.diff_cleanupSemantic(diff)
+    rerun = (time.perf_counter() - t) / len(sample)
+
+    t = time.perf_counter()
+    stream = StreamingLineDiff(original)
+    for prefix in prefixes:
+        incremental = stream.update(prefix)
+    inc = (time.perf_counter() - t) / len(prefixes)
+
+    assert "".join(text for op, text in incremental if op != DELETE) == prefixes[-1]
+    assert "".join(text for op, text in incremental if op != INSERT) == original
+    print(f"lines: {len(new_lines)}, updates: {len(prefixes)}")
+    print(f"{'':>12} {'ms/update':>10} {'ms total':>10}")
+    for name, per_update in [("dmp rerun", rerun), ("incremental", inc)]:
+        print(f"{name:>12} {per_update * 1e3:>10.3f} {per_update * len(prefixes) * 1e3:>10.1f}")
@@ -0,0 +1,96 @@
+import random
+import re
+
+import pytest
+
+import rift.lsp.types as lsp
+from rift.llm.budget import ContextBudget, context_window
+from rift.llm.openai_client import create_chat_messages, create_edit_code_messages
+from rift.llm.openai_types import Message
+from rift.llm.tokens import TokenCache
+from tests.test_tokens import WordEncoder
+
+
+class ChunkEncoder(WordEncoder):
+    """Tokens are runs of 3 characters, so the tokens of a text depend on where it starts."""
+
+    WORDS = re.compile(".{1,3}", re.DOTALL)
+
+
+def test_context_window():
+    assert context_window(None) == 4096
+    assert context_window("gpt-4") == 8192
+    assert context_window("gpt-4-0613") == 8192
+    assert context_window("gpt-4-32k-0613") == 32768
+    assert context_window("gpt-3.5-turbo-16k") == 16384
+    assert context_window("my-local-model") == 4096
+    assert ContextBudget.for_model("gpt-4", encoder=None).context_size == 8192
+
+
+def test_messages_size_counts_tokens():
+    budget = ContextBudget(encoder=TokenCache(WordEncoder()))
+    message = Message.user("hello there, general kenobi")
+    # 4 words and 3 spaces, plus the message markup.
+    assert budget.message_size(message) == 7 + 4
+    assert budget.messages_size([message, message]) == 2 * 11
+
+
+def random_text(rng: random.Random, lines: int) -> str:
+    words = ["def", "return", "x", "(", ")", ":", "foo_bar", "42", "    ", "#", "é"]
+    return "".join(" ".join(rng.choices(words, k=rng.randrange(1, 12))) + "\n" for _ in range(lines))
+
+
+@pytest.mark.parametrize("encoder", [WordEncoder, ChunkEncoder])
+def test_prompts_fit_in_budget(encoder):
+    rng = random.Random(0)
+    for context_size in [1024, 2048, 4096]:
+        budget = ContextBudget(
+            context_size=context_size,
+            completion_size=context_size // 8,
+            system_message_size=context_size // 4,
+            encoder=TokenCache(encoder()),
+        )
+        for _ in range(10):
+            document = random_text(rng, rng.choice([0, 10, 1000]))
+            documents = [
+                lsp.Document(f"file:///{i}.py", lsp.DocumentContext(random_text(rng, rng.randrange(500))))
+                for i in range(rng.randrange(3))
+            ]
+            history = [
+                Message.mk(rng.choice(["user", "assistant"]), random_text(rng, rng.randrange(20)))
+                for _ in range(rng.randrange(20))
+            ]
+            start = rng.randrange(len(document) + 1)
+            end = rng.randrange(start, min(start + 200, len(document)) + 1)
+
+            chat = create_chat_messages(
+                document, history, "what does this do?", start, documents, budget=budget
+            )
+            assert chat[0].role == "system"
+            assert budget.fits(chat)
+
+            edit = create_edit_code_messages(
+                document, start, end, goal="fix it", documents=documents, budget=budget
+            )
+            assert budget.fits(edit)
+            if len(document) > 20 * context_size:
+                # the document is truncated to what fits, not to a fraction of it.
+                assert budget.messages_size(edit) > budget.prompt_size * 0.9
+
+
+def test_truncate_messages_keeps_latest():
+    encoder = WordEncoder()
+    budget = ContextBudget(context_size=200, completion_size=50, encoder=TokenCache(encoder))
+    history = [Message.system("be nice")] + [Message.user(f"message {i}") for i in range(100)]
+    truncated = budget.truncate_messages(history)
+    assert truncated[0] is history[0]
+    assert truncated[1:] == history[len(history) - len(truncated) + 1 :]
+    assert budget.fits(truncated)
+    assert not budget.fits([history[0], history[-len(truncated)]] + truncated[1:])
+
+    # the sizes are kept on the messages.
+    chars = encoder.chars
+    assert budget.truncate_messages(history) == truncated
+    assert encoder.chars == chars
+    history[-1].content = "a new content"
+    assert budget.message_size(history[-1]) == 5 + budget.tokens_per_message
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+import rift.lsp.types as lsp
+from rift.rpc.codec import OrjsonCodec, StdlibCodec, orjson
+from rift.rpc.jsonrpc import ErrorCode, Request, Response, ResponseError
+from rift.util.ofdict import MyJsonEncoder
+
+MESSAGES = [
+    Request(method="initialized"),
+    Request(
+        method="textDocument/didChange",
+        params=lsp.DidChangeTextDocumentParams(
+            textDocument=lsp.TextDocumentIdentifier(uri="file:///a", version=3),
+            contentChanges=[
+                lsp.TextDocumentContentChangeEvent(lsp.Range.mk(0, 0, 0, 1), "é😀"),
+                lsp.TextDocumentContentChangeEvent(None, "everything"),
+            ],
+        ),
+    ),
+    Request(method="x", id=1, params={1: [lsp.Position(1, 2)], "k": (None, 1.5, True)}),
+    Response(id=1),
+    Response(id=2, error=ResponseError(ErrorCode.invalid_params, "bad")),
+]
+
+
+@pytest.mark.parametrize(
+    "codec",
+    [
+        StdlibCodec(),
+        pytest.param(
+            OrjsonCodec() if orjson else None,
+            marks=pytest.mark.skipif(orjson is None, reason="orjson not installed"),
+        ),
+    ],
+)
+def test_codec_matches_stdlib_encoder(codec):
+    for message in MESSAGES:
+        expected = json.loads(MyJsonEncoder().encode(message))
+        encoded = codec.encode(message)
+        assert isinstance(encoded, bytes)
+        assert json.loads(encoded) == expected
+        assert codec.decode(encoded) == expected
+    with pytest.raises(json.JSONDecodeError):
+        codec.decode(b"{not json")
@@ -0,0 +1,40 @@
+import gc
+
+from pydantic import SecretStr
+
+from rift.llm import create
+from rift.llm.create import ModelConfig, client_key, create_client, release_clients
+
+
+class Session:
+    pass
+
+
+def test_clients_shared_until_released():
+    a, b = Session(), Session()
+    key = SecretStr("sk-secret")
+    config = ModelConfig(chatModel="openai:gpt-4", completionsModel="openai:gpt-4", openaiKey=key)
+    chat = config.create_chat(user=a)
+    assert config.create_completions(user=b) is chat
+    assert create_client("openai:gpt-4", key) is chat
+    assert create_client("openai:gpt-4", SecretStr("sk-other")) is not chat
+    assert all("sk-secret" not in str(k) for k in create.CLIENTS.keys())
+
+    # a's config changes, b still uses the client.
+    other = ModelConfig(
+        chatModel="openai:gpt-3.5-turbo", completionsModel="openai:gpt-3.5-turbo", openaiKey=key
+    )
+    new = other.create_chat(user=a)
+    release_clients(a, keep=[new])
+    assert client_key("openai:gpt-4", key) in create._held
+    assert client_key("openai:gpt-3.5-turbo", key) in create._held
+
+    # the client is dropped once the last session using it is released.
+    release_clients(b)
+    release_clients(b)
+    assert client_key("openai:gpt-4", key) not in create._held
+    del chat
+    gc.collect()
+    assert client_key("openai:gpt-4", key) not in create.CLIENTS
+    release_clients(a)
+    assert not create._held and not create._users
@@ -0,0 +1,51 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+import rift.lsp.types as lsp
+from rift.rpc.jsonrpc import Dispatcher
+from rift.rpc.metrics import LATENCY_BUCKETS, MethodStats
+
+
+def test_dispatcher_records():
+    d = Dispatcher()
+
+    @d.register("sync")
+    def sync_method(params: lsp.Position, prefix="") -> str:
+        return f"{prefix}{params.line}:{params.character}"
+
+    @d.register()
+    async def async_method(params):
+        await asyncio.sleep(0)
+        raise ValueError("oops")
+
+    assert d.param_type("sync") is lsp.Position
+    assert d.return_type("sync") is str
+    assert d.param_type("async_method") is Any
+    record = d.record("sync")
+    assert record is not None and not record.is_async
+    assert d.record("async_method").is_async
+    assert d.record("missing") is None
+
+    async def main():
+        pos = record.decode({"line": 1, "character": 2})
+        assert await d.dispatch("sync", pos) == "1:2"
+        assert await d.with_kwargs(prefix="at ").dispatch("sync", pos) == "at 1:2"
+        with pytest.raises(ValueError):
+            await d.dispatch("async_method", None)
+
+    asyncio.run(main())
+    stats = d.stats()
+    assert stats["sync"].calls == 1 and stats["sync"].errors == 0
+    assert stats["async_method"].errors == 1
+    assert sum(stats["sync"].buckets) == 1
+
+
+def test_method_stats_quantile():
+    stats = MethodStats()
+    for t in [0.0005] * 90 + [0.3] * 10:
+        stats.record(t)
+    assert stats.quantile(0.5) == LATENCY_BUCKETS[0]
+    assert stats.quantile(0.99) == 0.3
+    assert MethodStats().quantile(0.5) == 0.0
@@ -0,0 +1,129 @@
+import bisect
+import random
+
+import rift.lsp.types as lsp
+from rift.lsp.line_index import LineIndex
+from rift.lsp.rope import Rope
+
+
+def test_rope_edits():
+    rng = random.Random(0)
+    text = "".join(rng.choice("ab\n😀") for _ in range(5000))
+    rope = Rope.of_str(text)
+    for _ in range(500):
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, min(len(text), start + rng.choice([0, 1, 3000])))
+        new = "".join(rng.choice("xy\n") for _ in range(rng.choice([0, 1, 50, 2000])))
+        text = text[:start] + new + text[end:]
+        rope = rope.replace(start, end, new)
+    assert str(rope) == text
+    assert rope.newlines == text.count("\n")
+    for offset in range(0, len(text) + 1, 97):
+        line = rope.line_of_offset(offset)
+        assert line == text.count("\n", 0, offset)
+        assert rope.line_start(line) == text.rfind("\n", 0, offset) + 1
+
+
+def test_document_apply_changes():
+    doc = lsp.TextDocumentItem(text="hello\nworld😀x\n", uri="file:///a", languageId="py", version=1)
+    after = doc.apply_changes(
+        [
+            lsp.TextDocumentContentChangeEvent(lsp.Range.mk(1, 0, 1, 5), "W"),
+            lsp.TextDocumentContentChangeEvent(lsp.Range.mk(1, 3, 1, 4), "Y"),
+        ],
+        version=2,
+    )
+    assert after.text == "hello\nW😀Y\n"
+    assert after.version == 2
+    # the original document is an untouched snapshot
+    assert doc.text == "hello\nworld😀x\n"
+    assert doc.version == 1
+    with lsp.setdoc(after):
+        assert lsp.Position.of_offset(9) == lsp.Position(1, 4)
+        assert lsp.Position(1, 3).to_offset() == 8
+
+
+def test_line_index_patched_in_place():
+    rng = random.Random(1)
+    text = "".join(rng.choice("ab\n") for _ in range(3000))
+    index = LineIndex.of_str(text)
+    for _ in range(1000):
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, min(len(text), start + rng.choice([0, 1, 300])))
+        new = "".join(rng.choice("xy\n") for _ in range(rng.choice([0, 1, 30])))
+        text = text[:start] + new + text[end:]
+        index.apply_edit(start, end, new)
+    expected = LineIndex.of_str(text)
+    assert index.line_count == expected.line_count
+    assert [index.line_start(i) for i in range(index.line_count)] == [
+        expected.line_start(i) for i in range(expected.line_count)
+    ]
+    for offset in range(0, len(text) + 1, 11):
+        assert index.line_of_offset(offset) == text.count("\n", 0, offset)
+
+
+def test_utf16_positions():
+    text = "ab😀c\n😀😀\nxyz\n"
+    doc = lsp.DocumentContext(text)
+    for offset in range(len(text) + 1):
+        start = text.rfind("\n", 0, offset) + 1
+        column = len(text[start:offset].encode("utf-16-le")) // 2
+        pos = doc.offset_to_position(offset)
+        assert pos == lsp.Position(text.count("\n", 0, offset), column)
+        assert doc.position_to_offset(pos) == offset
+    # columns inside a surrogate pair round down, columns past the end of a line clamp to the line end
+    assert doc.position_to_offset(lsp.Position(0, 3)) == 2
+    assert doc.position_to_offset(lsp.Position(1, 99)) == 8
+
+
+def test_batch_conversions():
+    rng = random.Random(2)
+    text = "".join(rng.choice("ab\n😀") for _ in range(2000))
+    doc = lsp.DocumentContext(text)
+    offsets = [rng.randint(-5, len(text) + 5) for _ in range(300)]
+    positions = doc.offsets_to_positions(offsets)
+    assert positions == [doc.offset_to_position(o) for o in offsets]
+    positions.append(lsp.Position(doc.line_count + 3, 0))
+    assert doc.positions_to_offsets(positions) == [doc.position_to_offset(p) for p in positions]
+
+
+def line_starts(text: str) -> list[int]:
+    starts = [0]
+    for line in text.splitlines(keepends=True):
+        starts.append(starts[-1] + len(line))
+    if starts[-1] == len(text) and len(starts) > 1 and not text.endswith(("\r", "\n")):
+        starts.pop()
+    return starts
+
+
+def test_carriage_return_line_breaks():
+    rng = random.Random(3)
+    text = "".join(rng.choice(["a", "\r", "\n", "\r\n", "😀"]) for _ in range(3000))
+    doc = lsp.DocumentContext(text)
+    doc.get_line_start_offset(0)
+    for _ in range(300):
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, min(len(text), start + rng.choice([0, 1, 2, 1500])))
+        new = "".join(rng.choice(["x", "\r", "\n"]) for _ in range(rng.choice([0, 1, 2, 1100])))
+        with lsp.setdoc(doc):
+            change = lsp.TextDocumentContentChangeEvent(
+                lsp.Range(lsp.Position.of_offset(start), lsp.Position.of_offset(end)), new
+            )
+        text = text[:start] + new + text[end:]
+        doc = doc.apply_change(change)
+    starts = line_starts(text)
+    fresh = lsp.DocumentContext(text)
+    assert doc.text == text and doc.line_count == fresh.line_count == len(starts)
+    for d in [doc, fresh, lsp.DocumentContext(doc.rope)]:
+        assert [d.get_line_start_offset(i) for i in range(len(starts))] == starts
+        for offset in range(0, len(text) + 1, 7):
+            assert d.get_line_of_offset(offset) == bisect.bisect_right(starts, offset) - 1
+    assert doc.line_offsets == starts[1:] + [len(text)]
+    for t in ["", "a", "a\r\n", "a\rb\n", "\n\n"]:
+        d = lsp.DocumentContext(t)
+        assert len(d.line_offsets) == d.line_count and d.line_offsets[-1] == len(t)
+    rope = doc.rope
+    assert rope.newlines == len(starts) - 1
+    assert [rope.line_start(i) for i in range(len(starts))] == starts
+    for offset in range(0, len(text) + 1, 7):
+        assert rope.line_of_offset(offset) == bisect.bisect_right(starts, offset) - 1
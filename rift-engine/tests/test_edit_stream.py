@@ -0,0 +1,51 @@
+import asyncio
+import random
+
+import rift.lsp.types as lsp
+from rift.server.edit_stream import EditStream, minimal_edit
+
+
+class FakeEditor:
+    def __init__(self, text: str):
+        self.doc = lsp.DocumentContext(text)
+        self.requests = 0
+
+    async def apply_range_edits(self, uri, edits, version=0):
+        self.requests += 1
+        await asyncio.sleep(0.01)
+        for edit in edits:
+            self.doc = self.doc.apply_change(
+                lsp.TextDocumentContentChangeEvent(edit.range, edit.newText)
+            )
+        return lsp.ApplyWorkspaceEditResponse(applied=True)
+
+
+def test_minimal_edit():
+    rng = random.Random(0)
+    for _ in range(500):
+        a = "".join(rng.choice("ab\n") for _ in range(rng.randrange(30)))
+        b = "".join(rng.choice("ab\n") for _ in range(rng.randrange(30)))
+        start, end, text = minimal_edit(a, b)
+        assert a[:start] + text + a[end:] == b
+        assert len(text) <= len(b)
+        assert not text or not (a[start:end] and a[start] == text[0])
+
+
+def test_edit_stream_coalesces():
+    async def main():
+        text = "header\nfn main() {\n    old();\n}\nfooter\n"
+        editor = FakeEditor(text)
+        region = lsp.Range.mk(1, 0, 4, 0)
+        stream = EditStream(editor, "file:///a", region, "fn main() {\n    old();\n}\n", interval=0)
+        body = ""
+        for i in range(100):
+            body += f"    new_{i}(😀);\n"
+            stream.update("fn main() {\n" + body + "}\n")
+            await asyncio.sleep(0)
+        await stream.aclose()
+        expected = "header\nfn main() {\n" + body + "}\nfooter\n"
+        assert editor.doc.text == expected
+        assert editor.requests < 100
+        assert stream.range == lsp.Range.mk(1, 0, 103, 0)
+
+    asyncio.run(main())
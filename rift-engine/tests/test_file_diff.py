@@ -0,0 +1,83 @@
+import asyncio
+
+import rift.lsp.types as lsp
+from rift.util import file_diff
+from rift.util.file_diff import (
+    FileChange,
+    edits_from_file_change,
+    edits_from_file_changes,
+    edits_from_file_changes_async,
+    get_file_change,
+    get_file_changes_async,
+)
+
+
+def apply(text: str, edits: list[lsp.TextEdit]) -> str:
+    doc = lsp.DocumentContext(text)
+    # edits refer to the original document, so apply them back to front.
+    for edit in sorted(edits, key=lambda e: e.range.start, reverse=True):
+        doc = doc.apply_change(lsp.TextDocumentContentChangeEvent(edit.range, edit.newText))
+    return doc.text
+
+
+def file_edits(old: str, new: str) -> list[lsp.TextEdit]:
+    uri = lsp.TextDocumentIdentifier(uri="file:///a.py", version=0)
+    workspace_edit = edits_from_file_change(FileChange(uri=uri, old_content=old, new_content=new))
+    (document_edit,) = workspace_edit.documentChanges
+    return document_edit.edits
+
+
+def test_edits_per_hunk():
+    old = "".join(f"line {i} 😀\n" for i in range(1000))
+    new = old.replace("line 10 😀\n", "line ten 😀\n").replace("line 500 😀\n", "")
+    edits = file_edits(old, new)
+    assert len(edits) == 2
+    assert apply(old, edits) == new
+    assert edits[0].range.start.line == 10
+
+
+def test_small_files_are_replaced_whole():
+    old = "a😀\nb\n"
+    new = "x😀\nb\ny\n"
+    (edit,) = file_edits(old, new)
+    assert edit.range == lsp.Range.mk(0, 0, 2, 0)
+    assert edit.newText == new
+
+
+def test_edits_from_file_changes_async(tmp_path):
+    files = []
+    for i in range(20):
+        path = tmp_path / f"f{i}.py"
+        old = "".join(f"x_{i}_{k} = {k}\n" for k in range(500))
+        path.write_text(old)
+        files.append((str(path), old.replace(f"x_{i}_7 ", f"y_{i}_7 ")))
+    files.append((str(tmp_path / "new.py"), "print('hi')\n"))
+
+    async def main():
+        changes = await get_file_changes_async(files)
+        assert changes == [get_file_change(path, content) for path, content in files]
+        return await edits_from_file_changes_async(changes)
+
+    edit = asyncio.run(main())
+    assert edit == edits_from_file_changes([get_file_change(p, c) for p, c in files])
+
+    pool = file_diff._diff_pool
+    assert pool is not None and pool._max_workers == file_diff.MAX_DIFF_WORKERS
+    assert pool._mp_context.get_start_method() == "spawn"
+    file_diff.shutdown_diff_pool()
+    assert file_diff._diff_pool is None
+
+    # the pool runs for as long as one of its users does.
+    a, b = User(), User()
+    file_diff.use_diff_pool(a)
+    file_diff.use_diff_pool(b)
+    assert asyncio.run(main()) == edit
+    file_diff.release_diff_pool(a)
+    file_diff.release_diff_pool(a)
+    assert file_diff._diff_pool is not None
+    file_diff.release_diff_pool(b)
+    assert file_diff._diff_pool is None
+
+
+class User:
+    pass
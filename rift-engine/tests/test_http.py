@@ -0,0 +1,106 @@
+import asyncio
+
+from aiohttp import web
+
+from rift.llm.http import ConnectionPool, HttpSettings, get_pool, release_pools, use_pools
+
+
+async def serve_echo():
+    async def echo(request: web.Request):
+        return web.json_response(
+            {"path": request.path, "authorization": request.headers.get("Authorization")}
+        )
+
+    app = web.Application()
+    app.router.add_post("/v1/echo", echo)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_pool_reuses_connections():
+    async def main():
+        runner, base_url = await serve_echo()
+        try:
+            pool = ConnectionPool(base_url, HttpSettings(limit_per_host=2, keepalive_timeout=30))
+            for i in range(10):
+                headers = {"Authorization": f"Bearer {i % 2}"}
+                async with pool.session.post("/v1/echo", json={}, headers=headers) as resp:
+                    assert await resp.json() == {"path": "/v1/echo", "authorization": f"Bearer {i % 2}"}
+            stats = pool.stats()
+            assert stats["requests"] == 10
+            assert stats["connections_created"] == 1
+            assert stats["connections_reused"] == 9
+
+            # concurrent requests open at most `limit_per_host` connections.
+            async def post():
+                async with pool.session.post("/v1/echo", json={}) as resp:
+                    await resp.read()
+
+            await asyncio.gather(*(post() for _ in range(8)))
+            assert pool.connections_created <= 2
+
+            await pool.close()
+            assert pool.closed
+            async with pool.session.post("/v1/echo", json={}) as resp:
+                assert resp.ok
+            assert not pool.closed
+            await pool.close()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(main())
+
+
+class User:
+    pass
+
+
+def test_pools_closed_by_last_user():
+    async def main():
+        runner, base_url = await serve_echo()
+        try:
+            pool = get_pool(base_url)
+            a, b = User(), User()
+            use_pools(a)
+            use_pools(b)
+            async with pool.session.post("/v1/echo", json={}) as resp:
+                assert resp.ok
+            await release_pools(a)
+            assert not pool.closed
+            await release_pools(a)
+            assert not pool.closed
+            await release_pools(b)
+            assert pool.closed
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(main())
+
+
+def test_pool_closes_the_session_of_a_previous_loop():
+    pool = ConnectionPool("http://127.0.0.1:1")
+
+    async def session():
+        session = pool.session
+        await asyncio.sleep(0.01)
+        return session
+
+    # the session of a loop that was closed is closed in the next loop.
+    first = asyncio.run(session())
+    loop = asyncio.new_event_loop()
+    second = loop.run_until_complete(session())
+    assert first.closed and not second.closed
+
+    # the session of a loop that only stopped is closed in that loop, when it runs again.
+    third = asyncio.run(session())
+    assert not second.closed and not third.closed
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert second.closed
+    loop.close()
+
+    asyncio.run(pool.close())
+    assert third.closed
@@ -0,0 +1,39 @@
+import random
+
+from rift.util.line_diff import DELETE, EQUAL, INSERT, StreamingLineDiff, diff_lines
+
+
+def check(diff, original: str, text: str):
+    assert "".join(t for op, t in diff if op != DELETE) == text
+    assert "".join(t for op, t in diff if op != INSERT) == original
+    assert all(t for _, t in diff)
+    assert all(a[0] != b[0] for a, b in zip(diff, diff[1:]))
+
+
+def test_streaming_line_diff():
+    rng = random.Random(0)
+    words = ["alpha", "beta", "gamma", "}", "", "    return x", "delta"]
+    for _ in range(200):
+        original = "".join(rng.choice(words) + "\n" for _ in range(rng.randrange(20)))
+        new = "".join(rng.choice(words) + "\n" for _ in range(rng.randrange(20)))
+        stream = StreamingLineDiff(original)
+        cut = 0
+        while cut < len(new):
+            cut = min(len(new), cut + rng.randrange(1, 12))
+            check(stream.update(new[:cut]), original, new[:cut])
+        # texts that don't extend the previous one start over
+        check(stream.update(new[: cut // 2] + "zeta"), original, new[: cut // 2] + "zeta")
+
+
+def test_unchanged_lines_are_kept():
+    original = "def f(x):\n    y = x + 1\n    return y\n"
+    new = "def f(x):\n    # add one\n    y = x + 1\n    return y\n"
+    assert diff_lines(original, new) == [
+        (EQUAL, "def f(x):\n"),
+        (INSERT, "    # add one\n"),
+        (EQUAL, "    y = x + 1\n    return y\n"),
+    ]
+    assert diff_lines(original, "def f(x):\n    y = x") == [
+        (EQUAL, "def f(x):\n    y = x"),
+        (DELETE, " + 1\n    return y\n"),
+    ]
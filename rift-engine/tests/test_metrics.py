@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+from rift.rpc.extrarpc import ExtraRpc
+from rift.rpc.jsonrpc import rpc_method
+from rift.rpc.transport import Transport, TransportClosedOK
+
+
+class QueueTransport(Transport):
+    def __init__(self, inbox: asyncio.Queue, outbox: asyncio.Queue):
+        self.inbox = inbox
+        self.outbox = outbox
+
+    async def recv(self):
+        data = await self.inbox.get()
+        if data is None:
+            raise TransportClosedOK("closed")
+        return data
+
+    async def send(self, data):
+        await self.outbox.put(data)
+
+
+class EchoServer(ExtraRpc):
+    @rpc_method("echo")
+    async def on_echo(self, params: str) -> str:
+        await asyncio.sleep(0)
+        return params
+
+
+def test_metrics(tmp_path):
+    async def main():
+        a, b = asyncio.Queue(), asyncio.Queue()
+        server = EchoServer(QueueTransport(a, b))
+        client = EchoServer(QueueTransport(b, a))
+        path = tmp_path / "metrics.json"
+        server.enable_metrics(path)
+        client.enable_metrics()
+        tasks = [asyncio.create_task(s.listen_forever()) for s in [server, client]]
+        results = await asyncio.gather(*(client.request("echo", f"hi {i}") for i in range(5)))
+        assert results == [f"hi {i}" for i in range(5)]
+        metrics = await client.request("morph/metrics", None)
+        assert metrics["incoming"]["echo"]["calls"] == 5
+        assert metrics["max_in_flight"]["their_requests"] >= 1
+        assert metrics["messages_in"] == 6
+        assert metrics["bytes_in"] > 0
+        snapshot = client.metrics_snapshot()
+        assert snapshot["outgoing"]["echo"]["calls"] == 5
+        assert snapshot["bytes_out"] == metrics["bytes_in"]
+        a.put_nowait(None)
+        b.put_nowait(None)
+        await asyncio.gather(*tasks)
+        dumped = json.loads(path.read_text())
+        assert dumped["incoming"]["morph/metrics"]["calls"] == 1
+
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum
+from pathlib import Path
+from typing import Literal, Optional, Union
+
+import pytest
+
+import rift.lsp.types as lsp
+from rift.rpc.jsonrpc import Request, Response
+from rift.util.ofdict import (
+    MyJsonEncoder,
+    OfDictError,
+    dumps_bytes,
+    ofdict,
+    ofdict_decoder,
+    todict_rec,
+)
+
+
+class Color(Enum):
+    red = "red"
+    blue = "blue"
+
+
+@dataclass
+class Leaf:
+    name: str
+    color: Color
+
+
+@dataclass
+class Node:
+    kind: Literal["leaf", "branch"]
+    children: list[Leaf]
+    weight: Union[int, str]
+    tags: dict[str, list[int]]
+    parent: Optional[str] = None
+
+CASES = [
+    (
+        lsp.DidChangeTextDocumentParams,
+        {
+            "textDocument": {"uri": "file:///a.py", "version": 3},
+            "contentChanges": [
+                {
+                    "range": {
+                        "start": {"line": 1, "character": 0},
+                        "end": {"line": 1, "character": 4},
+                    },
+                    "text": "x = 1\n",
+                },
+                {"text": "whole file\n"},
+            ],
+        },
+    ),
+    (lsp.InitializeParams, {"processId": 12, "workspaceFolders": [{"uri": "file:///", "name": "root"}]}),
+    (Request, {"method": "initialized", "params": {"a": [1, 2]}, "jsonrpc": "2.0"}),
+    (Response, {"id": 4, "error": {"code": -32601, "message": "nope"}, "jsonrpc": "2.0"}),
+    (
+        Node,
+        {
+            "kind": "branch",
+            "weight": "heavy",
+            "tags": {"a": [1, 2]},
+            "children": [{"name": "a", "color": "blue"}],
+        },
+    ),
+]
+
+
+@pytest.mark.parametrize("T, data", CASES)
+def test_decoder_matches_ofdict(T, data):
+    fast = ofdict_decoder(T)(data)
+    slow = ofdict(T, data)
+    assert type(fast) is type(slow)
+    if isinstance(fast, Exception):
+        assert vars(fast) == vars(slow)
+    else:
+        assert fast == slow
+    assert ofdict_decoder(T) is ofdict_decoder(T)
+
+
+def test_decoder_errors_have_path():
+    data = {"textDocument": {"uri": "file:///a.py", "version": 3}, "contentChanges": [{"text": 1}]}
+    with pytest.raises(OfDictError) as fast:
+        ofdict_decoder(lsp.DidChangeTextDocumentParams)(data)
+    with pytest.raises(OfDictError) as slow:
+        ofdict(lsp.DidChangeTextDocumentParams, data)
+    assert str(fast.value) == str(slow.value)
+    assert "contentChanges" in str(fast.value)
+
+
+@dataclass
+class Record:
+    first: Optional[int]
+    color: Color
+    path: Path
+    when: datetime
+    tags: set[str]
+    children: list[Leaf]
+    last: Optional[Leaf] = None
+
+
+def test_encoders_match_todict():
+    values = [
+        Record(None, Color.red, Path("/a/b"), datetime(2023, 1, 2, 3, 4), {"x"}, [Leaf("a", Color.blue)]),
+        Record(1, Color.blue, Path("c"), datetime(2023, 1, 2), set(), [], Leaf("b", Color.red)),
+        {"x": [Leaf("c", Color.red), ("tuple", 1)], 2: None},
+        Response(id=1, result=lsp.Range.mk(0, 1, 2, 3)),
+    ]
+    for value in values:
+        expected = json.dumps(todict_rec(value))
+        assert MyJsonEncoder().encode(value) == expected
+        assert json.loads(dumps_bytes(value)) == json.loads(expected)
@@ -0,0 +1,76 @@
+import asyncio
+import json
+from dataclasses import dataclass
+from typing import Optional
+
+from rift.rpc.extrarpc import ExtraRpc
+from rift.server.progress import (
+    FULL_RESPONSE_INTERVAL,
+    ResponseDeltas,
+    apply_response_delta,
+    is_partial_response,
+)
+from tests.test_metrics import QueueTransport
+
+
+@dataclass
+class ChatProgress:
+    response: Optional[str] = None
+    done_streaming: bool = False
+
+
+class Client:
+    def __init__(self):
+        self.response = ""
+        self.full = 0
+
+    def receive(self, payload: dict):
+        if "responseDelta" in payload:
+            self.response = apply_response_delta(self.response, payload["responseDelta"])
+        elif payload.get("response") is not None:
+            self.response = payload["response"]
+            self.full += 1
+
+
+def test_response_deltas():
+    deltas = ResponseDeltas()
+    client = Client()
+    response = ""
+    for i in range(100):
+        response = response + f"token{i} " if i != 50 else "rewritten "
+        payload = json.loads(json.dumps(deltas.encode({"response": response, "id": 1})))
+        assert payload["id"] == 1
+        client.receive(payload)
+        assert client.response == response
+    assert client.full == 1 + 99 // (FULL_RESPONSE_INTERVAL + 1)
+    payload = deltas.encode(ChatProgress(response + "!", done_streaming=True))
+    assert payload.response == response + "!"
+    # the next stream starts with a full response.
+    assert deltas.encode(ChatProgress("new")) == ChatProgress("new")
+    assert is_partial_response(ChatProgress("new")) and not is_partial_response(None)
+
+
+def test_deltas_survive_throttling():
+    async def main():
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        server = ExtraRpc(QueueTransport(inbox, outbox))
+        server.progress_interval = 0.005
+        deltas = ResponseDeltas()
+        response = ""
+        for i in range(200):
+            response += f"word{i} "
+            payload = ChatProgress(response)
+            await server.notify_throttled("progress", payload, encode=deltas.encode)
+            await asyncio.sleep(0.0005)
+        final = ChatProgress(response, done_streaming=True)
+        await server.notify_throttled("progress", final, final=True, encode=deltas.encode)
+        client = Client()
+        n = 0
+        while not outbox.empty():
+            message = json.loads(outbox.get_nowait())
+            client.receive(message["params"])
+            n += 1
+        assert n < 200
+        assert client.response == response
+
+    asyncio.run(main())
@@ -0,0 +1,37 @@
+import asyncio
+import json
+
+from rift.rpc.extrarpc import ExtraRpc
+from tests.test_metrics import QueueTransport
+
+
+def test_notify_throttled():
+    async def main():
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        server = ExtraRpc(QueueTransport(inbox, outbox))
+        server.progress_interval = 0.02
+
+        def sent():
+            out = []
+            while not outbox.empty():
+                out.append(json.loads(outbox.get_nowait()))
+            return out
+
+        for i in range(100):
+            await server.notify_throttled("progress", {"n": i}, key="a")
+            await server.notify_throttled("progress", {"m": i}, key="b")
+            await asyncio.sleep(0.001)
+        messages = sent()
+        assert 2 <= len(messages) < 40
+        await server.notify_throttled("progress", {"n": "done"}, key="a", final=True)
+        await asyncio.sleep(0.05)
+        messages += sent()
+        a = [m["params"]["n"] for m in messages if "n" in m["params"]]
+        b = [m["params"]["m"] for m in messages if "m" in m["params"]]
+        # the latest update before the final one is sent first, and nothing is sent after it.
+        assert a[-2:] == [99, "done"]
+        assert b[-1] == 99
+        assert a[:-1] == sorted(a[:-1]) and b == sorted(b)
+        assert server._throttle_tasks == {} and server._throttle_pending == {}
+
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from rift.rpc.jsonrpc import RequestTimeoutError, rpc_method
+from tests.test_metrics import EchoServer, QueueTransport
+
+
+class SlowServer(EchoServer):
+    cancelled = 0
+
+    @rpc_method("slow")
+    async def on_slow(self, params) -> str:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            SlowServer.cancelled += 1
+            raise
+        return "done"
+
+
+def test_request_timeout_cancels_peer():
+    async def main():
+        a, b = asyncio.Queue(), asyncio.Queue()
+        server = SlowServer(QueueTransport(a, b))
+        client = SlowServer(QueueTransport(b, a))
+        client.request_timeout = 0.05
+        tasks = [asyncio.create_task(s.listen_forever()) for s in [server, client]]
+        with pytest.raises(RequestTimeoutError) as e:
+            await client.request("slow", None)
+        assert e.value.method == "slow"
+        assert client.my_requests == {}
+        # per-call timeouts override the default.
+        assert await client.request("echo", "hi", timeout=1) == "hi"
+
+        caller = asyncio.create_task(client.request("slow", None, timeout=5))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.05)
+        assert client.my_requests == {}
+        assert server.their_requests == {}
+        assert SlowServer.cancelled == 2
+        a.put_nowait(None)
+        b.put_nowait(None)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+
+class ConfirmServer(EchoServer):
+    @rpc_method("confirm")
+    async def on_confirm(self, params) -> bool:
+        # the user takes their time.
+        await asyncio.sleep(0.2)
+        return True
+
+
+def test_interactive_requests_wait_for_the_user():
+    async def main():
+        a, b = asyncio.Queue(), asyncio.Queue()
+        server = ConfirmServer(QueueTransport(a, b))
+        client = ConfirmServer(QueueTransport(b, a))
+        client.request_timeout = 0.05
+        tasks = [asyncio.create_task(s.listen_forever()) for s in [server, client]]
+        with pytest.raises(RequestTimeoutError):
+            await client.request("confirm", None)
+        client.interactive_methods = frozenset(["confirm"])
+        assert await client.request("confirm", None) is True
+        a.put_nowait(None)
+        b.put_nowait(None)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
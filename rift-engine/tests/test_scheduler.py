@@ -0,0 +1,119 @@
+import asyncio
+import random
+import time
+
+from rift.rpc.jsonrpc import rpc_method
+from rift.rpc.scheduler import BACKPRESSURE_TIMEOUT, NotificationScheduler
+from tests.test_metrics import EchoServer, QueueTransport
+
+
+def test_scheduler_orders_and_bounds():
+    async def main():
+        rng = random.Random(0)
+        running = 0
+        max_running = 0
+        seen: dict[str, list[int]] = {}
+
+        async def run(n):
+            nonlocal running, max_running
+            key, i = n
+            running += 1
+            max_running = max(max_running, running)
+            try:
+                await asyncio.sleep(rng.random() * 0.002)
+                seen.setdefault(key, []).append(i)
+            finally:
+                running -= 1
+
+        scheduler = NotificationScheduler(run, max_concurrency=4, high_watermark=20)
+        paused = False
+        for i in range(200):
+            key = rng.choice(["a", "b", "c", None])
+            scheduler.submit((key or f"x{i}", i), key)
+            if scheduler.queued > 20:
+                paused = True
+                await scheduler.wait_for_capacity()
+                assert scheduler.queued <= scheduler.low_watermark
+        while scheduler.tasks or scheduler.queued:
+            await asyncio.sleep(0.001)
+        assert paused
+        assert max_running <= 4
+        for key in "abc":
+            assert seen[key] == sorted(seen[key])
+        assert sum(len(v) for v in seen.values()) == 200
+
+    asyncio.run(main())
+
+
+class OrderedServer(EchoServer):
+    max_concurrent_notifications = 1
+    notification_high_watermark = 2
+
+    def __init__(self, transport):
+        super().__init__(transport)
+        self.values: dict[str, int] = {}
+        self.answers: list[str] = []
+
+    def notification_key(self, req):
+        return req.params.get("key") if isinstance(req.params, dict) else None
+
+    @rpc_method("slow")
+    async def on_slow(self, params: dict):
+        await asyncio.sleep(0.05)
+
+    @rpc_method("set")
+    def on_set(self, params: dict):
+        self.values[params["key"]] = params["value"]
+
+    @rpc_method("get")
+    def on_get(self, params: dict) -> int:
+        return self.values[params["key"]]
+
+    @rpc_method("values")
+    def on_values(self, params) -> dict:
+        return dict(self.values)
+
+    @rpc_method("ask")
+    async def on_ask(self, params: dict):
+        self.answers.append(await self.request("echo", params["value"]))
+
+
+def test_requests_wait_for_earlier_notifications():
+    async def main():
+        a, b = asyncio.Queue(), asyncio.Queue()
+        server = OrderedServer(QueueTransport(a, b))
+        client = EchoServer(QueueTransport(b, a))
+        tasks = [asyncio.create_task(s.listen_forever()) for s in [server, client]]
+        await client.notify("slow", {"key": "doc"})
+        await client.notify("set", {"key": "doc", "value": 1})
+        assert await client.request("get", {"key": "doc"}) == 1
+        # requests without a key wait for every lane.
+        await client.notify("slow", {"key": "other"})
+        await client.notify("set", {"key": "other", "value": 2})
+        assert await client.request("values", None) == {"doc": 1, "other": 2}
+        a.put_nowait(None)
+        b.put_nowait(None)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+
+def test_backpressure_still_routes_responses():
+    async def main():
+        a, b = asyncio.Queue(), asyncio.Queue()
+        server = OrderedServer(QueueTransport(a, b))
+        client = EchoServer(QueueTransport(b, a))
+        tasks = [asyncio.create_task(s.listen_forever()) for s in [server, client]]
+        start = time.monotonic()
+        for i in range(4):
+            await client.notify("ask", {"value": str(i)})
+        # the queue is over the high watermark, but the responses to the running handlers are still read.
+        while len(server.answers) < 4:
+            await asyncio.sleep(0.01)
+        assert server.answers == ["0", "1", "2", "3"]
+        assert time.monotonic() - start < BACKPRESSURE_TIMEOUT / 2
+        a.put_nowait(None)
+        b.put_nowait(None)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+import random
+
+import rift.lsp.types as lsp
+from rift.lsp.rope import LINE_BREAK
+from rift.server.selection import RangeSet
+
+
+class NaiveRangeSet:
+    """The previous set-based implementation, used as a reference."""
+
+    def __init__(self):
+        self.ranges = set()
+
+    def add(self, range: lsp.Range):
+        acc = range
+        ranges = set()
+        for r in self.ranges:
+            if acc.end in r or acc.start in r:
+                acc = lsp.Range.union([acc, r])
+            else:
+                ranges.add(r)
+        ranges.add(acc)
+        self.ranges = ranges
+
+    def __contains__(self, pos: lsp.Position):
+        return any(pos in r for r in self.ranges)
+
+
+def random_range(rng: random.Random) -> lsp.Range:
+    a = lsp.Position(rng.randrange(20), rng.randrange(10))
+    b = lsp.Position(rng.randrange(20), rng.randrange(10))
+    return lsp.Range(min(a, b), max(a, b))
+
+
+def test_rangeset_matches_naive():
+    rng = random.Random(0)
+    grid = [lsp.Position(l, c) for l in range(21) for c in range(11)]
+    for _ in range(200):
+        fast, naive = RangeSet(), NaiveRangeSet()
+        for _ in range(rng.randrange(1, 15)):
+            r = random_range(rng)
+            fast.add(r)
+            naive.add(r)
+        assert [p in fast for p in grid] == [p in naive for p in grid]
+        ranges = list(fast)
+        assert all(a.end < b.start for a, b in zip(ranges, ranges[1:]))
+        assert fast.cover() == lsp.Range.union(naive.ranges)
+
+
+def random_edit(rng: random.Random, text: str, pieces: list[str]) -> tuple[int, int, str]:
+    """An edit that doesn't cut a "\r\n" in two or make one at its ends."""
+    breaks = lambda t: len(LINE_BREAK.findall(t))
+    while True:
+        a, b = sorted(rng.randrange(len(text) + 1) for _ in range(2))
+        new = "".join(rng.choice(pieces) for _ in range(rng.randrange(5)))
+        before, removed, after = text[:a], text[a:b], text[b:]
+        if breaks(text) == breaks(before) + breaks(removed) + breaks(after) and breaks(
+            before + new + after
+        ) == breaks(before) + breaks(new) + breaks(after):
+            return a, b, new
+
+
+def check_apply_edit(rng: random.Random, pieces: list[str]):
+    text = "".join(rng.choice(pieces) for _ in range(200))
+    doc = lsp.DocumentContext(text)
+    n = len(text)
+    spans = []
+    for _ in range(rng.randrange(1, 8)):
+        a, b = sorted(rng.randrange(n + 1) for _ in range(2))
+        spans.append((a, b))
+    ranges = RangeSet(lsp.Range(*doc.offsets_to_positions([a, b])) for a, b in spans)
+    a, b, new = random_edit(rng, text, pieces)
+    edit_range = lsp.Range(*doc.offsets_to_positions([a, b]))
+    change = lsp.TextDocumentContentChangeEvent(edit_range, new)
+    ranges.apply_edit(change)
+    after = doc.apply_change(change)
+
+    # every character that was in a range and wasn't replaced is still in a range.
+    def mapped(offset: int) -> int:
+        return offset if offset <= a else offset + len(new) - (b - a)
+
+    covered = {i for s, e in spans for i in range(s, e + 1) if i <= a or i >= b}
+    for i in covered:
+        assert after.offset_to_position(mapped(i)) in ranges
+    # and none of the inserted text is.
+    for r in ranges:
+        s, e = after.positions_to_offsets([r.start, r.end])
+        assert all(i <= a or i >= a + len(new) for i in range(s + 1, e))
+
+
+def test_rangeset_apply_edit():
+    rng = random.Random(1)
+    for _ in range(200):
+        check_apply_edit(rng, ["a", "b", "\n", "😀"])
+
+
+def test_rangeset_apply_edit_crlf():
+    rng = random.Random(2)
+    for _ in range(200):
+        check_apply_edit(rng, ["a", "\r\n", "\r", "\n", "😀"])
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+import rift.lsp.types as lsp
+from rift.lsp import LspServer
+from rift.rpc.io_transport import AsyncStreamTransport
+from rift.rpc.jsonrpc import InitializationMode, RpcServer, RpcServerStatus
+from rift.server.sessions import ConnectionLimitError, SessionRegistry
+
+
+def test_session_registry():
+    registry = SessionRegistry(max_sessions=2)
+    a = registry.open("a")
+    b = registry.open("b", peer=("127.0.0.1", 1234))
+    assert registry.latest is b and registry.is_full()
+    with pytest.raises(ConnectionLimitError):
+        registry.open("c")
+    registry.close(b)
+    assert registry.latest is a
+    registry.close(a)
+    registry.close(a)
+    assert registry.latest is None and len(registry) == 0
+
+
+N_CLIENTS = 12
+N_CHANGES = 20
+
+
+async def fake_client(port: int, i: int):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    client = RpcServer(AsyncStreamTransport(reader, writer), init_mode=InitializationMode.SendInit)
+    task = asyncio.create_task(client.listen_forever(lsp.InitializeParams()))
+    while client.status != RpcServerStatus.running:
+        await asyncio.sleep(0.01)
+    uri = f"file:///client_{i}.py"
+    text = f"# client {i}\n"
+    item = lsp.TextDocumentItem(uri=uri, languageId="python", version=0, text=text)
+    await client.notify("textDocument/didOpen", lsp.DidOpenTextDocumentParams(textDocument=item))
+    for version in range(1, N_CHANGES + 1):
+        line = f"x_{version} = {i}\n"
+        change = lsp.TextDocumentContentChangeEvent(lsp.Range.mk(version, 0, version, 0), line)
+        await client.notify(
+            "textDocument/didChange",
+            lsp.DidChangeTextDocumentParams(
+                textDocument=lsp.TextDocumentIdentifier(uri=uri, version=version),
+                contentChanges=[change],
+            ),
+        )
+        text += line
+    return client, task, writer, uri, text
+
+
+def test_concurrent_sessions():
+    async def main():
+        # the same registry as `CodeCapabilitiesServer.sessions`, serving the base `LspServer`.
+        sessions = SessionRegistry(max_sessions=N_CLIENTS)
+        tcp = await asyncio.start_server(
+            lambda reader, writer: sessions.on_connection(reader, writer, LspServer),
+            "127.0.0.1",
+            0,
+        )
+        port = tcp.sockets[0].getsockname()[1]
+        clients = await asyncio.gather(*(fake_client(port, i) for i in range(N_CLIENTS)))
+        expected = {uri: text for _, _, _, uri, text in clients}
+        for _ in range(200):
+            docs = [s.server.documents for s in sessions]
+            if len(docs) == N_CLIENTS and all(
+                len(d) == 1 and all(doc.text == expected[uri] for uri, doc in d.items())
+                for d in docs
+            ):
+                break
+            await asyncio.sleep(0.01)
+        else:
+            pytest.fail("documents weren't synced to their own sessions")
+
+        # one more editor is refused.
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        assert await reader.read() == b""
+        writer.close()
+
+        for client, task, writer, _, _ in clients:
+            writer.close()
+            task.cancel()
+        for _ in range(200):
+            if len(sessions) == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert len(sessions) == 0
+        tcp.close()
+
+    asyncio.run(main())
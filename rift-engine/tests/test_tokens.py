@@ -0,0 +1,122 @@
+import random
+import re
+
+import rift.lsp.types as lsp
+from rift.llm.tokens import BLOCK_SIZE, ENTRY_OVERHEAD, TokenCache, get_token_cache
+
+
+class CountingEncoder:
+    """One token per character."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text, **kwargs):
+        self.calls += 1
+        return [ord(c) for c in text]
+
+    def decode(self, tokens):
+        return "".join(map(chr, tokens))
+
+
+def test_token_cache_hits():
+    encoder = CountingEncoder()
+    cache = TokenCache(encoder)
+    assert cache.encode("hello") == [ord(c) for c in "hello"]
+    assert cache.count("hello") == 5
+    assert cache.decode(cache.encode("hello")) == "hello"
+    assert encoder.calls == 1
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+    # a different text with the same length is a different entry.
+    assert cache.count("world") == 5 and encoder.calls == 2
+
+
+def test_token_cache_bounded_by_bytes():
+    encoder = CountingEncoder()
+    entry = 4 * 100 + ENTRY_OVERHEAD
+    cache = TokenCache(encoder, max_bytes=3 * entry)
+    texts = [str(i) * 100 for i in range(5)]
+    for text in texts[:3]:
+        cache.count(text)
+    cache.count(texts[0])  # texts[0] is now the most recently used.
+    cache.count(texts[3])
+    cache.count(texts[4])
+    assert len(cache) == 3 and cache.size <= cache.max_bytes
+    assert cache.evictions == 2
+    calls = encoder.calls
+    cache.count(texts[0])
+    assert encoder.calls == calls
+    cache.count(texts[1])
+    assert encoder.calls == calls + 1
+
+    # texts larger than the whole cache aren't kept.
+    cache.count("x" * 10_000)
+    assert cache.size <= cache.max_bytes
+
+
+def test_shared_cache_with_custom_encoder():
+    made = []
+
+    def create_encoder():
+        made.append(CountingEncoder())
+        return made[-1]
+
+    cache = get_token_cache("test:counting", create_encoder)
+    assert get_token_cache("test:counting", create_encoder) is cache
+    assert cache.encoder is made[0] and len(made) == 1
+    assert cache.count("abc") == 3
+
+
+class WordEncoder:
+    """Tokens are words and runs of whitespace, cut like cl100k_base cuts around newlines."""
+
+    WORDS = re.compile(r"\S+|\s*\n+|\s+(?!\S)|\s+")
+
+    def __init__(self):
+        self.vocab = {}
+        self.chars = 0
+
+    def encode(self, text, **kwargs):
+        self.chars += len(text)
+        return [self.vocab.setdefault(w, len(self.vocab)) for w in self.WORDS.findall(text)]
+
+    def decode(self, tokens):
+        words = {i: w for w, i in self.vocab.items()}
+        return "".join(words[t] for t in tokens)
+
+
+def test_document_tokens_follow_edits():
+    rng = random.Random(0)
+    encoder = WordEncoder()
+    cache = TokenCache(encoder)
+    text = "".join(f"def f_{i}(x):\n    return x + {i}\n\n" for i in range(2000))
+    doc = lsp.DocumentContext(text)
+    tracked = cache.track(doc)
+    assert cache.encode(doc.text) == encoder.encode(doc.text)
+    for step in range(100):
+        start = rng.randrange(len(doc.text))
+        end = min(start + rng.choice([0, 0, 1, 5, 40]), len(doc.text))
+        insert = rng.choice(["", "x", "\n", "  ", "\n\n", "y = 1\n    "])
+        with lsp.setdoc(doc):
+            change = lsp.TextDocumentContentChangeEvent(
+                lsp.Range(lsp.Position.of_offset(start), lsp.Position.of_offset(end)), insert
+            )
+        after = doc.apply_changes([change])
+        tracked.update(after, doc.edit_offsets([change]))
+        doc = after
+        chars = encoder.chars
+        count = cache.count(doc.text)
+        # only the blocks around the edit are tokenized again.
+        assert encoder.chars - chars <= 3 * BLOCK_SIZE
+        if step % 10 == 0:
+            assert count == len(encoder.encode(doc.text))
+    assert cache.encode(doc.text) == encoder.encode(doc.text)
+    cursor = len(doc.text) // 3
+    before, after = cache.encode_parts(doc.text, [cursor])
+    assert encoder.decode(before) == doc.text[:cursor] and encoder.decode(after) == doc.text[cursor:]
+    assert cache.stats()["misses"] == 0
+
+    # a closed document isn't used anymore.
+    cache.untrack(tracked)
+    cache.count(doc.text)
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+from rift.rpc.io_transport import AsyncStreamTransport
+from rift.rpc.transport import TransportClosedOK
+
+
+class FakeWriter:
+    def __init__(self, reader: asyncio.StreamReader):
+        self.reader = reader
+        self.writes = []
+
+    def write(self, data: bytes):
+        self.writes.append(data)
+        self.reader.feed_data(data)
+
+    async def drain(self):
+        await asyncio.sleep(0)
+
+
+def test_batched_round_trip():
+    async def main():
+        reader = asyncio.StreamReader()
+        writer = FakeWriter(reader)
+        transport = AsyncStreamTransport(reader, writer)
+        messages = [f'{{"n": {i}, "s": "é😀"}}'.encode() for i in range(100)]
+        await asyncio.gather(*(transport.send(m) for m in messages))
+        assert len(writer.writes) == 1
+        assert transport.counters.messages_sent == 100
+        assert transport.counters.writes == 1
+        received = [await transport.recv() for _ in messages]
+        assert received == messages
+        assert transport.counters.bytes_received == transport.counters.bytes_sent
+        reader.feed_eof()
+        with pytest.raises(TransportClosedOK):
+            await transport.recv()
+
+    asyncio.run(main())
+
+
+def test_newline_headers():
+    async def main():
+        reader = asyncio.StreamReader()
+        transport = AsyncStreamTransport(reader, FakeWriter(reader))
+        reader.feed_data(b'Content-Length: 2\nContent-Type: application/json\n\n{}')
+        reader.feed_data(b"Content-Length:3\r\n\r\n[1]")
+        assert await transport.recv() == b"{}"
+        assert await transport.recv() == b"[1]"
+
+    asyncio.run(main())
+
+
+class StuckWriter(FakeWriter):
+    async def drain(self):
+        await asyncio.Event().wait()
+
+
+def test_cancelled_flush_releases_senders():
+    async def main():
+        reader = asyncio.StreamReader()
+        transport = AsyncStreamTransport(reader, StuckWriter(reader))
+        first = asyncio.create_task(transport.send(b"1"))
+        await asyncio.sleep(0.01)
+        # queued while the first batch is draining.
+        second = asyncio.create_task(transport.send(b"2"))
+        await asyncio.sleep(0.01)
+        transport._flusher.cancel()
+        done, _ = await asyncio.wait([first, second], timeout=1)
+        assert len(done) == 2 and all(t.cancelled() for t in done)
+
+    asyncio.run(main())